@@ -1,36 +1,57 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form, Query
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form, Query, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 import os
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
-from core.database import get_db
+from core.database import get_db, get_pool_stats
 from core.models import User, ApiUsageStats
 from core.statistics_service import StatisticsService
 import core.schemas as schemas
 import core.models as models
 from core.dependencies import get_current_admin, get_current_user
+from core.pagination import paginate, InvalidCursorError, MAX_PAGE_SIZE
 import core.crud as crud
 import core.auth as auth
+from services.ai_service import context_cache, document_upload_cache, get_ai_service_stats
+from services.file_cache import content_hash
+from services.secure_folder_index import secure_folder_index
+from services.mapped_files import mapped_files
+from services.cv_profiles import cv_profile_store
+from services.analysis_jobs import analysis_jobs
+from services.upload_service import spool_upload
+from config.settings import SECURE_CV_FOLDER_PATH
 
 router = APIRouter()
 
+def _set_next_cursor(response: Response, next_cursor: Optional[str]):
+    """User lists keep their plain-list body, so the next page cursor travels in a header"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
 # ============================================================================
 # USER MANAGEMENT
 # ============================================================================
 
 @router.get("/admin/users")
 async def get_all_users_admin(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_admin: User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
-    """Get all users with statistics (Admin only)"""
+    """Get all users with statistics (Admin only).
+    
+    The cursor of the next page is returned in the X-Next-Cursor header; ``skip`` cannot be
+    combined with a cursor.
+    """
     try:
         # Get users directly with all fields including last_login
-        users = db.query(User).order_by(User.created_at.desc()).offset(skip).limit(limit).all()
+        users, next_cursor = paginate(db.query(User), [User.created_at, User.id], limit, cursor, descending=True, skip=skip)
+        _set_next_cursor(response, next_cursor)
         
         # Convert to response format with proper datetime handling
         users_data = []
@@ -49,6 +70,8 @@ async def get_all_users_admin(
             users_data.append(user_dict)
         
         return users_data
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -60,6 +83,7 @@ async def get_platform_stats(
     """Get platform statistics (Admin only)"""
     try:
         stats = crud.get_platform_stats(db)
+        stats["database_pool"] = get_pool_stats()
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,14 +178,19 @@ async def reset_user_password(
 
 @router.get("/admin/users/search")
 async def search_users(
+    response: Response,
     q: str = "",
     role: str = None,
     status: str = None,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_admin: User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
-    """Search and filter users (Admin only)"""
+    """Search and filter users, newest first (Admin only).
+    
+    The cursor of the next page is returned in the X-Next-Cursor header.
+    """
     try:
         query = db.query(User)
         
@@ -182,7 +211,8 @@ async def search_users(
             is_active = status == "active"
             query = query.filter(User.is_active == is_active)
         
-        users = query.limit(limit).all()
+        users, next_cursor = paginate(query, [User.created_at, User.id], limit, cursor, descending=True)
+        _set_next_cursor(response, next_cursor)
         
         # Convert to response format
         users_data = []
@@ -199,6 +229,8 @@ async def search_users(
             users_data.append(user_dict)
         
         return users_data
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -280,28 +312,24 @@ async def get_secure_folders(
 ):
     """Get secure folders and their contents (Admin only)"""
     try:
-        SECURE_FOLDER_PATH = os.getenv("SECURE_CV_FOLDER_PATH", "C:/secure/cvs")
-        
         # Create directory if it doesn't exist
-        if not os.path.exists(SECURE_FOLDER_PATH):
-            os.makedirs(SECURE_FOLDER_PATH, exist_ok=True)
+        if not os.path.exists(SECURE_CV_FOLDER_PATH):
+            os.makedirs(SECURE_CV_FOLDER_PATH, exist_ok=True)
         
-        # Get all PDF files in the folder
+        # List the PDF files from the folder index
+        await secure_folder_index.refresh()
         files = []
-        for filename in os.listdir(SECURE_FOLDER_PATH):
-            if filename.lower().endswith('.pdf'):
-                file_path = os.path.join(SECURE_FOLDER_PATH, filename)
-                file_stat = os.stat(file_path)
-                files.append({
-                    "filename": filename,
-                    "size": file_stat.st_size,
-                    "uploaded_at": file_stat.st_mtime
-                })
+        for document in secure_folder_index.list_documents():
+            files.append({
+                "filename": document['filename'],
+                "size": document['size'],
+                "uploaded_at": document['mtime_ns'] / 1e9
+            })
         
         # Return folder structure
         return [{
             "name": "CVs",
-            "path": SECURE_FOLDER_PATH,
+            "path": SECURE_CV_FOLDER_PATH,
             "files": files
         }]
     except Exception as e:
@@ -316,11 +344,9 @@ async def upload_to_secure_folder(
 ):
     """Upload files to secure folder (Admin only)"""
     try:
-        SECURE_FOLDER_PATH = os.getenv("SECURE_CV_FOLDER_PATH", "C:/secure/cvs")
-        
         # Create directory if it doesn't exist
-        if not os.path.exists(SECURE_FOLDER_PATH):
-            os.makedirs(SECURE_FOLDER_PATH, exist_ok=True)
+        if not os.path.exists(SECURE_CV_FOLDER_PATH):
+            os.makedirs(SECURE_CV_FOLDER_PATH, exist_ok=True)
         
         uploaded_files = []
         
@@ -333,7 +359,7 @@ async def upload_to_secure_folder(
                 )
             
             # Save file to secure folder
-            file_path = os.path.join(SECURE_FOLDER_PATH, file.filename)
+            file_path = os.path.join(SECURE_CV_FOLDER_PATH, file.filename)
             
             # Check if file already exists
             if os.path.exists(file_path):
@@ -342,14 +368,21 @@ async def upload_to_secure_folder(
                     detail=f"File {file.filename} already exists in the secure folder"
                 )
             
-            # Write file
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
+            # Stream to a spool file next to the destination, then move it into place in one step
+            upload = await spool_upload(file, directory=SECURE_CV_FOLDER_PATH)
+            try:
+                # Forget any mapping left over from a deleted file of the same name before replacing it
+                mapped_files.invalidate(file_path)
+                os.replace(upload.path, file_path)
+            finally:
+                upload.discard()
+            
+            # Index the new CV right away so the next analysis does not have to
+            await secure_folder_index.index_file(file.filename)
             
             uploaded_files.append({
                 "filename": file.filename,
-                "size": len(content),
+                "size": upload.size,
                 "path": file_path
             })
         
@@ -357,6 +390,8 @@ async def upload_to_secure_folder(
             "message": f"Successfully uploaded {len(uploaded_files)} file(s)",
             "files": uploaded_files
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload files: {str(e)}")
 
@@ -484,19 +519,28 @@ async def delete_from_secure_folder(
         if not filename:
             raise HTTPException(status_code=400, detail="Filename is required")
         
-        # Get the secure folder path from environment
-        SECURE_FOLDER_PATH = os.getenv("SECURE_CV_FOLDER_PATH", "C:/secure/cvs")
-        
-        # Construct the file path (all files are stored directly in SECURE_FOLDER_PATH)
-        file_path = os.path.join(SECURE_FOLDER_PATH, filename)
+        # Construct the file path (all files are stored directly in SECURE_CV_FOLDER_PATH)
+        file_path = os.path.join(SECURE_CV_FOLDER_PATH, filename)
         
         # Check if file exists
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail=f"File {filename} not found in secure folder")
         
-        # Delete the file
+        # Look the file up in the index (indexing it if it was added outside the admin API)
+        document = secure_folder_index.get_document(filename) or await secure_folder_index.index_file(filename)
+        
+        # Drop the file from the folder index (unmapping it) before deleting it; Windows cannot delete a mapped file
+        secure_folder_index.remove_file(filename)
         os.remove(file_path)
         
+        # Drop cached Gemini contexts and uploads that include this file
+        if document:
+            await context_cache.invalidate_document(document['sha256'])
+            document_upload_cache.forget(document['sha256'])
+            document_text = secure_folder_index.document_text(document)
+            if document_text:
+                await context_cache.invalidate_document(content_hash(document_text))
+        
         return {
             "message": f"File {filename} deleted successfully",
             "filename": filename,
@@ -637,6 +681,7 @@ async def get_platform_overview(
                 "rate_limited_requests_24h": rate_limit_data["total_events"]
             },
             "recent_errors": recent_errors,
+            "database_pool": get_pool_stats(),
             "top_endpoints_24h": last_24h_stats["top_endpoints"][:5],
             "top_users_24h": last_24h_stats["top_users"][:5],
             "rate_limit_summary": {
@@ -650,6 +695,23 @@ async def get_platform_overview(
             detail=f"Failed to retrieve platform overview: {str(e)}"
         )
 
+@router.get("/admin/statistics/ai-service")
+async def get_ai_service_statistics(
+    current_user: models.User = Depends(get_current_admin)
+) -> Dict[str, Any]:
+    """Get AI service cache statistics (hits, misses, evictions)."""
+    try:
+        stats = get_ai_service_stats()
+        stats["secure_folder_files"] = mapped_files.get_stats()
+        stats["cv_profiles"] = cv_profile_store.get_stats()
+        stats["analysis_jobs"] = analysis_jobs.get_stats()
+        return stats
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Failed to retrieve AI service statistics: {str(e)}"
+        )
+
 @router.post("/admin/statistics/generate-sample-data")
 async def generate_sample_statistics_data(
     current_user: models.User = Depends(get_current_admin),
@@ -1,19 +1,51 @@
-from fastapi import APIRouter, Form, HTTPException, Depends, Request
+from fastapi import APIRouter, Form, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 import uuid
 
-from core.database import get_db
-from core.models import User, ChatSession, Message
+from core.database import get_db, SessionLocal
+from core.models import User
 from core.schemas import MessageCreate
 import core.schemas as schemas
 from core.dependencies import get_current_user
-from services.ai_service import chat_with_document_context, chat_without_context, document_sessions
+from core.pagination import InvalidCursorError, MAX_PAGE_SIZE
+from core.streaming import sse_event, start_stream, SSE_HEADERS
+from services.ai_service import chat_with_document_context, chat_without_context, stream_chat_with_document_context, stream_chat_without_context, document_sessions, get_document_session
+from services.document_service import delete_document_session, delete_user_document_sessions
 from rate_limiting.rate_limiter import check_rate_limit, increment_rate_limit
 import core.crud as crud
 
 router = APIRouter()
 
+def _get_or_create_chat_session(db: Session, session_id: Optional[str], user_id: int) -> tuple:
+    """Return (session_id, db_session), staging a new session in the current unit of work if needed"""
+    if session_id:
+        db_session = crud.get_chat_session(db, session_id)
+        if not db_session or db_session.user_id != user_id:
+            # Create new session if not found or doesn't belong to user
+            session_id = str(uuid.uuid4())
+            print(f"📝 Creating new session (existing invalid): {session_id}")
+            db_session = crud.add_chat_session(db, session_id, user_id)
+    else:
+        # Create new session
+        session_id = str(uuid.uuid4())
+        print(f"📝 Creating new session: {session_id}")
+        db_session = crud.add_chat_session(db, session_id, user_id)
+    
+    return session_id, db_session
+
+def _require_document_session(db_session) -> bool:
+    """Whether the chat session answers from analyzed documents; 404 once its document session was evicted"""
+    if not db_session.has_document_context:
+        return False
+    get_document_session(db_session.session_id)
+    return True
+
+def _session_title(message: str) -> str:
+    """Build a session title from the first user message"""
+    return message[:50] + "..." if len(message) > 50 else message
+
 @router.post("/chat")
 async def chat_with_ai(
     message: str = Form(...), 
@@ -25,51 +57,34 @@ async def chat_with_ai(
     try:
         print(f"🔍 Chat request - User: {current_user.id}, Message: {message[:50]}...")
         
-        # Get or create chat session
-        if session_id:
-            db_session = crud.get_chat_session(db, session_id)
-            if not db_session or db_session.user_id != current_user.id:
-                # Create new session if not found or doesn't belong to user
-                session_id = str(uuid.uuid4())
-                print(f"📝 Creating new session (existing invalid): {session_id}")
-                db_session = crud.create_chat_session(db, session_id, current_user.id)
-        else:
-            # Create new session
-            session_id = str(uuid.uuid4())
-            print(f"📝 Creating new session: {session_id}")
-            db_session = crud.create_chat_session(db, session_id, current_user.id)
-        
-        print(f"✅ Session created/found: {db_session.session_id}")
-        
-        # Save user message to database
-        user_message = MessageCreate(content=message, message_type="user")
-        print(f"💾 Saving user message to DB...")
-        user_msg_db = crud.create_message(db, user_message, current_user.id, db_session.id, False)
-        print(f"✅ User message saved with ID: {user_msg_db.id}")
+        # Get or create chat session and save the user message in one transaction
+        with crud.unit_of_work(db):
+            session_id, db_session = _get_or_create_chat_session(db, session_id, current_user.id)
+            has_document_context = _require_document_session(db_session)
+            user_message = MessageCreate(content=message, message_type="user")
+            print(f"💾 Saving user message to DB...")
+            user_msg_db = crud.add_message(db, user_message, current_user.id, db_session, False)
+        print(f"✅ User message saved with ID: {user_msg_db.id} (session {db_session.session_id})")
         
-        # Check if there's a document session for context
-        has_document_context = False
-        if session_id and session_id in document_sessions:
-            response_text = await chat_with_document_context(message, session_id)
-            has_document_context = True
+        if has_document_context:
+            response_text = await chat_with_document_context(message, session_id, route="/chat")
         else:
             # Regular chat without document context
-            response_text = await chat_without_context(message)
+            response_text = await chat_without_context(message, route="/chat")
         
         print(f"🤖 AI response generated: {response_text[:50]}...")
         
-        # Save AI response to database
-        ai_message = MessageCreate(content=response_text, message_type="ai")
-        print(f"💾 Saving AI response to DB...")
-        ai_msg_db = crud.create_message(db, ai_message, current_user.id, db_session.id, has_document_context)
+        # Save AI response and, on the first message, the session title in one transaction
+        with crud.unit_of_work(db):
+            ai_message = MessageCreate(content=response_text, message_type="ai")
+            print(f"💾 Saving AI response to DB...")
+            ai_msg_db = crud.add_message(db, ai_message, current_user.id, db_session.id, has_document_context)
+            if not db_session.title:
+                title = _session_title(message)
+                print(f"📝 Updating session title: {title}")
+                crud.set_chat_session_title(db, db_session.id, title)
         print(f"✅ AI message saved with ID: {ai_msg_db.id}")
         
-        # Update session title if it's the first message
-        if not db_session.title:
-            title = message[:50] + "..." if len(message) > 50 else message
-            print(f"📝 Updating session title: {title}")
-            crud.update_chat_session_title(db, session_id, current_user.id, title)
-        
         print(f"🎉 Chat completed successfully")
         
         return {
@@ -78,10 +93,74 @@ async def chat_with_ai(
             "has_document_context": has_document_context
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/stream")
+async def chat_with_ai_stream(
+    message: str = Form(...), 
+    session_id: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Chat with AI and stream the answer as Server-Sent Events (authenticated users only)"""
+    try:
+        user_id = current_user.id
+        
+        # Save user message before streaming starts
+        with crud.unit_of_work(db):
+            session_id, db_session = _get_or_create_chat_session(db, session_id, user_id)
+            has_document_context = _require_document_session(db_session)
+            user_message = MessageCreate(content=message, message_type="user")
+            crud.add_message(db, user_message, user_id, db_session, False)
+        
+        chat_session_pk = db_session.id
+        needs_title = not db_session.title
+        
+        # Wait for the first chunk so model failures before it are returned as HTTP errors
+        if has_document_context:
+            stream = await start_stream(stream_chat_with_document_context(message, session_id, route="/chat/stream"))
+        else:
+            stream = await start_stream(stream_chat_without_context(message, route="/chat/stream"))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        chunks = []
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield sse_event({"type": "token", "text": chunk})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield sse_event({"type": "error", "detail": str(e)})
+            return
+        
+        # The request-scoped DB session is closed once streaming starts, so persist with a fresh one
+        stream_db = SessionLocal()
+        try:
+            with crud.unit_of_work(stream_db):
+                ai_message = MessageCreate(content="".join(chunks), message_type="ai")
+                crud.add_message(stream_db, ai_message, user_id, chat_session_pk, has_document_context)
+                if needs_title:
+                    crud.set_chat_session_title(stream_db, chat_session_pk, _session_title(message))
+        finally:
+            stream_db.close()
+        
+        yield sse_event({
+            "type": "done",
+            "session_id": session_id,
+            "has_document_context": has_document_context
+        })
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/chat/public")
 async def chat_public(request: Request, message: str = Form(...), session_id: str = Form(None)):
     """Chat with AI (public access) - Rate limited"""
@@ -101,7 +180,7 @@ async def chat_public(request: Request, message: str = Form(...), session_id: st
         
         # Check if there's a document session for context
         if session_id and session_id in document_sessions:
-            response_text = await chat_with_document_context(message, session_id)
+            response_text = await chat_with_document_context(message, session_id, route="/chat/public")
             
             # Increment request counter after successful operation
             increment_rate_limit(request, "request")
@@ -117,7 +196,7 @@ async def chat_public(request: Request, message: str = Form(...), session_id: st
             }
         else:
             # Regular chat without document context
-            response_text = await chat_without_context(message)
+            response_text = await chat_without_context(message, route="/chat/public")
             
             # Increment request counter after successful operation
             increment_rate_limit(request, "request")
@@ -134,34 +213,77 @@ async def chat_public(request: Request, message: str = Form(...), session_id: st
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/public/stream")
+async def chat_public_stream(request: Request, message: str = Form(...), session_id: str = Form(None)):
+    """Chat with AI (public access) and stream the answer as Server-Sent Events - Rate limited"""
+    # Check rate limit for non-authenticated users
+    rate_check = check_rate_limit(request, "request")
+    if not rate_check["allowed"]:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "Rate limit exceeded",
+                "message": rate_check["message"],
+                "type": "rate_limit",
+                "requires_login": True
+            }
+        )
+    
+    has_document_context = bool(session_id) and session_id in document_sessions
+    
+    # Wait for the first chunk so model failures before it are returned as HTTP errors
+    if has_document_context:
+        stream = await start_stream(stream_chat_with_document_context(message, session_id, route="/chat/public/stream"))
+    else:
+        stream = await start_stream(stream_chat_without_context(message, route="/chat/public/stream"))
+    
+    async def event_stream():
+        try:
+            async for chunk in stream:
+                yield sse_event({"type": "token", "text": chunk})
+        except Exception as e:
+            print(f"Public chat stream error: {e}")
+            yield sse_event({"type": "error", "detail": str(e)})
+            return
+        
+        # Increment request counter after successful operation
+        increment_rate_limit(request, "request")
+        
+        done_event = {
+            "type": "done",
+            "has_document_context": has_document_context,
+            "rate_limit": {
+                "remaining_requests": rate_check["remaining"] - 1,  # -1 because we just used one
+                "message": f"{rate_check['remaining'] - 1} requests remaining before sign-in required."
+            }
+        }
+        if has_document_context:
+            done_event["session_id"] = session_id
+        yield sse_event(done_event)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 # ============================================================================
 # CHAT HISTORY MANAGEMENT ENDPOINTS
 # ============================================================================
 
 @router.get("/chat/history", response_model=schemas.ChatHistoryListResponse)
 async def get_chat_history(
-    skip: int = 0,
-    limit: int = 50,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get user's chat history"""
+    """Get user's chat history; pass ``next_cursor`` back as ``cursor`` for the next page"""
     try:
-        sessions = crud.get_user_chat_sessions(db, current_user.id, skip, limit)
-        total_count = db.query(ChatSession).filter(ChatSession.user_id == current_user.id).count()
+        # Counts and previews come from one aggregate query, not two queries per session
+        sessions, total_count, next_cursor = crud.get_chat_history_with_previews(db, current_user.id, skip, limit, cursor=cursor)
         
         # Transform sessions to ChatHistoryResponse format
         chat_sessions = []
-        for session in sessions:
-            # Get first message as preview
-            first_message = db.query(Message).filter(
-                Message.session_id == session.id
-            ).order_by(Message.created_at).first()
-            
-            preview = first_message.content[:100] + "..." if first_message and len(first_message.content) > 100 else (first_message.content if first_message else "No messages")
-            
-            # Get message count
-            message_count = db.query(Message).filter(Message.session_id == session.id).count()
+        for session, message_count, first_message in sessions:
+            preview = first_message[:100] + "..." if first_message and len(first_message) > 100 else (first_message or "No messages")
             
             chat_sessions.append(schemas.ChatHistoryResponse(
                 id=session.id,
@@ -174,20 +296,26 @@ async def get_chat_history(
                 updated_at=session.updated_at
             ))
         
-        return {"chat_sessions": chat_sessions, "total_count": total_count}
+        return {"chat_sessions": chat_sessions, "total_count": total_count, "next_cursor": next_cursor}
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/chat/history/{session_id}")
 async def get_chat_session_messages(
     session_id: str,
+    limit: int = Query(200, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get messages for a specific chat session"""
+    """Get the latest messages of a chat session; ``next_cursor`` fetches the earlier ones"""
     try:
-        messages = crud.get_chat_session_messages(db, session_id, current_user.id)
-        return {"messages": messages}
+        messages, next_cursor = crud.get_chat_session_messages_window(db, session_id, current_user.id, limit, cursor)
+        return {"messages": messages, "next_cursor": next_cursor}
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -201,6 +329,10 @@ async def delete_chat_session(
     try:
         success = crud.delete_chat_session(db, session_id, current_user.id)
         if success:
+            # Release the documents of the matching document session, if any
+            session_data = document_sessions.get(session_id)
+            if session_data and session_data.get('user_id') == current_user.id:
+                delete_document_session(session_id)
             return {"success": True, "message": "Chat session deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Chat session not found")
@@ -215,6 +347,7 @@ async def clear_all_chat_history(
     """Clear all chat history for the user"""
     try:
         success = crud.clear_user_chat_history(db, current_user.id)
+        delete_user_document_sessions(current_user.id)
         if success:
             return {"success": True, "message": "All chat history cleared successfully"}
         else:
@@ -1,78 +1,192 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from typing import List
 import uuid
 import core.models as models
 
-from core.database import get_db
+from core.database import get_db, SessionLocal
 from core.models import User
-from core.schemas import MessageCreate
 from core.dependencies import get_current_user, get_current_admin
-from services.document_service import process_uploaded_files, analyze_documents_with_ai, create_document_session
-from services.ai_service import document_sessions
+from core.streaming import sse_event, start_stream, SSE_HEADERS
+from services.document_service import process_uploaded_files, analyze_uploaded_documents, DOCUMENT_ANALYSIS_MODES, analyze_documents_with_ai, stream_analyze_documents_with_ai, analyze_secure_folder_documents, create_document_session, update_analysis_progress
+from services.secure_folder_index import secure_folder_index
+from services.cv_profiles import answer_profile_query
+from services.blob_store import document_store
+from services.analysis_jobs import analysis_jobs, job_status
 from rate_limiting.rate_limiter import check_rate_limit, increment_rate_limit
 import core.crud as crud
 
 router = APIRouter()
 
+def _require_secure_folder_access(current_user: User, db: Session):
+    """Admins have automatic access, regular users need a granted permission"""
+    if current_user.role == "admin":
+        return
+    permission = db.query(models.SecureFolderPermission).filter(
+        models.SecureFolderPermission.user_id == current_user.id
+    ).first()
+    
+    # Check if user has valid permission (record exists AND has_access is True)
+    if not permission or permission.has_access != True:
+        raise HTTPException(
+            status_code=403, 
+            detail="Access denied. You don't have permission to analyze CVs from the secure folder. Please contact an administrator for access or upload your own documents to analyze."
+        )
+
 @router.post("/analyze-document")
 async def analyze_documents(
     files: List[UploadFile] = File(...),
     prompt: str = Form(...),
+    mode: str = Form("auto"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Analyze PDF documents with AI (authenticated users only)"""
+    """Analyze PDF documents with AI (authenticated users only)
+    
+    mode: "single" sends the documents in one request, "chunked" summarizes page ranges
+    concurrently and answers over the summaries, "auto" chunks very large PDFs.
+    """
     try:
         if not files:
             raise HTTPException(status_code=400, detail="No files provided")
+        if mode not in DOCUMENT_ANALYSIS_MODES:
+            raise HTTPException(status_code=400, detail="mode must be 'auto', 'single' or 'chunked'")
         
         # Validate and process files
         file_contents, file_info = await process_uploaded_files(files)
         
         # Generate AI response
-        response_text = await analyze_documents_with_ai(file_contents, prompt, len(files))
+        analysis = await analyze_uploaded_documents(file_contents, file_info, prompt, mode, route="/analyze-document")
+        response_text = analysis["response"]
         
-        # Create new session for document analysis
+        # Save the analysis as a new chat session
         session_id = str(uuid.uuid4())
-        db_session = crud.create_chat_session(db, session_id, current_user.id)
-        
-        # Update session with document context
         document_info = {"files": file_info, "total_files": len(files)}
-        crud.update_chat_session_document_context(db, session_id, True, document_info)
-        
-        # Save user message (prompt) to database
-        user_message = MessageCreate(content=prompt, message_type="user")
-        crud.create_message(db, user_message, current_user.id, db_session.id, True)
-        
-        # Save AI response to database
-        ai_message = MessageCreate(content=response_text, message_type="ai")
-        crud.create_message(db, ai_message, current_user.id, db_session.id, True)
-        
-        # Set session title based on first user message
         title = prompt[:50] + "..." if len(prompt) > 50 else prompt
-        crud.update_chat_session_title(db, session_id, current_user.id, title)
+        crud.save_document_analysis(db, session_id, current_user.id, prompt, response_text, document_info, title)
         
         # Store session for follow-up questions (in-memory for backward compatibility)
-        document_sessions[session_id] = {
-            'file_contents': file_contents,
-            'file_info': file_info,
-            'conversation_history': [f"User: {prompt}", f"Assistant: {response_text}"],
-            'user_id': current_user.id
-        }
+        await create_document_session(file_contents, file_info, prompt, response_text, current_user.id, session_id)
 
         return {
-            "response": response_text,
+            **analysis,
             "files_processed": file_info,
             "total_files": len(files),
             "session_id": session_id,
             "user": current_user.full_name
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Document analysis error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _job_response(job, created: bool) -> JSONResponse:
+    """202 for a newly queued job, 200 when an idempotent retry returns the existing one"""
+    return JSONResponse(
+        status_code=202 if created else 200,
+        content=jsonable_encoder({**job_status(job), "status_url": f"/jobs/{job.job_id}", "result_url": f"/jobs/{job.job_id}/result"})
+    )
+
+@router.post("/analyze-document/jobs")
+async def submit_document_analysis_job(
+    files: List[UploadFile] = File(...),
+    prompt: str = Form(...),
+    mode: str = Form("auto"),
+    idempotency_key: str = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue a document analysis and return its job id straight away (authenticated users only)
+    
+    Poll GET /jobs/{job_id} for the status and GET /jobs/{job_id}/result for the answer. Retrying
+    with the same Idempotency-Key header returns the original job instead of starting another.
+    """
+    try:
+        if idempotency_key:
+            existing = crud.get_analysis_job_by_idempotency_key(db, current_user.id, idempotency_key)
+            if existing:
+                return _job_response(existing, False)
+        
+        if not files:
+            raise HTTPException(status_code=400, detail="No files provided")
+        if mode not in DOCUMENT_ANALYSIS_MODES:
+            raise HTTPException(status_code=400, detail="mode must be 'auto', 'single' or 'chunked'")
+        
+        # Uploads are closed once the response is sent, so store the documents for the worker
+        file_contents, file_info = await process_uploaded_files(files)
+        document_hashes = await document_store.put_many(file_contents)
+        
+        job, created = analysis_jobs.submit(
+            db,
+            current_user.id,
+            "document_analysis",
+            {"prompt": prompt, "mode": mode, "document_hashes": document_hashes, "file_info": file_info},
+            idempotency_key
+        )
+        return _job_response(job, created)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Document analysis job submission error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze-document/stream")
+async def analyze_documents_stream(
+    files: List[UploadFile] = File(...),
+    prompt: str = Form(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze PDF documents with AI and stream the answer as Server-Sent Events (authenticated users only)"""
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+    
+    # Uploads are closed once the response starts, so read them up front
+    file_contents, file_info = await process_uploaded_files(files)
+    user_id = current_user.id
+    
+    # Wait for the first chunk so model failures before it are returned as HTTP errors
+    stream = await start_stream(stream_analyze_documents_with_ai(file_contents, prompt, len(file_contents), route="/analyze-document/stream"))
+    
+    async def event_stream():
+        chunks = []
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield sse_event({"type": "token", "text": chunk})
+        except Exception as e:
+            print(f"Document analysis stream error: {e}")
+            yield sse_event({"type": "error", "detail": str(e)})
+            return
+        
+        response_text = "".join(chunks)
+        session_id = str(uuid.uuid4())
+        
+        # The request-scoped DB session is closed once streaming starts, so persist with a fresh one
+        db = SessionLocal()
+        try:
+            document_info = {"files": file_info, "total_files": len(file_contents)}
+            title = prompt[:50] + "..." if len(prompt) > 50 else prompt
+            crud.save_document_analysis(db, session_id, user_id, prompt, response_text, document_info, title)
+        finally:
+            db.close()
+        
+        # Store session for follow-up questions
+        await create_document_session(file_contents, file_info, prompt, response_text, user_id, session_id)
+        
+        yield sse_event({
+            "type": "done",
+            "files_processed": file_info,
+            "total_files": len(file_contents),
+            "session_id": session_id
+        })
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/analyze-document/public")
 async def analyze_documents_public(
     request: Request,
@@ -114,14 +228,14 @@ async def analyze_documents_public(
         file_contents, file_info = await process_uploaded_files(files)
         
         # Generate AI response
-        response_text = await analyze_documents_with_ai(file_contents, prompt, len(files))
+        response_text = await analyze_documents_with_ai(file_contents, prompt, len(files), route="/analyze-document/public")
         
         # Increment counters after successful operation
         increment_rate_limit(request, "request")
         increment_rate_limit(request, "file")
         
         # Create document session
-        session_id = create_document_session(file_contents, file_info, prompt, response_text, None)
+        session_id = await create_document_session(file_contents, file_info, prompt, response_text, None)
 
         return {
             "response": response_text,
@@ -135,122 +249,56 @@ async def analyze_documents_public(
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/analyze-secure-folder")
 async def analyze_secure_folder(
     prompt: str = Form(...),
+    mode: str = Form("auto"),
+    progress_id: str = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Analyze CVs from secure folder (authenticated users with permission only)"""
-    import os
+    """Analyze CVs from secure folder (authenticated users with permission only)
+    
+    mode: "single" sends every CV in one request, "map_reduce" extracts each CV in parallel
+    and then compares the extractions, "auto" picks map-reduce for large folders.
+    Pass a progress_id to poll GET /analyze-secure-folder/progress/{progress_id}.
+    """
     try:
         # Admins have automatic access, regular users need permission
-        if current_user.role != "admin":
-            permission = db.query(models.SecureFolderPermission).filter(
-                models.SecureFolderPermission.user_id == current_user.id
-            ).first()
-            
-            # Check if user has valid permission (record exists AND has_access is True)
-            if not permission or permission.has_access != True:
-                raise HTTPException(
-                    status_code=403, 
-                    detail="Access denied. You don't have permission to analyze CVs from the secure folder. Please contact an administrator for access or upload your own documents to analyze."
-                )
-        
-        # Define the secure folder path (you can configure this as an environment variable)
-        SECURE_FOLDER_PATH = os.getenv("SECURE_CV_FOLDER_PATH", "C:/secure/cvs")
-        
-        if not os.path.exists(SECURE_FOLDER_PATH):
-            raise HTTPException(status_code=404, detail="Secure folder not found")
-        
-        # Get all PDF files from the secure folder
-        pdf_files = []
-        for filename in os.listdir(SECURE_FOLDER_PATH):
-            if filename.lower().endswith('.pdf'):
-                pdf_files.append(os.path.join(SECURE_FOLDER_PATH, filename))
-        
-        if not pdf_files:
-            raise HTTPException(
-                status_code=404, 
-                detail="No PDF files found in secure folder. Please contact an administrator to upload CV files."
-            )
-        
-        # Read and process the PDF files
-        file_contents = []
-        file_info = []
-        
-        for file_path in pdf_files:
-            try:
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
-                    file_contents.append(file_content)
-                    file_info.append({
-                        "filename": os.path.basename(file_path),
-                        "size": len(file_content)
-                    })
-            except Exception as e:
-                print(f"Error reading file {file_path}: {e}")
-                continue
-        
-        if not file_contents:
-            raise HTTPException(status_code=500, detail="Failed to read any files from secure folder")
+        _require_secure_folder_access(current_user, db)
         
-        # Generate AI response with CV analysis focus
-        cv_analysis_prompt = f"""
-        You are analyzing CVs from a confidential recruitment process. Please provide:
+        def report_progress(stage, completed, total, failed):
+            if progress_id:
+                update_analysis_progress(progress_id, current_user.id, stage=stage, completed=completed, total=total, failed=failed)
         
-        User Request: {prompt}
+        analysis = await analyze_secure_folder_documents(prompt, mode, report_progress, route="/analyze-secure-folder")
+        response_text = analysis["response"]
+        file_contents = analysis["file_contents"]
+        file_info = analysis["file_info"]
         
-        Guidelines for CV Analysis:
-        - Maintain confidentiality and professionalism
-        - Focus on relevant skills, experience, and qualifications
-        - Provide comparative analysis when requested
-        - Respect privacy by not revealing personal details unless specifically asked
-        - Summarize key findings and recommendations
-        
-        Please analyze the CVs and respond to the user's request.
-        """
-        
-        response_text = await analyze_documents_with_ai(file_contents, cv_analysis_prompt, len(file_contents))
-        
-        # Create new session for document analysis
+        # Save the analysis as a new chat session
         session_id = str(uuid.uuid4())
-        db_session = crud.create_chat_session(db, session_id, current_user.id)
-        
-        # Update session with document context
         document_info = {"files": file_info, "total_files": len(file_contents), "source": "secure_folder"}
-        crud.update_chat_session_document_context(db, session_id, True, document_info)
-        
-        # Save user message (prompt) to database
-        user_message = MessageCreate(content=prompt, message_type="user")
-        crud.create_message(db, user_message, current_user.id, db_session.id, True)
-        
-        # Save AI response to database
-        ai_message = MessageCreate(content=response_text, message_type="ai")
-        crud.create_message(db, ai_message, current_user.id, db_session.id, True)
-        
-        # Set session title based on first user message
         title = f"CV Analysis: {prompt[:30]}..." if len(prompt) > 30 else f"CV Analysis: {prompt}"
-        crud.update_chat_session_title(db, session_id, current_user.id, title)
+        crud.save_document_analysis(db, session_id, current_user.id, prompt, response_text, document_info, title)
         
-        # Store session for follow-up questions (in-memory for backward compatibility)
-        document_sessions[session_id] = {
-            'file_contents': file_contents,
-            'file_info': file_info,
-            'conversation_history': [f"User: {prompt}", f"Assistant: {response_text}"],
-            'user_id': current_user.id,
-            'source': 'secure_folder'
-        }
+        # Store session for follow-up questions
+        await create_document_session(file_contents, file_info, prompt, response_text, current_user.id, session_id, source='secure_folder')
 
         return {
             "response": response_text,
             "files_processed": file_info,
             "total_files": len(file_contents),
             "session_id": session_id,
-            "source": "secure_folder"
+            "source": "secure_folder",
+            "mode": analysis["mode"],
+            "failed_files": analysis["failed_files"],
+            "retrieval": analysis["retrieval"]
         }
         
     except HTTPException:
@@ -258,3 +306,93 @@ async def analyze_secure_folder(
     except Exception as e:
         print(f"Error in secure folder analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze-secure-folder/jobs")
+async def submit_secure_folder_analysis_job(
+    prompt: str = Form(...),
+    mode: str = Form("auto"),
+    idempotency_key: str = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue a secure folder CV analysis and return its job id straight away (users with permission only)
+    
+    Progress is reported by GET /jobs/{job_id} while the job runs.
+    """
+    try:
+        _require_secure_folder_access(current_user, db)
+        
+        if mode not in ("auto", "single", "map_reduce"):
+            raise HTTPException(status_code=400, detail="mode must be 'auto', 'single' or 'map_reduce'")
+        
+        if idempotency_key:
+            existing = crud.get_analysis_job_by_idempotency_key(db, current_user.id, idempotency_key)
+            if existing:
+                return _job_response(existing, False)
+        
+        job, created = analysis_jobs.submit(
+            db,
+            current_user.id,
+            "secure_folder_analysis",
+            {"prompt": prompt, "mode": mode},
+            idempotency_key
+        )
+        return _job_response(job, created)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Secure folder analysis job submission error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze-secure-folder/query")
+async def query_secure_folder_profiles(
+    prompt: str = Form(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Answer filter and comparison questions over the secure folder CVs from their stored profiles
+    
+    Simple filters ("years of experience > 5 and speaks French") are answered locally; other
+    questions are sent to the model with the compact profiles instead of the CVs.
+    """
+    try:
+        _require_secure_folder_access(current_user, db)
+        
+        file_contents, file_info = await secure_folder_index.load_documents()
+        if not file_contents:
+            raise HTTPException(
+                status_code=404, 
+                detail="No PDF files found in secure folder. Please contact an administrator to upload CV files."
+            )
+        
+        result = await answer_profile_query(prompt, file_contents, file_info, route="/analyze-secure-folder/query")
+        if not result["profiles_considered"]:
+            raise HTTPException(status_code=502, detail="Could not extract any CV profiles. Please try again later.")
+        
+        return {**result, "total_files": len(file_contents), "source": "secure_folder"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in secure folder profile query: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analyze-secure-folder/progress/{progress_id}")
+async def get_secure_folder_analysis_progress(
+    progress_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the progress of a running secure folder analysis"""
+    progress = crud.get_analysis_progress(db, progress_id, current_user.id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Analysis progress not found")
+    
+    return {
+        "progress_id": progress_id,
+        "stage": progress['stage'],
+        "completed": progress['completed'],
+        "total": progress['total'],
+        "failed_files": progress['failed']
+    }
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.orm import Session
+import json
+
+from core.database import get_db
+from core.models import User
+from core.dependencies import get_current_user
+from services.analysis_jobs import job_status
+import core.crud as crud
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the status of a background analysis job"""
+    job = crud.get_analysis_job(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    status = job_status(job)
+    
+    # Map-reduce progress is stored under the job id by whichever worker runs the job
+    progress = crud.get_analysis_progress(db, job_id, current_user.id) if job.status == "running" else None
+    if progress:
+        status["progress"] = {
+            "stage": progress['stage'],
+            "completed": progress['completed'],
+            "total": progress['total'],
+            "failed_files": progress['failed']
+        }
+    return status
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the result of a finished background analysis job
+    
+    Returns 409 while the job is queued or running, and the analysis error when it failed.
+    """
+    job = crud.get_analysis_job(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    
+    return {"job_id": job.job_id, **json.loads(job.result)}
@@ -1,9 +1,12 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from .models import User, ChatSession, Message
+from sqlalchemy import desc, func
+from .models import User, ChatSession, Message, AnalysisJob, AnalysisProgress
 from .schemas import UserCreate, ChatSessionCreate, MessageCreate
 from .auth import get_password_hash, verify_password
-from typing import Optional, List
+from .pagination import paginate
+from typing import Optional, List, Union
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import json
 
 # User CRUD operations
@@ -33,6 +36,63 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
         return None
     return user
 
+# Unit of work
+@contextmanager
+def unit_of_work(db: Session):
+    """Run a group of writes as one transaction.
+    
+    Objects staged inside the block (``add_chat_session``, ``add_message``) are inserted in one
+    flush and committed once when it exits; an exception rolls the whole group back. The
+    commit does not expire loaded objects, so reading them afterwards (e.g. ``db_session.id``)
+    costs no refresh query.
+    """
+    try:
+        yield db
+        expire_on_commit = db.expire_on_commit
+        db.expire_on_commit = False
+        try:
+            db.commit()
+        finally:
+            db.expire_on_commit = expire_on_commit
+    except Exception:
+        db.rollback()
+        raise
+
+def add_chat_session(db: Session, session_id: str, user_id: int, title: Optional[str] = None, document_info: dict = None) -> ChatSession:
+    """Stage a new chat session in the current unit of work; ``document_info`` marks it as a document session"""
+    db_session = ChatSession(
+        session_id=session_id,
+        user_id=user_id,
+        title=title,
+        has_document_context=document_info is not None,
+        document_info=json.dumps(document_info) if document_info is not None else None
+    )
+    db.add(db_session)
+    return db_session
+
+def add_message(db: Session, message: MessageCreate, user_id: int, chat_session: Union[ChatSession, int], has_document_context: bool = False) -> Message:
+    """Stage a message in the current unit of work.
+    
+    ``chat_session`` is a ChatSession (possibly staged in the same unit of work) or the id of a
+    stored one.
+    """
+    db_message = Message(
+        user_id=user_id,
+        message_type=message.message_type,
+        content=message.content,
+        has_document_context=has_document_context
+    )
+    if isinstance(chat_session, ChatSession):
+        db_message.chat_session = chat_session
+    else:
+        db_message.session_id = chat_session
+    db.add(db_message)
+    return db_message
+
+def set_chat_session_title(db: Session, chat_session_id: int, title: str):
+    """Set a session title by primary key in the current unit of work, without loading the session"""
+    db.query(ChatSession).filter(ChatSession.id == chat_session_id).update({ChatSession.title: title}, synchronize_session=False)
+
 # Chat session CRUD operations
 def create_chat_session(db: Session, session_id: str, user_id: int, title: Optional[str] = None) -> ChatSession:
     db_session = ChatSession(
@@ -49,7 +109,12 @@ def get_chat_session(db: Session, session_id: str) -> Optional[ChatSession]:
     return db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
 
 def get_user_chat_sessions(db: Session, user_id: int, skip: int = 0, limit: int = 50) -> List[ChatSession]:
-    return db.query(ChatSession).filter(ChatSession.user_id == user_id).order_by(desc(ChatSession.updated_at)).offset(skip).limit(limit).all()
+    return get_user_chat_sessions_page(db, user_id, limit, skip=skip)[0]
+
+def get_user_chat_sessions_page(db: Session, user_id: int, limit: int = 50, cursor: Optional[str] = None, skip: int = 0) -> tuple:
+    """Most recently updated sessions first; returns (sessions, next_cursor)"""
+    query = db.query(ChatSession).filter(ChatSession.user_id == user_id)
+    return paginate(query, [ChatSession.updated_at, ChatSession.id], limit, cursor, descending=True, skip=skip)
 
 def update_chat_session_document_context(db: Session, session_id: str, has_documents: bool, document_info: dict = None):
     db_session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
@@ -109,6 +174,24 @@ def get_chat_session_messages(db: Session, session_id: str, user_id: int) -> Lis
         Message.session_id == session.id
     ).order_by(Message.created_at).all()
 
+def get_chat_session_messages_window(db: Session, session_id: str, user_id: int, limit: int = 200, cursor: Optional[str] = None) -> tuple:
+    """Get a window of a chat session's messages, latest first.
+    
+    Returns (messages in chronological order, cursor of the previous window); pass the cursor
+    back to walk towards the start of the session. ([], None) if the session is not the user's.
+    """
+    session = db.query(ChatSession).filter(
+        ChatSession.session_id == session_id,
+        ChatSession.user_id == user_id
+    ).first()
+    
+    if not session:
+        return [], None
+    
+    query = db.query(Message).filter(Message.session_id == session.id)
+    messages, next_cursor = paginate(query, [Message.created_at, Message.id], limit, cursor, descending=True)
+    return messages[::-1], next_cursor
+
 def delete_chat_session(db: Session, session_id: str, user_id: int) -> bool:
     """Delete a chat session and all its messages"""
     # First delete all messages for this session
@@ -153,35 +236,176 @@ def update_chat_session_title(db: Session, session_id: str, user_id: int, title:
     
     return db_session
 
-def get_chat_history_with_previews(db: Session, user_id: int, skip: int = 0, limit: int = 50):
-    """Get chat history with message previews and counts"""
-    from sqlalchemy import func, text
+def save_document_analysis(db: Session, session_id: str, user_id: int, prompt: str, response_text: str, document_info: dict, title: str) -> ChatSession:
+    """Store a document analysis as a chat session holding the prompt and the answer (one transaction)"""
+    with unit_of_work(db):
+        db_session = add_chat_session(db, session_id, user_id, title, document_info)
+        add_message(db, MessageCreate(content=prompt, message_type="user"), user_id, db_session, True)
+        add_message(db, MessageCreate(content=response_text, message_type="ai"), user_id, db_session, True)
+    return db_session
+
+# Analysis progress CRUD operations
+def save_analysis_progress(db: Session, progress_id: str, user_id: Optional[int], max_age_seconds: float, **fields):
+    """Create or update the progress of a running analysis; entries of other users are left alone.
+    
+    Creating an entry also deletes the ones not updated for ``max_age_seconds``.
+    """
+    now = datetime.utcnow()
+    db_progress = db.get(AnalysisProgress, progress_id)
+    if db_progress is None:
+        db.query(AnalysisProgress).filter(
+            AnalysisProgress.updated_at < now - timedelta(seconds=max_age_seconds)
+        ).delete(synchronize_session=False)
+        db_progress = AnalysisProgress(progress_id=progress_id, user_id=user_id, stage="starting", completed=0, total=0, failed="[]")
+        db.add(db_progress)
+    elif db_progress.user_id != user_id:
+        return
     
-    # Query to get chat sessions with message count and preview
-    query = db.query(
-        ChatSession,
+    for field, value in fields.items():
+        setattr(db_progress, field, json.dumps(value) if field == "failed" else value)
+    db_progress.updated_at = now
+    db.commit()
+
+def get_analysis_progress(db: Session, progress_id: str, user_id: int) -> Optional[dict]:
+    db_progress = db.query(AnalysisProgress).filter(
+        AnalysisProgress.progress_id == progress_id,
+        AnalysisProgress.user_id == user_id
+    ).first()
+    if not db_progress:
+        return None
+    return {
+        "stage": db_progress.stage,
+        "completed": db_progress.completed,
+        "total": db_progress.total,
+        "failed": json.loads(db_progress.failed)
+    }
+
+# Analysis job CRUD operations
+def create_analysis_job(db: Session, job_id: str, user_id: int, kind: str, payload: dict, idempotency_key: Optional[str] = None) -> AnalysisJob:
+    db_job = AnalysisJob(
+        job_id=job_id,
+        user_id=user_id,
+        kind=kind,
+        payload=json.dumps(payload),
+        idempotency_key=idempotency_key
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_analysis_job(db: Session, job_id: str, user_id: Optional[int] = None) -> Optional[AnalysisJob]:
+    query = db.query(AnalysisJob).filter(AnalysisJob.job_id == job_id)
+    if user_id is not None:
+        query = query.filter(AnalysisJob.user_id == user_id)
+    return query.first()
+
+def get_analysis_job_by_idempotency_key(db: Session, user_id: int, idempotency_key: str) -> Optional[AnalysisJob]:
+    return db.query(AnalysisJob).filter(
+        AnalysisJob.user_id == user_id,
+        AnalysisJob.idempotency_key == idempotency_key
+    ).first()
+
+def get_queued_analysis_job_ids(db: Session) -> List[str]:
+    return [row[0] for row in db.query(AnalysisJob.job_id).filter(AnalysisJob.status == "queued").order_by(AnalysisJob.id)]
+
+def requeue_stale_analysis_jobs(db: Session, max_age_seconds: float) -> List[str]:
+    """Put running jobs without a heartbeat for ``max_age_seconds`` (their process died) back in the queue; returns their ids"""
+    stale = (AnalysisJob.heartbeat_at < datetime.utcnow() - timedelta(seconds=max_age_seconds)) | AnalysisJob.heartbeat_at.is_(None)
+    job_ids = [row[0] for row in db.query(AnalysisJob.job_id).filter(AnalysisJob.status == "running", stale)]
+    if not job_ids:
+        return []
+    # Only the jobs still stale are re-queued, whichever process gets there first
+    db.query(AnalysisJob).filter(
+        AnalysisJob.job_id.in_(job_ids),
+        AnalysisJob.status == "running",
+        stale
+    ).update({"status": "queued", "started_at": None, "heartbeat_at": None}, synchronize_session=False)
+    db.commit()
+    return job_ids
+
+def requeue_analysis_job(db: Session, job_id: str):
+    """Hand a running job back to the queue, e.g. when its worker is shutting down"""
+    db.query(AnalysisJob).filter(
+        AnalysisJob.job_id == job_id,
+        AnalysisJob.status == "running"
+    ).update({"status": "queued", "started_at": None, "heartbeat_at": None}, synchronize_session=False)
+    db.commit()
+
+def claim_analysis_job(db: Session, job_id: str) -> Optional[AnalysisJob]:
+    """Atomically move a queued job to running; None if another worker got it first"""
+    claimed = db.query(AnalysisJob).filter(
+        AnalysisJob.job_id == job_id,
+        AnalysisJob.status == "queued"
+    ).update({"status": "running", "started_at": func.now(), "heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return get_analysis_job(db, job_id) if claimed else None
+
+def touch_analysis_job(db: Session, job_id: str):
+    """Record that a running job is still being worked on"""
+    db.query(AnalysisJob).filter(
+        AnalysisJob.job_id == job_id,
+        AnalysisJob.status == "running"
+    ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+def complete_analysis_job(db: Session, db_job: AnalysisJob, result: dict) -> AnalysisJob:
+    db_job.status = "succeeded"
+    db_job.result = json.dumps(result)
+    db_job.session_id = result.get("session_id")
+    db_job.finished_at = func.now()
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def fail_analysis_job(db: Session, db_job: AnalysisJob, error: str, error_status: int = 500) -> AnalysisJob:
+    db_job.status = "failed"
+    db_job.error = error
+    db_job.error_status = error_status
+    db_job.finished_at = func.now()
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_chat_history_with_previews(db: Session, user_id: int, skip: int = 0, limit: int = 50, preview_length: int = 100, cursor: Optional[str] = None):
+    """Get a page of chat sessions with message counts and first-message previews.
+    
+    Returns ([(session, message_count, preview_text)], total_count, next_cursor) in three
+    queries whatever the page size: the page of sessions, one aggregate over their messages
+    joined to the first message (truncated in SQL to ``preview_length + 1`` characters), and
+    the total count. ``preview_text`` is None for sessions without messages. A ``cursor``
+    (from a previous page) cannot be combined with ``skip``.
+    """
+    sessions, next_cursor = get_user_chat_sessions_page(db, user_id, limit, cursor, skip)
+    total_count = db.query(func.count(ChatSession.id)).filter(ChatSession.user_id == user_id).scalar()
+    if not sessions:
+        return [], total_count, next_cursor
+    
+    # Message ids grow with insertion, so the smallest id of a session is its first message
+    message_stats = db.query(
+        Message.session_id.label('session_id'),
         func.count(Message.id).label('message_count'),
-        func.first_value(Message.content).over(
-            partition_by=ChatSession.id,
-            order_by=Message.created_at
-        ).label('first_message')
-    ).outerjoin(Message, ChatSession.id == Message.session_id)\
-     .filter(ChatSession.user_id == user_id)\
-     .group_by(ChatSession.id)\
-     .order_by(desc(ChatSession.updated_at))\
-     .offset(skip).limit(limit)
+        func.min(Message.id).label('first_message_id')
+    ).filter(Message.session_id.in_([session.id for session in sessions]))\
+     .group_by(Message.session_id)\
+     .subquery()
+    
+    rows = db.query(
+        message_stats.c.session_id,
+        message_stats.c.message_count,
+        func.substr(Message.content, 1, preview_length + 1)
+    ).join(Message, Message.id == message_stats.c.first_message_id).all()
+    stats = {session_id: (message_count, preview) for session_id, message_count, preview in rows}
     
-    return query.all()
+    return [(session, *stats.get(session.id, (0, None))) for session in sessions], total_count, next_cursor
 
 # Admin CRUD operations
-def get_all_users(db: Session, skip: int = 0, limit: int = 100):
-    """Get all users with their basic info for admin panel"""
-    from sqlalchemy import desc
+def get_all_users(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Get a page of users (newest first) with their basic info for admin panel.
     
-    users = db.query(User)\
-        .order_by(desc(User.created_at))\
-        .offset(skip).limit(limit)\
-        .all()
+    Returns (users, next_cursor); a ``cursor`` from a previous page cannot be combined with ``skip``.
+    """
+    users, next_cursor = paginate(db.query(User), [User.created_at, User.id], limit, cursor, descending=True, skip=skip)
     
     # Convert to dict format for easier handling in frontend
     result = []
@@ -197,7 +421,7 @@ def get_all_users(db: Session, skip: int = 0, limit: int = 100):
         }
         result.append(user_dict)
     
-    return result
+    return result, next_cursor
 
 def update_user_role(db: Session, user_id: int, new_role: str):
     """Update user role"""
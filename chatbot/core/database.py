@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,11 +16,109 @@ DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_NAME = os.getenv("DB_NAME", "chatbot")
 
+# Connection pool configuration (per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # Connections kept open
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # Extra connections opened during bursts
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Reopen connections older than this (below MySQL wait_timeout)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # Check connections on checkout
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # Log every SQL statement (debugging only)
+
 # Create database URL
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+class PoolTelemetry:
+    """Counters of connection checkouts: wait time, timeouts, new and invalidated connections.
+    
+    Kept outside the pool because ``engine.dispose()`` replaces the pool instance.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_checked_out = 0
+        self.connections_opened = 0
+        self.invalidations = 0
+    
+    def record_checkout(self, wait_seconds: float, checked_out: int):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+    
+    def record_timeout(self, wait_seconds: float):
+        with self.lock:
+            self.timeouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+pool_telemetry = PoolTelemetry()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited and how many timed out"""
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_telemetry.record_timeout(time.perf_counter() - started)
+            raise
+        pool_telemetry.record_checkout(time.perf_counter() - started, self.checkedout())
+        return connection
+
+def get_pool_stats() -> dict:
+    """Live pool gauges plus the checkout counters"""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # Negative while the pool has not opened pool_size connections yet
+            "overflow": max(pool.overflow(), 0),
+            "timeout_seconds": pool.timeout()
+        })
+    with pool_telemetry.lock:
+        checkouts = pool_telemetry.checkouts
+        stats.update({
+            "checkouts": checkouts,
+            "timeouts": pool_telemetry.timeouts,
+            "avg_wait_ms": round(pool_telemetry.total_wait_seconds / (checkouts + pool_telemetry.timeouts) * 1000, 2) if checkouts + pool_telemetry.timeouts else 0,
+            "max_wait_ms": round(pool_telemetry.max_wait_seconds * 1000, 2),
+            "peak_checked_out": pool_telemetry.peak_checked_out,
+            "connections_opened": pool_telemetry.connections_opened,
+            "invalidations": pool_telemetry.invalidations
+        })
+    return stats
+
 # Create engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    echo=DB_ECHO,
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
+
+@event.listens_for(engine, "connect")
+def _count_connect(dbapi_connection, connection_record):
+    with pool_telemetry.lock:
+        pool_telemetry.connections_opened += 1
+
+@event.listens_for(engine, "invalidate")
+def _count_invalidate(dbapi_connection, connection_record, exception):
+    with pool_telemetry.lock:
+        pool_telemetry.invalidations += 1
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
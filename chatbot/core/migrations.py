@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+from sqlalchemy import Column, Integer, String, DateTime, MetaData, Table, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+from .database import Base
+from . import models
+
+# Applied migrations, one row per version
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now())
+)
+
+def _create_tables(connection):
+    """Tables (and, on a new database, their indexes) from the models"""
+    Base.metadata.create_all(bind=connection)
+
+def _create_indexes(*names: str):
+    """Migration creating indexes declared in the models' ``__table_args__``"""
+    def migrate(connection):
+        declared = {index.name: index for table in Base.metadata.sorted_tables for index in table.indexes}
+        for name in names:
+            declared[name].create(bind=connection, checkfirst=True)
+    return migrate
+
+def _add_columns(model, *names: str):
+    """Migration adding columns declared in a model to its existing table"""
+    def migrate(connection):
+        table = model.__table__
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        for name in names:
+            if name not in existing:
+                column_type = table.c[name].type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+    return migrate
+
+def _backfill_chat_session_updated_at(connection):
+    """Sessions created before updated_at was set on insert have NULL and sort last"""
+    chat_sessions = models.ChatSession.__table__
+    connection.execute(
+        update(chat_sessions)
+        .where(chat_sessions.c.updated_at.is_(None))
+        .values(updated_at=chat_sessions.c.created_at)
+    )
+
+# (version, description, migrate(connection)); append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "Baseline schema", _create_tables),
+    (2, "Composite indexes for history, transcript, activity and statistics queries", _create_indexes(
+        "ix_users_created_at",
+        "ix_chat_sessions_user_id_updated_at",
+        "ix_chat_sessions_user_id_created_at",
+        "ix_messages_session_id_created_at",
+        "ix_messages_user_id_created_at",
+        "ix_api_usage_stats_created_at_endpoint",
+        "ix_api_usage_stats_created_at_user_id",
+        "ix_system_error_logs_error_type_created_at"
+    )),
+    (3, "Backfill chat_sessions.updated_at from created_at", _backfill_chat_session_updated_at),
+    (4, "Analysis progress table shared by all workers", _create_tables),
+    (5, "Heartbeat of running analysis jobs", _add_columns(models.AnalysisJob, "heartbeat_at"))
+]
+
+# A worker waits this long for another worker's migrations before giving up on startup
+MIGRATION_LOCK_NAME = "schema_migrations"
+MIGRATION_LOCK_TIMEOUT_SECONDS = 600
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """Hold a server-wide lock so only one process runs migrations at a time.
+
+    MySQL DDL is not transactional, so two workers both passing a "does it exist" check would
+    both issue the DDL and one would crash on the duplicate. Other databases (SQLite in tests
+    and single-process setups) run without the lock.
+    """
+    if engine.dialect.name != "mysql":
+        yield
+        return
+    with engine.connect() as connection:
+        acquired = connection.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT_SECONDS}
+        ).scalar()
+        if acquired != 1:
+            raise RuntimeError(f"Timed out after {MIGRATION_LOCK_TIMEOUT_SECONDS}s waiting for another worker's schema migrations")
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK_NAME})
+
+def get_applied_versions(engine: Engine) -> set:
+    if not inspect(engine).has_table("schema_migrations"):
+        return set()
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(select(schema_migrations.c.version))}
+
+def run_migrations(engine: Engine) -> list:
+    """Apply pending migrations in order and return the versions applied.
+
+    Workers starting together take turns under ``migration_lock``; the applied versions are
+    read once the lock is held, so the later ones find nothing left to do. Migrations are also
+    idempotent (``checkfirst`` DDL, guarded updates) so a run interrupted halfway can resume.
+    """
+    with migration_lock(engine):
+        migration_metadata.create_all(bind=engine)
+        applied = get_applied_versions(engine)
+        newly_applied = []
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"🗄️ Applying migration {version}: {description}")
+            with engine.begin() as connection:
+                migrate(connection)
+            try:
+                with engine.begin() as connection:
+                    connection.execute(schema_migrations.insert().values(version=version, description=description))
+            except IntegrityError:
+                # Recorded by a process that ran without the lock (non-MySQL databases)
+                pass
+            newly_applied.append(version)
+    return newly_applied
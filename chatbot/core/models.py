@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -10,6 +10,10 @@ class UserRole(enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Admin user list, newest first
+        Index("ix_users_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
@@ -27,6 +31,12 @@ class User(Base):
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # History sidebar: a user's sessions by last update
+        Index("ix_chat_sessions_user_id_updated_at", "user_id", "updated_at"),
+        # Admin user activity: a user's sessions created since a date
+        Index("ix_chat_sessions_user_id_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), unique=True, index=True, nullable=False)
@@ -35,7 +45,7 @@ class ChatSession(Base):
     has_document_context = Column(Boolean, default=False)
     document_info = Column(Text, nullable=True)  # JSON string of document info
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())  # Set on insert so new sessions sort first
     
     # Relationships
     user = relationship("User", back_populates="chat_sessions")
@@ -43,6 +53,12 @@ class ChatSession(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Session transcripts in order, and per-session counts and first messages
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),
+        # Admin user activity: a user's messages since a date
+        Index("ix_messages_user_id_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -56,6 +72,44 @@ class Message(Base):
     user = relationship("User", back_populates="messages")
     chat_session = relationship("ChatSession", back_populates="messages")
 
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        # A retried submission with the same key returns the original job
+        UniqueConstraint("user_id", "idempotency_key", name="uq_analysis_jobs_user_idempotency_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), unique=True, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String(50), nullable=False)  # 'document_analysis' or 'secure_folder_analysis'
+    status = Column(String(20), default="queued", nullable=False, index=True)  # queued, running, succeeded, failed
+    idempotency_key = Column(String(255), nullable=True)
+    payload = Column(Text, nullable=False)  # JSON string of the job input
+    result = Column(Text, nullable=True)  # JSON string of the analysis response
+    error = Column(Text, nullable=True)
+    error_status = Column(Integer, nullable=True)  # HTTP status the analysis failed with
+    session_id = Column(String(255), nullable=True)  # Chat session holding the result
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # UTC, set by the application while the job runs
+    
+    # Relationships
+    user = relationship("User")
+
+class AnalysisProgress(Base):
+    __tablename__ = "analysis_progress"
+    
+    # Shared by every worker, so a progress poll can land on any of them
+    progress_id = Column(String(255), primary_key=True)  # Client progress id or job id
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    stage = Column(String(50), nullable=False, default="starting")
+    completed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    failed = Column(Text, nullable=False, default="[]")  # JSON list of failed file names
+    updated_at = Column(DateTime, nullable=False, index=True)  # UTC, set by the application
+
 class SecureFolderPermission(Base):
     __tablename__ = "secure_folder_permissions"
     
@@ -72,6 +126,11 @@ class SecureFolderPermission(Base):
 
 class ApiUsageStats(Base):
     __tablename__ = "api_usage_stats"
+    __table_args__ = (
+        # Usage dashboards: requests in a time window grouped by endpoint or user
+        Index("ix_api_usage_stats_created_at_endpoint", "created_at", "endpoint"),
+        Index("ix_api_usage_stats_created_at_user_id", "created_at", "user_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     endpoint = Column(String(255), nullable=False, index=True)
@@ -94,6 +153,10 @@ class ApiUsageStats(Base):
 
 class SystemErrorLog(Base):
     __tablename__ = "system_error_logs"
+    __table_args__ = (
+        # Error log filtered by type, newest first
+        Index("ix_system_error_logs_error_type_created_at", "error_type", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     error_type = Column(String(100), nullable=False, index=True)  # API_ERROR, PARSING_ERROR, etc.
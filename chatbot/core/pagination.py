@@ -0,0 +1,57 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import desc, tuple_
+
+# Largest page a client may ask for
+MAX_PAGE_SIZE = 500
+
+class InvalidCursorError(ValueError):
+    """A pagination cursor that was not issued by ``paginate`` (or not for this ordering), or one combined with an offset"""
+
+def encode_cursor(values: list) -> str:
+    """Opaque cursor holding the sort key of the last item of a page"""
+    payload = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(payload, list):
+            raise InvalidCursorError("Invalid pagination cursor")
+        values = [datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in payload]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursorError("Invalid pagination cursor")
+    if len(values) != size or any(value is None for value in values):
+        raise InvalidCursorError("Invalid pagination cursor")
+    return values
+
+def paginate(query, order_columns: list, limit: int, cursor: Optional[str] = None, descending: bool = False, skip: int = 0) -> tuple:
+    """Keyset pagination: return (items, next_cursor) for a page of ``query``.
+
+    ``order_columns`` must end with a unique column (the primary key) so the ordering is
+    total. With a cursor the page starts right after the item it was issued for, through a
+    range condition on the (composite) index, so every page costs the same whatever its
+    depth; without one, ``skip`` falls back to an offset. ``next_cursor`` is None on the last
+    page. ``limit`` must be between 1 and MAX_PAGE_SIZE. Raises InvalidCursorError for a
+    malformed cursor or a cursor given together with ``skip``.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if cursor and skip:
+        raise InvalidCursorError("skip cannot be combined with a cursor")
+    if cursor:
+        key = tuple_(*order_columns)
+        last = tuple_(*decode_cursor(cursor, len(order_columns)))
+        query = query.filter(key < last if descending else key > last)
+    query = query.order_by(*[desc(column) if descending else column for column in order_columns])
+    if skip:
+        query = query.offset(skip)
+
+    # One extra row tells whether there is a next page
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], column.key) for column in order_columns])
@@ -0,0 +1,45 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+class RequestSizeLimitMiddleware:
+    """Reject request bodies larger than ``max_bytes`` while they are still being received.
+
+    Starlette parses a multipart upload completely (spooling every file to disk) before the
+    route runs, so per-file limits checked in the route come too late to save bandwidth and
+    temp disk. A declared Content-Length over the limit is refused with 413 before any of the
+    body is read; bodies without one (chunked uploads) are counted as they arrive and fail
+    with 413 as soon as they cross the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Request body is larger than the {self.max_bytes // (1024 * 1024)} MB limit")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            error = self._too_large()
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the body parser, so the route's exception handling turns it into a 413
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
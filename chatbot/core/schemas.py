@@ -111,6 +111,7 @@ class ChatHistoryResponse(BaseModel):
 class ChatHistoryListResponse(BaseModel):
     chat_sessions: List[ChatHistoryResponse]
     total_count: int
+    next_cursor: Optional[str] = None
 
 class ChatSessionWithMessages(BaseModel):
     id: int
@@ -0,0 +1,39 @@
+import json
+
+# Headers that stop browsers and the nginx front from buffering Server-Sent Events
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def _chain_stream(first_chunk, stream):
+    try:
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+
+async def _empty_stream():
+    return
+    yield
+
+async def start_stream(stream):
+    """Pull the first chunk of ``stream`` before the response starts and return the whole stream.
+    
+    Errors raised before the first byte (circuit open, retries exhausted, deadline, unknown
+    session) reach the route as exceptions, so an HTTPException keeps its status and headers
+    instead of becoming an SSE error event behind a 200.
+    """
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        return _empty_stream()
+    except BaseException:
+        await stream.aclose()
+        raise
+    return _chain_stream(first_chunk, stream)
@@ -3,10 +3,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
 # Import configuration
-from config.settings import ALLOWED_ORIGINS
+from config.settings import ALLOWED_ORIGINS, MAX_REQUEST_BODY_MB
 
 # Import database setup
 from core.database import engine, get_db
+from core.migrations import run_migrations
 import core.models as models
 from core.models import User, ChatSession, Message
 import core.schemas as schemas
@@ -14,20 +15,30 @@ import core.schemas as schemas
 # Import statistics middleware
 # from core.statistics_middleware import StatisticsMiddleware
 
+# Import request size limit middleware
+from core.request_size_limit import RequestSizeLimitMiddleware
+
 # Import API routes
 from api.auth_routes import router as auth_router
 from api.chat_routes import router as chat_router
 from api.document_routes import router as document_router
 from api.admin_routes import router as admin_router
+from api.job_routes import router as job_router
 
 # Import dependencies
 from core.dependencies import get_current_user
 
+# Import model backend health for the health check
+from services.ai_service import get_llm_health
+from services.pdf_extraction import shutdown_extraction_pool
+from services.analysis_jobs import analysis_jobs
+from services.blob_store import document_store
+
 # Import rate limiting for status endpoint
 from rate_limiting.rate_limiter import get_client_ip, rate_limit_storage
 
-# Initialize database
-models.Base.metadata.create_all(bind=engine)
+# Initialize database (versioned migrations, see core/migrations.py)
+run_migrations(engine)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -39,6 +50,9 @@ app = FastAPI(
 # Add statistics middleware (before CORS) - temporarily disabled
 # app.add_middleware(StatisticsMiddleware)
 
+# Reject oversized request bodies before they are received (inside CORS so browsers see the 413)
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_BODY_MB * 1024 * 1024)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -46,13 +60,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+async def start_workers():
+    """Start the background analysis workers and release documents held by stopped workers"""
+    document_store.reap_dead_owners()
+    await analysis_jobs.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop the background analysis workers and the PDF extraction worker processes"""
+    await analysis_jobs.stop()
+    shutdown_extraction_pool()
+
 # Include API routes
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(document_router)
 app.include_router(admin_router)
+app.include_router(job_router)
 
 # ============================================================================
 # HEALTH CHECK ENDPOINTS
@@ -70,7 +98,10 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "ChatBot API"}
+    llm_health = get_llm_health()
+    # An open circuit means model calls are being rejected; the API itself is still up
+    status = "healthy" if llm_health["circuit_breaker"]["state"] == "closed" else "degraded"
+    return {"status": status, "service": "ChatBot API", "llm": llm_health}
 
 @app.get("/test/db")
 async def test_database(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
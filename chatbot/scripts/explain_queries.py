@@ -0,0 +1,76 @@
+"""Print the EXPLAIN plan of every hot query against the configured database.
+
+Run from the chatbot directory after the migrations have been applied:
+
+    python -m scripts.explain_queries [--user-id 1]
+
+Each query mirrors a query shape of core/crud.py, core/statistics_service.py or
+api/admin_routes.py; check that the plans use the composite indexes of core/migrations.py.
+"""
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import desc, func, tuple_
+from core.database import engine, SessionLocal
+from core.models import User, ChatSession, Message, ApiUsageStats, SystemErrorLog
+
+def hot_queries(db, user_id: int) -> list:
+    since = datetime.utcnow() - timedelta(hours=24)
+    session_ids = [row[0] for row in db.query(ChatSession.id).filter(ChatSession.user_id == user_id).limit(50)] or [0]
+    message_stats = db.query(
+        Message.session_id.label('session_id'),
+        func.count(Message.id).label('message_count'),
+        func.min(Message.id).label('first_message_id')
+    ).filter(Message.session_id.in_(session_ids)).group_by(Message.session_id).subquery()
+
+    return [
+        ("History page (crud.get_user_chat_sessions)",
+         db.query(ChatSession).filter(ChatSession.user_id == user_id).order_by(desc(ChatSession.updated_at)).limit(50)),
+        ("History page after a cursor (crud.get_user_chat_sessions_page)",
+         db.query(ChatSession).filter(ChatSession.user_id == user_id, tuple_(ChatSession.updated_at, ChatSession.id) < tuple_(since, 1000))
+         .order_by(desc(ChatSession.updated_at), desc(ChatSession.id)).limit(51)),
+        ("History counts and previews (crud.get_chat_history_with_previews)",
+         db.query(message_stats.c.session_id, message_stats.c.message_count, func.substr(Message.content, 1, 101))
+         .join(Message, Message.id == message_stats.c.first_message_id)),
+        ("Session transcript (crud.get_session_messages)",
+         db.query(Message).filter(Message.session_id == session_ids[0]).order_by(Message.created_at).limit(100)),
+        ("Admin user list (crud.get_all_users)",
+         db.query(User).order_by(desc(User.created_at)).limit(100)),
+        ("Admin user activity: sessions (admin_routes)",
+         db.query(ChatSession).filter(ChatSession.user_id == user_id, ChatSession.created_at >= since).order_by(ChatSession.created_at.desc()).limit(10)),
+        ("Admin user activity: messages (admin_routes)",
+         db.query(func.count(Message.id)).filter(Message.user_id == user_id, Message.created_at >= since, Message.message_type == 'user')),
+        ("Top endpoints (statistics_service.get_api_usage_stats)",
+         db.query(ApiUsageStats.endpoint, func.count(ApiUsageStats.id).label('count'))
+         .filter(ApiUsageStats.created_at >= since).group_by(ApiUsageStats.endpoint).order_by(desc('count')).limit(10)),
+        ("Active users (admin_routes statistics overview)",
+         db.query(func.count(func.distinct(ApiUsageStats.user_id))).filter(ApiUsageStats.created_at >= since)),
+        ("Error log by type (statistics_service.get_error_logs)",
+         db.query(SystemErrorLog).filter(SystemErrorLog.created_at >= since, SystemErrorLog.error_type == 'API_ERROR')
+         .order_by(desc(SystemErrorLog.created_at)).limit(50))
+    ]
+
+def explain(connection, query) -> list:
+    compiled = query.statement.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup) if compiled.positional else compiled.params
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    result = connection.exec_driver_sql(prefix + str(compiled), params)
+    return list(result.keys()), result.fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", type=int, default=1, help="User whose history and activity queries are explained")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for title, query in hot_queries(db, args.user_id):
+            columns, rows = explain(db.connection(), query)
+            print(f"\n=== {title} ===")
+            print(" | ".join(columns))
+            for row in rows:
+                print(" | ".join("" if value is None else str(value) for value in row))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,199 @@
-from google import genai
-from google.genai import types
+import asyncio
+from google.genai import types, errors
 from typing import List
 from fastapi import UploadFile, HTTPException
-from config.settings import GEMINI_API_KEY, CGI_SYSTEM_INSTRUCTION, CGI_CREATIVE_WRITING_INSTRUCTION, CGI_CODE_DEVELOPMENT_INSTRUCTION, CGI_PROBLEM_SOLVING_INSTRUCTION
+from services.llm_backend import create_llm_backend
+from services.file_cache import FileUploadCache, content_hash
+from services.context_cache import ContextCache
+from services.response_cache import create_response_cache, make_cache_key
+from services.history_manager import ConversationHistory, estimate_tokens
+from services.request_coalescer import RequestCoalescer, make_request_key
+from services.blob_store import document_store, BlobStore
+from services.session_store import create_session_store
+from services.resilience import CircuitBreaker, ResilientCaller
+from config.settings import GEMINI_MAX_CONCURRENT_REQUESTS, GEMINI_FILE_CACHE_ENABLED, GEMINI_FILE_CACHE_TTL_SECONDS, GEMINI_CONTEXT_CACHE_ENABLED, GEMINI_CONTEXT_CACHE_TTL_SECONDS, GEMINI_CONTEXT_CACHE_MIN_TOKENS, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_DISABLED_ROUTES, HISTORY_TOKEN_BUDGET, HISTORY_RECENT_TURNS, SESSION_STORE_BACKEND, SESSION_STORE_PATH, SESSION_MAX_SESSIONS, SESSION_MAX_BYTES, SESSION_IDLE_TTL_SECONDS, LLM_DEFAULT_DEADLINE_SECONDS, LLM_ROUTE_DEADLINES, LLM_MAX_RETRIES, LLM_RETRY_BACKOFF_BASE_SECONDS, LLM_RETRY_BACKOFF_MAX_SECONDS, LLM_HEDGE_DELAY_SECONDS, LLM_ATTEMPT_TIMEOUT_RATIO, LLM_STREAM_IDLE_TIMEOUT_SECONDS, LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RECOVERY_SECONDS, CGI_HISTORY_SUMMARY_INSTRUCTION, CGI_SYSTEM_INSTRUCTION, CGI_CREATIVE_WRITING_INSTRUCTION, CGI_CODE_DEVELOPMENT_INSTRUCTION, CGI_PROBLEM_SOLVING_INSTRUCTION
 
-# Initialize Gemini client
+# Initialize the LLM backend (Gemini, or the local fake for offline load tests)
 try:
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-    print("✓ Gemini AI client initialized successfully")
+    llm_backend = create_llm_backend()
+    print(f"✓ LLM backend initialized successfully ({llm_backend.name})")
 except Exception as e:
-    raise Exception(f"Failed to initialize Gemini client: {e}")
+    raise Exception(f"Failed to initialize LLM backend: {e}")
 
-# In-memory storage for document sessions
-document_sessions = {}
+# Global cap on in-flight Gemini calls for this worker
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENT_REQUESTS)
 
-async def chat_without_context(message: str) -> str:
-    """Generate AI response without document context using appropriate system instruction"""
+# Deadlines, retries, hedging and circuit breaking around every model call
+resilient_caller = ResilientCaller(
+    CircuitBreaker(LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RECOVERY_SECONDS),
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF_BASE_SECONDS,
+    LLM_RETRY_BACKOFF_MAX_SECONDS,
+    LLM_HEDGE_DELAY_SECONDS,
+    LLM_ATTEMPT_TIMEOUT_RATIO
+)
+
+def _release_session_documents(session_id: str, session_data: dict):
+    """Release the documents of an evicted document session"""
+    document_store.release(session_data['document_hashes'], SESSION_BLOB_OWNER)
+
+# Document sessions: bounded, evicting store (in-memory, or SQLite shared by the workers)
+document_sessions = create_session_store(
+    SESSION_STORE_BACKEND,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_BYTES,
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_STORE_PATH,
+    on_evict=_release_session_documents
+)
+
+# In-memory sessions die with this worker, so their document references do too
+SESSION_BLOB_OWNER = document_store.process_owner if document_sessions.backend == "memory" else BlobStore.SHARED_OWNER
+
+# Each distinct PDF is uploaded once and referenced by URI on later turns
+document_upload_cache = FileUploadCache(llm_backend.upload_file, GEMINI_FILE_CACHE_TTL_SECONDS, GEMINI_FILE_CACHE_ENABLED)
+
+# Instruction + document prefixes are cached once and shared across turns and users
+context_cache = ContextCache(
+    llm_backend.create_cache,
+    llm_backend.delete_cache,
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    GEMINI_CONTEXT_CACHE_ENABLED
+)
+
+# Exact-match cache for answers that depend on neither documents nor history
+response_cache = create_response_cache(
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_REDIS_URL
+) if RESPONSE_CACHE_ENABLED else None
+
+# Identical concurrent generations share one in-flight Gemini call
+request_coalescer = RequestCoalescer()
+
+def get_ai_service_stats() -> dict:
+    """Cache and coalescing counters of the AI service layer for the admin panel"""
+    return {
+        "response_cache": response_cache.get_stats() if response_cache else {"enabled": False},
+        "context_cache": context_cache.get_stats(),
+        "file_uploads": document_upload_cache.get_stats(),
+        "coalescing": request_coalescer.get_stats(),
+        "resilience": resilient_caller.get_stats(),
+        "document_store": document_store.get_stats(),
+        "document_sessions": document_sessions.get_stats()
+    }
+
+def get_llm_health() -> dict:
+    """Backend name and circuit breaker state for the health check"""
+    return {
+        "backend": llm_backend.name,
+        "circuit_breaker": resilient_caller.breaker.get_state()
+    }
+
+def get_route_deadline(route: str = None) -> float:
+    """Deadline in seconds for the model calls of a route"""
+    return LLM_ROUTE_DEADLINES.get(route, LLM_DEFAULT_DEADLINE_SECONDS)
+
+async def prepare_request(contents: list, system_instruction: str, documents: list = None, use_context_cache: bool = True, document_hashes: list = None) -> tuple:
+    """Build (contents, config, cache_name) for a request, using cached context when available"""
+    documents = documents or []
+    document_hashes = document_hashes or [content_hash(data) for data in documents]
+    
+    async def load_document_parts():
+        return await document_upload_cache.get_parts(documents, keys=document_hashes)
+    
+    if use_context_cache:
+        # Only text documents have a known size; PDFs count as large
+        document_tokens = sum(estimate_tokens(document) for document in documents) if all(isinstance(document, str) for document in documents) else None
+        cache_name = await context_cache.get_cache_name(system_instruction, document_hashes, load_document_parts, document_tokens)
+        if cache_name:
+            # Instruction and documents live in the cache; only send the new turn
+            return contents, types.GenerateContentConfig(cached_content=cache_name), cache_name
     
+    document_parts = await load_document_parts()
+    return document_parts + contents, types.GenerateContentConfig(system_instruction=system_instruction), None
+
+def _is_stale_cache_error(error: Exception) -> bool:
+    """Whether a failed call should be retried without its cached context"""
+    return isinstance(error, errors.ClientError) and error.code in (400, 403, 404)
+
+async def generate_content(contents: list, system_instruction: str, documents: list = None, use_context_cache: bool = True, route: str = None) -> str:
+    """Run a Gemini generation on the async client without blocking the event loop.
+    
+    Concurrent calls with the same instruction, documents and contents share one request.
+    """
+    documents = documents or []
+    document_hashes = [content_hash(data) for data in documents]
+    request_key = make_request_key(system_instruction, document_hashes, contents)
+    return await request_coalescer.run(
+        request_key,
+        lambda: _generate_content(contents, system_instruction, documents, document_hashes, use_context_cache, route)
+    )
+
+async def _generate_content(contents: list, system_instruction: str, documents: list, document_hashes: list, use_context_cache: bool = True, route: str = None) -> str:
+    request_contents, config, cache_name = await prepare_request(contents, system_instruction, documents, use_context_cache, document_hashes)
+    
+    async def attempt():
+        async with gemini_semaphore:
+            return await llm_backend.generate(request_contents, config)
+    
+    try:
+        return await resilient_caller.call(attempt, get_route_deadline(route))
+    except Exception as e:
+        if not cache_name or not _is_stale_cache_error(e):
+            raise
+        # The cache expired or was deleted elsewhere; drop it and resend the full context
+        await context_cache.invalidate_name(cache_name)
+        return await _generate_content(contents, system_instruction, documents, document_hashes, use_context_cache=False, route=route)
+
+async def _open_stream(request_contents: list, config: types.GenerateContentConfig) -> tuple:
+    """Start a streaming call and wait for its first chunk, so start-up errors surface here.
+    
+    The concurrency permit covers the request up to its first chunk only: the rest of the
+    stream is paced by the client, and a slow reader must not hold a permit other calls need.
+    """
+    stream = llm_backend.generate_stream(request_contents, config)
+    try:
+        async with gemini_semaphore:
+            first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = None
+    except BaseException:
+        # Close the failed stream (and its HTTP response) before the caller retries
+        await stream.aclose()
+        raise
+    return first_chunk, stream
+
+async def stream_content(contents: list, system_instruction: str, documents: list = None, route: str = None):
+    """Yield text chunks as they arrive from the backend's streaming call.
+    
+    Failures before the first chunk are retried; once text has been sent the stream is not restarted.
+    """
+    request_contents, config, cache_name = await prepare_request(contents, system_instruction, documents)
+    deadline = get_route_deadline(route)
+    try:
+        first_chunk, stream = await resilient_caller.call(lambda: _open_stream(request_contents, config), deadline, hedge=False)
+    except Exception as e:
+        if not cache_name or not _is_stale_cache_error(e):
+            raise
+        # The cache expired or was deleted elsewhere; drop it and resend the full context
+        await context_cache.invalidate_name(cache_name)
+        uncached_contents, uncached_config, _ = await prepare_request(contents, system_instruction, documents, use_context_cache=False)
+        first_chunk, stream = await resilient_caller.call(lambda: _open_stream(uncached_contents, uncached_config), deadline, hedge=False)
+    
+    try:
+        if first_chunk is None:
+            return
+        yield first_chunk
+        async for chunk in resilient_caller.stream_chunks(stream, LLM_STREAM_IDLE_TIMEOUT_SECONDS):
+            yield chunk
+    finally:
+        await stream.aclose()
+
+def select_system_instruction(message: str) -> str:
+    """Pick the CGI system instruction matching the kind of request"""
     # Detect the type of request based on message content
     message_lower = message.lower()
     
@@ -29,48 +206,132 @@ async def chat_without_context(message: str) -> str:
     else:
         system_instruction = CGI_SYSTEM_INSTRUCTION
     
-    response = gemini_client.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=[message],
-        config=types.GenerateContentConfig(
-            system_instruction=system_instruction
-        )
-    )
-    return response.text
+    return system_instruction
 
-async def chat_with_document_context(message: str, session_id: str) -> str:
-    """Generate AI response with document context"""
-    session_data = document_sessions[session_id]
+def _use_response_cache(route: str = None) -> bool:
+    return response_cache is not None and route not in RESPONSE_CACHE_DISABLED_ROUTES
+
+async def chat_without_context(message: str, route: str = None) -> str:
+    """Generate AI response without document context using appropriate system instruction"""
+    system_instruction = select_system_instruction(message)
+    if not _use_response_cache(route):
+        return await generate_content([message], system_instruction, route=route)
     
-    # Build context with documents and conversation history
-    gemini_contents = []
+    cache_key = make_cache_key(system_instruction, message)
+    cached_response = await response_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+    
+    response_text = await generate_content([message], system_instruction, route=route)
+    await response_cache.set(cache_key, response_text)
+    return response_text
+
+async def stream_chat_without_context(message: str, route: str = None):
+    """Stream AI response chunks without document context"""
+    system_instruction = select_system_instruction(message)
+    use_cache = _use_response_cache(route)
+    
+    if use_cache:
+        cache_key = make_cache_key(system_instruction, message)
+        cached_response = await response_cache.get(cache_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+    
+    chunks = []
+    async for chunk in stream_content([message], system_instruction, route=route):
+        chunks.append(chunk)
+        yield chunk
+    
+    if use_cache:
+        await response_cache.set(cache_key, "".join(chunks))
+
+async def summarize_conversation(previous_summary: str, turns: list) -> str:
+    """Fold conversation turns into the rolling summary of a document session"""
+    contents = []
+    if previous_summary:
+        contents.append(f"Current summary:\n{previous_summary}")
+    contents.append("Conversation turns to fold in:\n" + "\n".join(turns))
+    return await generate_content(contents, CGI_HISTORY_SUMMARY_INSTRUCTION)
+
+def new_conversation_history(turns: list = None) -> ConversationHistory:
+    """Create a token-budgeted conversation history for a document session"""
+    return ConversationHistory(summarize_conversation, HISTORY_TOKEN_BUDGET, HISTORY_RECENT_TURNS, turns)
+
+def load_conversation_history(session_id: str, history_data: dict) -> ConversationHistory:
+    """Rebuild the conversation history of a stored session; background compactions are saved back"""
+    def on_compacted(previous_summary: str, folded_turns: list, summary: str):
+        session_data = document_sessions.get(session_id)
+        if session_data is None:
+            return
+        stored = session_data['conversation_history']
+        # Apply the fold only if no other turn has compacted the stored history meanwhile
+        if stored['summary'] != previous_summary or stored['turns'][:len(folded_turns)] != folded_turns:
+            return
+        stored['summary'] = summary
+        del stored['turns'][:len(folded_turns)]
+        document_sessions.set(session_id, session_data)
     
-    # Add all PDF files from the session
-    for file_content in session_data['file_contents']:
-        gemini_contents.append(
-            types.Part.from_bytes(
-                data=file_content,
-                mime_type='application/pdf',
-            )
-        )
+    return ConversationHistory.from_dict(history_data, summarize_conversation, HISTORY_TOKEN_BUDGET, HISTORY_RECENT_TURNS, on_compacted, key=session_id)
+
+def get_document_session(session_id: str) -> dict:
+    """Return a stored document session, or 404 if it was evicted or never existed"""
+    session_data = document_sessions.get(session_id)
+    if session_data is None:
+        raise HTTPException(status_code=404, detail="Document session not found or expired. Please analyze the documents again.")
+    return session_data
+
+def record_document_turn(session_id: str, message: str, response_text: str):
+    """Append a turn to the stored conversation history, compacting it in the background if needed"""
+    # Re-read the session so turns answered concurrently are not lost
+    session_data = document_sessions.get(session_id)
+    if session_data is None:
+        return
+    history = load_conversation_history(session_id, session_data['conversation_history'])
+    history.append(f"User: {message}")
+    history.append(f"Assistant: {response_text}")
+    session_data['conversation_history'] = history.to_dict()
+    document_sessions.set(session_id, session_data)
+    history.schedule_compaction()
+
+def build_document_chat_contents(session_id: str, session_data: dict, message: str) -> list:
+    """Build Gemini contents from conversation history and the new message"""
+    # Session documents are attached separately so they can be served from the context cache
+    gemini_contents = []
     
-    # Add conversation history
-    for msg in session_data['conversation_history']:
-        gemini_contents.append(msg)
+    # Add conversation history (rolling summary plus the latest turns)
+    gemini_contents.extend(load_conversation_history(session_id, session_data['conversation_history']).render())
     
     # Add current message
     gemini_contents.append(f"User: {message}")
     
-    response = gemini_client.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=gemini_contents,
-        config=types.GenerateContentConfig(
-            system_instruction=CGI_SYSTEM_INSTRUCTION
-        )
-    )
+    return gemini_contents
+
+async def chat_with_document_context(message: str, session_id: str, route: str = None) -> str:
+    """Generate AI response with document context"""
+    session_data = get_document_session(session_id)
+    gemini_contents = build_document_chat_contents(session_id, session_data, message)
+    
+    documents = await document_store.get_many(session_data['document_hashes'])
+    
+    response_text = await generate_content(gemini_contents, CGI_SYSTEM_INSTRUCTION, documents, route=route)
+    
+    # Update conversation history, folding old turns into the summary in the background
+    record_document_turn(session_id, message, response_text)
+    
+    return response_text
+
+async def stream_chat_with_document_context(message: str, session_id: str, route: str = None):
+    """Stream AI response chunks with document context"""
+    session_data = get_document_session(session_id)
+    gemini_contents = build_document_chat_contents(session_id, session_data, message)
+    
+    documents = await document_store.get_many(session_data['document_hashes'])
     
-    # Update conversation history
-    session_data['conversation_history'].append(f"User: {message}")
-    session_data['conversation_history'].append(f"Assistant: {response.text}")
+    chunks = []
+    async for chunk in stream_content(gemini_contents, CGI_SYSTEM_INSTRUCTION, documents, route=route):
+        chunks.append(chunk)
+        yield chunk
     
-    return response.text
+    # Update conversation history once the full answer is known
+    record_document_turn(session_id, message, "".join(chunks))
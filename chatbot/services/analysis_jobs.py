@@ -0,0 +1,285 @@
+import asyncio
+import json
+import uuid
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from core.database import SessionLocal
+import core.crud as crud
+from services.blob_store import document_store
+from services.document_service import analyze_uploaded_documents, analyze_secure_folder_documents, create_document_session, update_analysis_progress
+from config.settings import ANALYSIS_JOB_WORKERS, ANALYSIS_JOB_MAX_QUEUED, ANALYSIS_JOB_HEARTBEAT_SECONDS, ANALYSIS_JOB_STALE_SECONDS
+
+class AnalysisJobQueue:
+    """Bounded pool of background workers running long document analyses.
+
+    Jobs are rows of ``analysis_jobs``, so their status and result can be polled from any
+    HTTP worker; each job runs on the process that accepted it. A job is claimed with an
+    atomic queued -> running update, so queued jobs recovered at startup by several
+    processes still run once. A job interrupted by a shutdown goes back to the queue; running
+    jobs whose heartbeat stopped (their process died) are queued again by a periodic sweep.
+    Handlers are coroutines ``(job_id, user_id, payload) ->
+    result`` that open their own database sessions; the documents referenced by ``payload['document_hashes']`` are released
+    from the blob store once the job ends.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.handlers = {}
+        self.queue = None
+        self.tasks = []
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    def _ensure_started(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def start(self):
+        """Start the workers and pick up jobs left queued or interrupted by a previous run"""
+        self._ensure_started()
+        self._requeue_stale()
+        db = SessionLocal()
+        try:
+            recovered = crud.get_queued_analysis_job_ids(db)
+        finally:
+            db.close()
+        for job_id in recovered:
+            self.queue.put_nowait(job_id)
+        if recovered:
+            print(f"📋 Recovered {len(recovered)} queued analysis job(s)")
+        self.tasks.append(asyncio.create_task(self._sweep()))
+
+    def _requeue_stale(self) -> list:
+        """Re-queue the jobs of workers that died while running them; returns their ids"""
+        db = SessionLocal()
+        try:
+            job_ids = crud.requeue_stale_analysis_jobs(db, ANALYSIS_JOB_STALE_SECONDS)
+        finally:
+            db.close()
+        if job_ids:
+            self.requeued += len(job_ids)
+            print(f"📋 Re-queued {len(job_ids)} analysis job(s) interrupted by a stopped worker")
+        return job_ids
+
+    async def _sweep(self):
+        """Pick up the jobs of crashed workers while this one keeps running"""
+        while True:
+            await asyncio.sleep(ANALYSIS_JOB_STALE_SECONDS)
+            try:
+                for job_id in self._requeue_stale():
+                    self.queue.put_nowait(job_id)
+            except Exception as e:
+                print(f"⚠️ Could not sweep stale analysis jobs: {e}")
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue for the next start"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+
+    @staticmethod
+    def _release(payload: dict):
+        document_store.release(payload.get('document_hashes', []))
+
+    def submit(self, db: Session, user_id: int, kind: str, payload: dict, idempotency_key: Optional[str] = None) -> tuple:
+        """Queue a job and return (job, created); a known idempotency key returns the original job.
+
+        The payload's documents are released whenever the job is not queued, including when
+        the insert fails. Raises 503 when the queue is full.
+        """
+        self._ensure_started()
+        if self.queue.qsize() >= self.max_queued:
+            self._release(payload)
+            raise HTTPException(
+                status_code=503,
+                detail="Too many analyses are queued. Please try again in a few minutes.",
+                headers={"Retry-After": "60"}
+            )
+
+        try:
+            job = crud.create_analysis_job(db, str(uuid.uuid4()), user_id, kind, payload, idempotency_key)
+        except IntegrityError:
+            # The same submission was retried concurrently
+            db.rollback()
+            self._release(payload)
+            return crud.get_analysis_job_by_idempotency_key(db, user_id, idempotency_key), False
+        except Exception:
+            db.rollback()
+            self._release(payload)
+            raise
+
+        self.queue.put_nowait(job.job_id)
+        return job, True
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"⚠️ Analysis job {job_id} could not be run: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _heartbeat(self, job_id: str):
+        """Mark a running job as alive until cancelled"""
+        while True:
+            await asyncio.sleep(ANALYSIS_JOB_HEARTBEAT_SECONDS)
+            db = SessionLocal()
+            try:
+                crud.touch_analysis_job(db, job_id)
+            except Exception as e:
+                print(f"⚠️ Could not record the heartbeat of analysis job {job_id}: {e}")
+            finally:
+                db.close()
+
+    @staticmethod
+    def _requeue(job_id: str):
+        db = SessionLocal()
+        try:
+            crud.requeue_analysis_job(db, job_id)
+        except Exception as e:
+            # The stale sweep picks it up once its heartbeat is old enough
+            print(f"⚠️ Could not re-queue interrupted analysis job {job_id}: {e}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _finish(job_id: str, record, *args):
+        """Record the outcome of a job (``crud.complete_analysis_job`` or ``crud.fail_analysis_job``) in a session of its own"""
+        db = SessionLocal()
+        try:
+            record(db, crud.get_analysis_job(db, job_id), *args)
+        finally:
+            db.close()
+
+    async def _run(self, job_id: str):
+        # The claim's session is closed before the analysis so no connection is held during model calls
+        db = SessionLocal()
+        try:
+            job = crud.claim_analysis_job(db, job_id)
+            if job is None:
+                return
+            kind, user_id, payload = job.kind, job.user_id, json.loads(job.payload)
+        finally:
+            db.close()
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await self.handlers[kind](job_id, user_id, payload)
+            self._finish(job_id, crud.complete_analysis_job, result)
+            self.succeeded += 1
+        except asyncio.CancelledError:
+            # Shutting down: the job runs again after the restart, so its documents are kept
+            self._requeue(job_id)
+            self.requeued += 1
+            raise
+        except HTTPException as e:
+            self._finish(job_id, crud.fail_analysis_job, str(e.detail), e.status_code)
+            self.failed += 1
+        except Exception as e:
+            print(f"Analysis job {job_id} failed: {e}")
+            self._finish(job_id, crud.fail_analysis_job, str(e))
+            self.failed += 1
+        finally:
+            heartbeat.cancel()
+        # Only a recorded outcome releases the documents
+        self._release(payload)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "max_queued": self.max_queued,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "requeued": self.requeued
+        }
+
+def job_status(job) -> dict:
+    """Public view of a job for the polling endpoints"""
+    status = {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "session_id": job.session_id
+    }
+    if job.status == "failed":
+        status["error"] = job.error
+    return status
+
+def _save_analysis(session_id: str, user_id: int, prompt: str, response_text: str, document_info: dict, title: str):
+    """Store a finished analysis as a chat session, in a session opened only for the write"""
+    db = SessionLocal()
+    try:
+        crud.save_document_analysis(db, session_id, user_id, prompt, response_text, document_info, title)
+    finally:
+        db.close()
+
+async def run_document_analysis_job(job_id: str, user_id: int, payload: dict) -> dict:
+    """Analyze uploaded documents (stored in the blob store at submission) and save the result"""
+    prompt = payload['prompt']
+    file_info = payload['file_info']
+    file_contents = await document_store.get_many(payload['document_hashes'])
+
+    analysis = await analyze_uploaded_documents(file_contents, file_info, prompt, payload.get('mode', "auto"), route="/analyze-document")
+    response_text = analysis["response"]
+
+    session_id = str(uuid.uuid4())
+    document_info = {"files": file_info, "total_files": len(file_contents)}
+    title = prompt[:50] + "..." if len(prompt) > 50 else prompt
+    _save_analysis(session_id, user_id, prompt, response_text, document_info, title)
+    await create_document_session(file_contents, file_info, prompt, response_text, user_id, session_id)
+
+    return {
+        **analysis,
+        "files_processed": file_info,
+        "total_files": len(file_contents),
+        "session_id": session_id
+    }
+
+async def run_secure_folder_analysis_job(job_id: str, user_id: int, payload: dict) -> dict:
+    """Analyze the secure folder CVs and save the result; progress is reported under the job id"""
+    prompt = payload['prompt']
+
+    def report_progress(stage, completed, total, failed):
+        update_analysis_progress(job_id, user_id, stage=stage, completed=completed, total=total, failed=failed)
+
+    analysis = await analyze_secure_folder_documents(prompt, payload['mode'], report_progress, route="/analyze-secure-folder")
+    file_contents = analysis["file_contents"]
+    file_info = analysis["file_info"]
+
+    session_id = str(uuid.uuid4())
+    document_info = {"files": file_info, "total_files": len(file_contents), "source": "secure_folder"}
+    title = f"CV Analysis: {prompt[:30]}..." if len(prompt) > 30 else f"CV Analysis: {prompt}"
+    _save_analysis(session_id, user_id, prompt, analysis["response"], document_info, title)
+    await create_document_session(file_contents, file_info, prompt, analysis["response"], user_id, session_id, source='secure_folder')
+
+    return {
+        "response": analysis["response"],
+        "files_processed": file_info,
+        "total_files": len(file_contents),
+        "session_id": session_id,
+        "source": "secure_folder",
+        "mode": analysis["mode"],
+        "failed_files": analysis["failed_files"],
+        "retrieval": analysis["retrieval"]
+    }
+
+# Shared background queue for long analyses
+analysis_jobs = AnalysisJobQueue(ANALYSIS_JOB_WORKERS, ANALYSIS_JOB_MAX_QUEUED)
+analysis_jobs.register("document_analysis", run_document_analysis_job)
+analysis_jobs.register("secure_folder_analysis", run_secure_folder_analysis_job)
@@ -0,0 +1,286 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from services.file_cache import content_hash
+from config.settings import BLOB_STORE_PATH, BLOB_CACHE_MAX_BYTES, BLOB_GC_GRACE_SECONDS, BLOB_GC_INTERVAL_SECONDS, SESSION_IDLE_TTL_SECONDS
+
+class BlobStore:
+    """Content-addressed, reference-counted store for session documents.
+
+    Documents (extracted text or PDF bytes) are written once to ``root`` under their SHA-256
+    and shared by every session that references them; a byte-bounded in-memory LRU keeps the
+    hot ones off the disk. Reference counts live in SQLite next to the blobs, and blobs nobody
+    references for ``gc_grace_seconds`` are deleted by ``collect_garbage``.
+
+    References are counted per owner. Holders that outlive the process (analysis jobs,
+    the SQLite session store) use ``SHARED_OWNER``; in-memory sessions die with their process,
+    so they hold references under ``process_owner``. Each process refreshes a heartbeat while it
+    uses the store, and the references of a process silent for ``process_owner_ttl_seconds``
+    (any session it held has expired by then) are dropped at startup and before each
+    garbage collection, so restarts do not leave blobs referenced forever.
+    """
+
+    SHARED_OWNER = "shared"
+    HEARTBEAT_INTERVAL_SECONDS = 60
+
+    def __init__(self, root: str, cache_max_bytes: int, gc_grace_seconds: float, gc_interval_seconds: float, process_owner_ttl_seconds: float):
+        self.root = root
+        self.cache_max_bytes = cache_max_bytes
+        self.gc_grace_seconds = gc_grace_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self.process_owner_ttl_seconds = process_owner_ttl_seconds
+        self.process_owner = f"process:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        self.last_heartbeat = 0.0
+        # hash -> document, most recently used last
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.last_gc = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.collected = 0
+        self.reaped_owners = 0
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.root, "blobs.db"), check_same_thread=False)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL,
+                    released_at REAL
+                )
+            """)
+            has_refs = self._connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blob_refs'").fetchone()
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS blob_refs (
+                    owner TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    refcount INTEGER NOT NULL,
+                    PRIMARY KEY (owner, hash)
+                )
+            """)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS blob_owners (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+            if not has_refs:
+                # References taken before they were counted per owner cannot be attributed
+                self._connection.execute(
+                    "INSERT INTO blob_refs (owner, hash, refcount) SELECT ?, hash, refcount FROM blobs WHERE refcount > 0",
+                    (self.SHARED_OWNER,)
+                )
+            self._connection.commit()
+        return self._connection
+
+    def _heartbeat(self, connection: sqlite3.Connection):
+        """Mark this process as alive; the write is skipped if done recently"""
+        now = time.time()
+        if now - self.last_heartbeat < self.HEARTBEAT_INTERVAL_SECONDS:
+            return
+        self.last_heartbeat = now
+        connection.execute(
+            "INSERT INTO blob_owners (owner, heartbeat_at) VALUES (?, ?) ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+            (self.process_owner, now)
+        )
+        connection.commit()
+
+    def _drop_references(self, connection: sqlite3.Connection, owner: str, key: str, count: int):
+        """Remove up to ``count`` of ``owner``'s references to a blob (no commit)"""
+        row = connection.execute("SELECT refcount FROM blob_refs WHERE owner = ? AND hash = ?", (owner, key)).fetchone()
+        count = min(count, row[0]) if row else 0
+        if count <= 0:
+            return
+        connection.execute("UPDATE blob_refs SET refcount = refcount - ? WHERE owner = ? AND hash = ?", (count, owner, key))
+        connection.execute("DELETE FROM blob_refs WHERE owner = ? AND hash = ? AND refcount <= 0", (owner, key))
+        connection.execute(
+            "UPDATE blobs SET refcount = MAX(refcount - ?, 0), "
+            "released_at = CASE WHEN refcount <= ? THEN ? ELSE released_at END WHERE hash = ?",
+            (count, count, time.time(), key)
+        )
+
+    def reap_dead_owners(self) -> int:
+        """Drop the references of processes that stopped sending heartbeats; returns how many were reaped"""
+        connection = self._connect()
+        self.last_heartbeat = 0.0
+        self._heartbeat(connection)
+        dead_owners = [row[0] for row in connection.execute(
+            "SELECT owner FROM blob_owners WHERE heartbeat_at < ? AND owner != ?",
+            (time.time() - self.process_owner_ttl_seconds - self.HEARTBEAT_INTERVAL_SECONDS, self.process_owner)
+        )]
+        for owner in dead_owners:
+            for key, count in connection.execute("SELECT hash, refcount FROM blob_refs WHERE owner = ?", (owner,)).fetchall():
+                self._drop_references(connection, owner, key, count)
+            connection.execute("DELETE FROM blob_owners WHERE owner = ?", (owner,))
+        connection.commit()
+        if dead_owners:
+            print(f"🧹 Released the document references of {len(dead_owners)} stopped worker(s)")
+        self.reaped_owners += len(dead_owners)
+        return len(dead_owners)
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{'txt' if kind == 'text' else 'pdf'}")
+
+    @staticmethod
+    def _size(document) -> int:
+        return len(document.encode('utf-8')) if isinstance(document, str) else len(document)
+
+    def _cache_put(self, key: str, document):
+        if isinstance(document, memoryview):
+            # Copy views of mapped files so the cache does not keep the mapping (and the file) open
+            document = bytes(document)
+        size = self._size(document)
+        if size > self.cache_max_bytes:
+            return
+        if key not in self.cache:
+            self.cache_bytes += size
+        self.cache[key] = document
+        self.cache.move_to_end(key)
+        while self.cache_bytes > self.cache_max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= self._size(evicted)
+
+    def _cache_drop(self, key: str):
+        document = self.cache.pop(key, None)
+        if document is not None:
+            self.cache_bytes -= self._size(document)
+
+    @staticmethod
+    def _write(path: str, document):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name so concurrent writers of the same blob never interleave
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        if isinstance(document, str):
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(document)
+        else:
+            with open(temp_path, 'wb') as f:
+                f.write(document)
+        os.replace(temp_path, path)
+
+    async def put(self, document, owner: str = SHARED_OWNER) -> str:
+        """Store a document (if new), take a reference to it for ``owner`` and return its hash"""
+        key = content_hash(document)
+        kind = 'text' if isinstance(document, str) else 'pdf'
+        connection = self._connect()
+        self._heartbeat(connection)
+        row = connection.execute("SELECT kind FROM blobs WHERE hash = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(self._path(key, kind)):
+            await asyncio.to_thread(self._write, self._path(key, kind), document)
+        connection.execute(
+            "INSERT INTO blobs (hash, kind, size, refcount, released_at) VALUES (?, ?, ?, 1, NULL) "
+            "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1, released_at = NULL",
+            (key, kind, self._size(document))
+        )
+        connection.execute(
+            "INSERT INTO blob_refs (owner, hash, refcount) VALUES (?, ?, 1) "
+            "ON CONFLICT(owner, hash) DO UPDATE SET refcount = refcount + 1",
+            (owner, key)
+        )
+        connection.commit()
+        self._cache_put(key, document)
+        return key
+
+    async def put_many(self, documents: list, owner: str = SHARED_OWNER) -> list:
+        """Store several documents; if one fails, the references already taken are dropped"""
+        keys = []
+        try:
+            for document in documents:
+                keys.append(await self.put(document, owner))
+        except BaseException:
+            self.release(keys, owner)
+            raise
+        return keys
+
+    async def get(self, key: str):
+        """Return the document stored under ``key``"""
+        document = self.cache.get(key)
+        if document is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return document
+
+        self.misses += 1
+        connection = self._connect()
+        self._heartbeat(connection)
+        row = connection.execute("SELECT kind FROM blobs WHERE hash = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(f"Document {key} is not in the blob store")
+        path = self._path(key, row[0])
+        if row[0] == 'text':
+            document = await asyncio.to_thread(self._read_text, path)
+        else:
+            document = await asyncio.to_thread(self._read_bytes, path)
+        self._cache_put(key, document)
+        return document
+
+    @staticmethod
+    def _read_text(path: str) -> str:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    @staticmethod
+    def _read_bytes(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def get_many(self, keys: list) -> list:
+        # Cache hits do not touch the database, so keep the heartbeat alive here too
+        self._heartbeat(self._connect())
+        return [await self.get(key) for key in keys]
+
+    def release(self, keys: list, owner: str = SHARED_OWNER):
+        """Drop one of ``owner``'s references to each document; unreferenced ones are collected after the grace period"""
+        if not keys:
+            return
+        connection = self._connect()
+        self._heartbeat(connection)
+        for key in keys:
+            self._drop_references(connection, owner, key, 1)
+        connection.commit()
+        if time.time() - self.last_gc >= self.gc_interval_seconds:
+            self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        """Delete blobs that have been unreferenced for longer than the grace period"""
+        self.reap_dead_owners()
+        self.last_gc = time.time()
+        connection = self._connect()
+        rows = connection.execute(
+            "SELECT hash, kind FROM blobs WHERE refcount = 0 AND released_at < ?",
+            (time.time() - self.gc_grace_seconds,)
+        ).fetchall()
+        for key, kind in rows:
+            self._cache_drop(key)
+            try:
+                os.remove(self._path(key, kind))
+            except FileNotFoundError:
+                pass
+        connection.executemany("DELETE FROM blobs WHERE hash = ? AND refcount = 0", [(key,) for key, _ in rows])
+        connection.commit()
+        self.collected += len(rows)
+        return len(rows)
+
+    def get_stats(self) -> dict:
+        connection = self._connect()
+        blobs, referenced, disk_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(refcount > 0), 0), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        return {
+            "blobs": blobs,
+            "referenced_blobs": referenced,
+            "disk_bytes": disk_bytes,
+            "cached_blobs": len(self.cache),
+            "cache_bytes": self.cache_bytes,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "collected": self.collected,
+            "reaped_owners": self.reaped_owners
+        }
+
+# Shared store of the documents held by document sessions; a worker silent for longer than the
+# session idle TTL no longer holds any live in-memory session
+document_store = BlobStore(BLOB_STORE_PATH, BLOB_CACHE_MAX_BYTES, BLOB_GC_GRACE_SECONDS, BLOB_GC_INTERVAL_SECONDS, SESSION_IDLE_TTL_SECONDS)
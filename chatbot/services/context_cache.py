@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import time
+from typing import Optional
+
+class ContextCache:
+    """Keeps one Gemini cached-content entry per (system instruction, document set) pair.
+
+    The creator is an async callable ``(system_instruction, document_parts, ttl_seconds) -> name``
+    and the deleter an async callable ``(name) -> None``. Entries are shared by every caller that
+    sends the same instruction and documents, so users analysing the same secure-folder corpus
+    reuse one cache.
+    """
+
+    def __init__(self, creator, deleter, ttl_seconds: int, min_tokens: int, enabled: bool = True, failure_ttl_seconds: int = 600):
+        self.creator = creator
+        self.deleter = deleter
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+        self.failure_ttl_seconds = failure_ttl_seconds
+        # cache key -> {'name', 'expires_at', 'document_hashes'}
+        self.entries = {}
+        # cache key -> timestamp before which creation is not retried
+        self.failed = {}
+        self._locks = {}
+        self.hits = 0
+        self.creates = 0
+        self.failures = 0
+
+    @staticmethod
+    def make_key(system_instruction: str, document_hashes: list) -> str:
+        digest = hashlib.sha256(system_instruction.encode('utf-8'))
+        for document_hash in document_hashes:
+            digest.update(document_hash.encode('ascii'))
+        return digest.hexdigest()
+
+    def _get_valid_entry(self, key: str):
+        entry = self.entries.get(key)
+        # Leave a minute of slack so a request never starts against an expiring cache
+        if entry and entry['expires_at'] - 60 > time.time():
+            return entry
+        self.entries.pop(key, None)
+        return None
+
+    async def get_cache_name(self, system_instruction: str, document_hashes: list, load_document_parts, document_tokens: int = None) -> Optional[str]:
+        """Return the cached-content name for this context, creating it on first use.
+
+        ``load_document_parts`` is an async callable only awaited when the entry has to be created.
+        ``document_tokens`` is the estimated size of the documents when known (text documents);
+        PDFs are assumed to be large enough to cache.
+        Returns None when caching is disabled, the context is too small to be cached, or
+        creation recently failed; callers then send the full context inline.
+        """
+        if not self.enabled:
+            return None
+        # Instruction-only and short text contexts are below the model's minimum cacheable size
+        if (not document_hashes or document_tokens is not None) and len(system_instruction) // 4 + (document_tokens or 0) < self.min_tokens:
+            return None
+
+        key = self.make_key(system_instruction, document_hashes)
+        entry = self._get_valid_entry(key)
+        if entry:
+            self.hits += 1
+            return entry['name']
+        if self.failed.get(key, 0) > time.time():
+            return None
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._get_valid_entry(key)
+            if entry:
+                self.hits += 1
+                return entry['name']
+            if self.failed.get(key, 0) > time.time():
+                return None
+            try:
+                document_parts = await load_document_parts()
+                name = await self.creator(system_instruction, document_parts, self.ttl_seconds)
+            except Exception as e:
+                self.failures += 1
+                self.failed[key] = time.time() + self.failure_ttl_seconds
+                print(f"⚠️ Context cache creation failed, sending context inline: {e}")
+                return None
+            finally:
+                self._locks.pop(key, None)
+
+            self.entries[key] = {
+                'name': name,
+                'expires_at': time.time() + self.ttl_seconds,
+                'document_hashes': list(document_hashes)
+            }
+            self.failed.pop(key, None)
+            self.creates += 1
+            return name
+
+    async def invalidate(self, key: str):
+        """Forget a cache entry and delete it on the Gemini side (best effort)"""
+        entry = self.entries.pop(key, None)
+        if entry:
+            try:
+                await self.deleter(entry['name'])
+            except Exception as e:
+                print(f"⚠️ Failed to delete context cache {entry['name']}: {e}")
+
+    async def invalidate_name(self, name: str):
+        """Invalidate the entry with the given cached-content name, e.g. after the server rejected it"""
+        for key, entry in list(self.entries.items()):
+            if entry['name'] == name:
+                await self.invalidate(key)
+
+    async def invalidate_document(self, document_hash: str):
+        """Invalidate every cached context that includes the given document"""
+        for key, entry in list(self.entries.items()):
+            if document_hash in entry['document_hashes']:
+                await self.invalidate(key)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "cached_contexts": len(self.entries),
+            "hits": self.hits,
+            "creates": self.creates,
+            "failures": self.failures
+        }
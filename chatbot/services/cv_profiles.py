@@ -0,0 +1,373 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Optional
+from services.ai_service import generate_content
+from services.file_cache import content_hash
+from config.settings import CV_PROFILE_STORE_PATH, CV_PROFILE_VERSION, MAP_REDUCE_CONCURRENCY, CGI_CV_PROFILE_INSTRUCTION, CGI_CV_PROFILE_QUERY_INSTRUCTION
+
+class CVProfileStore:
+    """Structured CV profiles persisted in SQLite, keyed by the content hash of the CV.
+
+    A CV is sent to the model for extraction once per profile ``version``; every later
+    query or map-reduce analysis over the same content reads the stored profile.
+    """
+
+    def __init__(self, db_path: str, version: int):
+        self.db_path = db_path
+        self.version = version
+        self.hits = 0
+        self.extractions = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS cv_profiles (
+                    sha256 TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    profile TEXT NOT NULL,
+                    extracted_at REAL NOT NULL,
+                    PRIMARY KEY (sha256, version)
+                )
+            """)
+            self._connection.commit()
+        return self._connection
+
+    def get_many(self, keys: list) -> dict:
+        """hash -> profile for the keys that already have a profile"""
+        if not keys:
+            return {}
+        placeholders = ", ".join("?" * len(keys))
+        rows = self._connect().execute(
+            f"SELECT sha256, profile FROM cv_profiles WHERE version = ? AND sha256 IN ({placeholders})",
+            (self.version, *keys)
+        ).fetchall()
+        return {key: json.loads(profile) for key, profile in rows}
+
+    def put(self, key: str, profile: dict):
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO cv_profiles (sha256, version, profile, extracted_at) VALUES (?, ?, ?, ?)",
+            (key, self.version, json.dumps(profile, ensure_ascii=False), time.time())
+        )
+        connection.commit()
+
+    def get_stats(self) -> dict:
+        profiles = self._connect().execute("SELECT COUNT(*) FROM cv_profiles WHERE version = ?", (self.version,)).fetchone()[0]
+        return {
+            "profiles": profiles,
+            "version": self.version,
+            "hits": self.hits,
+            "extractions": self.extractions,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures
+        }
+
+def _string_list(value) -> list:
+    if not isinstance(value, list):
+        return []
+    return [str(item).strip() for item in value if isinstance(item, (str, int, float)) and str(item).strip()]
+
+def _dict_list(value, keys: tuple) -> list:
+    if not isinstance(value, list):
+        return []
+    return [{key: item.get(key) for key in keys} for item in value if isinstance(item, dict)]
+
+def parse_profile(text: str) -> dict:
+    """Parse and normalize the model's JSON profile; raises ValueError when there is none"""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError("No JSON object in the profile response")
+    data = json.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("The profile is not a JSON object")
+    return _normalize_profile(data)
+
+def _normalize_profile(data: dict) -> dict:
+    try:
+        years = float(data.get("years_of_experience")) if data.get("years_of_experience") is not None else None
+    except (TypeError, ValueError):
+        years = None
+
+    languages = []
+    for item in data.get("languages") or []:
+        if isinstance(item, dict) and item.get("language"):
+            languages.append({"language": str(item["language"]).strip(), "level": item.get("level")})
+        elif isinstance(item, str) and item.strip():
+            languages.append({"language": item.strip(), "level": None})
+
+    return {
+        "name": data.get("name"),
+        "current_title": data.get("current_title"),
+        "location": data.get("location"),
+        "years_of_experience": years,
+        "experience": _dict_list(data.get("experience"), ("title", "company", "start", "end")),
+        "real_estate_experience": bool(data.get("real_estate_experience")),
+        "skills": _string_list(data.get("skills")),
+        "languages": languages,
+        "education": _dict_list(data.get("education"), ("degree", "field", "institution", "year")),
+        "certifications": _string_list(data.get("certifications")),
+        "achievements": _string_list(data.get("achievements")),
+        "summary": data.get("summary") or ""
+    }
+
+def notes_profile(text: str) -> dict:
+    """Profile holding only the model's free-text notes, for answers that are not profile JSON"""
+    return {**_normalize_profile({}), "summary": text.strip(), "notes_only": True}
+
+async def extract_profile(document, filename: str, route: str = None) -> dict:
+    """Have the model extract the structured profile of one CV"""
+    # One-off per-CV context, not worth a cached-content entry
+    response_text = await generate_content(
+        [f"Extract the structured profile of this CV ({filename})."],
+        CGI_CV_PROFILE_INSTRUCTION,
+        [document],
+        use_context_cache=False,
+        route=route
+    )
+    try:
+        return parse_profile(response_text)
+    except ValueError as e:
+        if not response_text.strip():
+            raise
+        # Keep the notes rather than dropping the CV; filters cannot match them, the model can still read them
+        print(f"⚠️ No structured profile for {filename} ({e}), keeping the free-text notes")
+        return notes_profile(response_text)
+
+async def load_profiles(documents: list, file_info: list, route: str = None, progress_callback=None) -> tuple:
+    """Return (profiles, failed_files) for the documents, extracting only CVs without a stored profile.
+
+    ``profiles`` is aligned with ``documents`` (None where extraction failed).
+    ``progress_callback(completed, failed_files)`` is called as profiles become available.
+    """
+    keys = [content_hash(document) for document in documents]
+    stored = cv_profile_store.get_many(list(set(keys)))
+    profiles = [stored.get(key) for key in keys]
+    failed_files = []
+    completed = sum(profile is not None for profile in profiles)
+    cv_profile_store.hits += completed
+    semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+
+    def report():
+        if progress_callback:
+            progress_callback(completed, list(failed_files))
+
+    async def extract(index: int):
+        nonlocal completed
+        filename = file_info[index]["filename"]
+        async with semaphore:
+            try:
+                profiles[index] = await extract_profile(documents[index], filename, route)
+                if profiles[index].get("notes_only"):
+                    # Not stored, so the next analysis tries the extraction again
+                    cv_profile_store.fallbacks += 1
+                else:
+                    cv_profile_store.put(keys[index], profiles[index])
+                    cv_profile_store.extractions += 1
+            except Exception as e:
+                print(f"⚠️ CV profile extraction failed for {filename}: {e}")
+                cv_profile_store.failures += 1
+                failed_files.append(filename)
+            finally:
+                completed += 1
+                report()
+
+    report()
+    await asyncio.gather(*(extract(index) for index, profile in enumerate(profiles) if profile is None))
+    return profiles, failed_files
+
+def render_profile(filename: str, profile: dict) -> str:
+    """Compact one-line JSON of a profile, as sent to the model instead of the CV"""
+    return json.dumps({"file": filename, **profile}, ensure_ascii=False, separators=(",", ":"))
+
+def _fold(text: str) -> str:
+    """Lowercase, accent-free text with apostrophes turned into spaces"""
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return re.sub(r"\s+", " ", re.sub(r"[’'`]", " ", text)).strip()
+
+# Language names (English and French) -> English name used in profiles
+LANGUAGE_NAMES = {
+    "english": "english", "anglais": "english",
+    "french": "french", "francais": "french",
+    "arabic": "arabic", "arabe": "arabic",
+    "spanish": "spanish", "espagnol": "spanish",
+    "german": "german", "allemand": "german",
+    "italian": "italian", "italien": "italian",
+    "portuguese": "portuguese", "portugais": "portuguese",
+    "dutch": "dutch", "neerlandais": "dutch",
+    "chinese": "chinese", "chinois": "chinese",
+    "russian": "russian", "russe": "russian",
+    "amazigh": "amazigh", "tamazight": "amazigh", "berber": "amazigh", "berbere": "amazigh"
+}
+
+# Skills and tools that "experience in X" may name; anything else there (a city, a sector) goes to the model
+SKILL_TERMS = {
+    "python", "java", "javascript", "typescript", "c", "c++", "c#", ".net", "php", "ruby", "go", "rust", "kotlin", "swift",
+    "sql", "mysql", "postgresql", "oracle", "mongodb", "nosql", "html", "css", "react", "angular", "vue", "node.js", "django",
+    "spring", "docker", "kubernetes", "aws", "azure", "gcp", "linux", "git", "devops", "machine learning", "data analysis",
+    "sap", "salesforce", "excel", "power bi", "tableau", "ms project", "primavera", "autocad", "revit", "bim", "archicad",
+    "sketchup", "civil 3d", "robot structural analysis", "etabs", "agile", "scrum", "prince2", "pmp", "itil"
+}
+
+_COMPARISON_WORDS = {
+    "more than": ">", "over": ">", "above": ">", "greater than": ">", "plus de": ">",
+    "at least": ">=", "minimum": ">=", "min": ">=", "au moins": ">=",
+    "less than": "<", "under": "<", "below": "<", "fewer than": "<", "moins de": "<",
+    "at most": "<=", "maximum": "<=", "max": "<=", "up to": "<=", "au plus": "<=",
+    "exactly": "="
+}
+
+_FILLER = re.compile(
+    r"^(?:(?:which|who|list|show|find|give|me|all|the|candidates?|cvs?|people|profiles?|applicants?|"
+    r"with|that|has|have|having|are|is|where|whose|any|quels?|quelles?|candidats?|qui|avec|ont|les)\s+)+"
+)
+_YEARS = r"(?:years?|yrs?|ans)"
+_EXPERIENCE = rf"(?:(?:total\s+)?(?:{_YEARS}\s+(?:of\s+|d\s+)?)?experience)"
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_EXPERIENCE_PATTERNS = [
+    (re.compile(rf"{_EXPERIENCE}\s*(>=|<=|>|<|==|=)\s*{_NUMBER}\s*(?:{_YEARS})?"), None),
+    (re.compile(rf"(?:{_EXPERIENCE}\s+(?:of\s+|de\s+)?)?({'|'.join(sorted(_COMPARISON_WORDS, key=len, reverse=True))})\s+{_NUMBER}\s*\+?\s*(?:{_YEARS})?(?:\s+(?:of\s+|d\s+)?experience)?"), None),
+    (re.compile(rf"{_NUMBER}\s*\+\s*(?:{_YEARS})?(?:\s+(?:of\s+|d\s+)?experience)?"), ">=")
+]
+_LANGUAGE_PATTERNS = [
+    re.compile(r"(?:speaks?|speaking|fluent\s+in|parlent|parle)\s+([a-z]+)"),
+    re.compile(r"([a-z]+)[\s-]speak(?:ers?|ing)")
+]
+_REAL_ESTATE_PATTERN = re.compile(
+    r"(?:(?:real\s+estate|property|construction)\s+experience|experience\s+in\s+(?:real\s+estate|property(?:\s+management)?|construction)|experience\s+immobiliere)"
+)
+_SKILL_PATTERNS = [
+    re.compile(r"(?:skills?\s+(?:in\s+)?|knows?\s+|knowledge\s+of\s+|experience\s+with\s+|proficient\s+in\s+|skilled\s+in\s+|uses?\s+|maitrise\s+)(.+)"),
+    re.compile(r"(.+?)\s+skills?")
+]
+_EXPERIENCE_IN_PATTERN = re.compile(r"experience\s+(?:in|en)\s+(.+)")
+
+def _parse_clause(clause: str) -> Optional[dict]:
+    clause = _FILLER.sub("", clause).strip()
+    if not clause:
+        return None
+
+    if re.search(rf"{_YEARS}|experience", clause):
+        for pattern, fixed_operator in _EXPERIENCE_PATTERNS:
+            match = pattern.fullmatch(clause)
+            if match:
+                operator = fixed_operator or _COMPARISON_WORDS.get(match.group(1), match.group(1))
+                return {"field": "years_of_experience", "op": "=" if operator == "==" else operator, "value": float(match.groups()[-1])}
+
+    for pattern in _LANGUAGE_PATTERNS:
+        match = pattern.fullmatch(clause)
+        if match:
+            language = LANGUAGE_NAMES.get(match.group(1))
+            return {"field": "languages", "op": "contains", "value": language} if language else None
+
+    if _REAL_ESTATE_PATTERN.fullmatch(clause):
+        return {"field": "real_estate_experience", "op": "is", "value": True}
+
+    match = _EXPERIENCE_IN_PATTERN.fullmatch(clause)
+    if match:
+        # "experience in Casablanca" is not a skill filter
+        return {"field": "skills", "op": "contains", "value": match.group(1)} if match.group(1) in SKILL_TERMS else None
+
+    for pattern in _SKILL_PATTERNS:
+        match = pattern.fullmatch(clause)
+        if match and len(match.group(1).split()) <= 3:
+            return {"field": "skills", "op": "contains", "value": match.group(1)}
+    return None
+
+def parse_profile_query(query: str) -> Optional[list]:
+    """Turn a simple filter query into conditions, or None when it needs the model.
+
+    Understands clauses such as "years of experience > 5", "at least 3 years", "speaks French",
+    "real estate experience" or "knows Python", joined with "and" or commas.
+    """
+    folded = _fold(query).rstrip("?.! ")
+    clauses = [clause for clause in re.split(r"\s*(?:,|;|&|\band\b|\bet\b)\s*", folded) if clause]
+    conditions = [_parse_clause(clause) for clause in clauses]
+    if not conditions or any(condition is None for condition in conditions):
+        return None
+    return conditions
+
+def profile_matches(profile: dict, conditions: list) -> bool:
+    """Whether a profile satisfies every condition; unknown values never match"""
+    for condition in conditions:
+        field, operator, value = condition["field"], condition["op"], condition["value"]
+        if field == "years_of_experience":
+            years = profile.get("years_of_experience")
+            if years is None:
+                return False
+            if not {">": years > value, ">=": years >= value, "<": years < value, "<=": years <= value, "=": years == value}[operator]:
+                return False
+        elif field == "languages":
+            if not any(LANGUAGE_NAMES.get(_fold(item["language"]), _fold(item["language"])) == value for item in profile.get("languages", [])):
+                return False
+        elif field == "real_estate_experience":
+            if profile.get("real_estate_experience") is not value:
+                return False
+        elif field == "skills":
+            needle = re.compile(rf"(?<!\w){re.escape(value)}(?!\w)")
+            if not any(needle.search(_fold(skill)) for skill in profile.get("skills", []) + profile.get("certifications", [])):
+                return False
+    return True
+
+def _describe_match(filename: str, profile: dict) -> str:
+    details = [detail for detail in (
+        profile.get("name"),
+        profile.get("current_title"),
+        f"{profile['years_of_experience']:g} years of experience" if profile.get("years_of_experience") is not None else None
+    ) if detail]
+    return f"- {filename}" + (f": {', '.join(details)}" if details else "")
+
+async def answer_profile_query(query: str, documents: list, file_info: list, route: str = None) -> dict:
+    """Answer a filter or comparison question over CVs from their structured profiles.
+
+    Queries understood by ``parse_profile_query`` are answered locally; anything else is
+    sent to the model with the compact profiles only, never the CVs themselves. So are
+    filters over notes-only profiles, which local filters cannot evaluate.
+    """
+    profiles, failed_files = await load_profiles(documents, file_info, route)
+    available = [(info["filename"], profile) for info, profile in zip(file_info, profiles) if profile is not None]
+    conditions = parse_profile_query(query)
+
+    if conditions is not None and not any(profile.get("notes_only") for _, profile in available):
+        matches = [(filename, profile) for filename, profile in available if profile_matches(profile, conditions)]
+        if matches:
+            answer = f"{len(matches)} of {len(available)} candidate(s) match:\n" + "\n".join(_describe_match(filename, profile) for filename, profile in matches)
+        else:
+            answer = f"None of the {len(available)} candidate(s) match."
+        method = "local"
+    else:
+        matches = []
+        profile_lines = "\n".join(render_profile(filename, profile) for filename, profile in available)
+        answer = await generate_content(
+            [f"Candidate profiles:\n{profile_lines}", f"Question: {query}"],
+            CGI_CV_PROFILE_QUERY_INSTRUCTION,
+            route=route
+        )
+        method = "model"
+
+    if failed_files:
+        answer += f"\n\nNote: the following CV(s) could not be profiled and were not considered: {', '.join(failed_files)}."
+
+    return {
+        "response": answer,
+        "method": method,
+        "conditions": conditions,
+        "matches": [{"filename": filename, **profile} for filename, profile in matches],
+        "profiles_considered": len(available),
+        "failed_files": failed_files
+    }
+
+# Shared store of extracted CV profiles
+cv_profile_store = CVProfileStore(CV_PROFILE_STORE_PATH, CV_PROFILE_VERSION)
@@ -1,13 +1,30 @@
-from typing import List
+from typing import List, Optional
+import asyncio
+import os
+import re
 import uuid
 from fastapi import UploadFile, HTTPException
-from google import genai
-from google.genai import types
-from services.ai_service import gemini_client, document_sessions
-from config.settings import CGI_SYSTEM_INSTRUCTION, CGI_CV_ANALYSIS_INSTRUCTION
+from core.database import SessionLocal
+import core.crud as crud
+from services.ai_service import generate_content, stream_content, new_conversation_history, document_sessions, SESSION_BLOB_OWNER
+from services.pdf_extraction import prepare_document_file, split_pdf_document, pdf_page_count
+from services.upload_service import spool_upload
+from services.blob_store import document_store
+from services.cv_profiles import load_profiles, render_profile
+from services.secure_folder_index import secure_folder_index
+from services.retrieval import select_relevant_documents
+from config.settings import CGI_SYSTEM_INSTRUCTION, CGI_CV_ANALYSIS_INSTRUCTION, CGI_DOCUMENT_CHUNK_INSTRUCTION, MAP_REDUCE_MIN_FILES, MAP_REDUCE_MIN_SUCCESS_RATIO, CHUNKED_ANALYSIS_MIN_PAGES, CHUNKED_ANALYSIS_PAGES_PER_CHUNK, CHUNKED_ANALYSIS_CONCURRENCY, SECURE_CV_FOLDER_PATH
+
+ANALYSIS_PROGRESS_TTL = 60 * 60  # Forget progress entries after an hour
+
+# "auto" picks "chunked" when a document has CHUNKED_ANALYSIS_MIN_PAGES pages or more
+DOCUMENT_ANALYSIS_MODES = ("auto", "single", "chunked")
+
+# Page markers written by the PDF text extraction
+PAGE_MARKER = re.compile(r"^\[Page (\d+)\]$", re.MULTILINE)
 
 async def process_uploaded_files(files: List[UploadFile]) -> tuple:
-    """Process and validate uploaded PDF files"""
+    """Process and validate uploaded PDF files, extracting their text where possible"""
     file_contents = []
     file_info = []
     
@@ -18,29 +35,26 @@ async def process_uploaded_files(files: List[UploadFile]) -> tuple:
                 detail=f"File {file.filename} is not a PDF. Only PDF files are supported"
             )
         
-        file_content = await file.read()
-        file_contents.append(file_content)
-        file_info.append({
-            "filename": file.filename,
-            "size": len(file_content)
-        })
+        # Stream to a spool file so large uploads never sit in memory whole
+        upload = await spool_upload(file)
+        try:
+            info = {
+                "filename": file.filename,
+                "size": upload.size
+            }
+            # Text PDFs are sent as compact text; scanned ones stay as bytes
+            file_contents.append(await prepare_document_file(upload.path, upload.sha256, info))
+            file_info.append(info)
+        finally:
+            upload.discard()
     
     return file_contents, file_info
 
-async def analyze_documents_with_ai(file_contents: list, prompt: str, file_count: int) -> str:
-    """Analyze documents using AI"""
-    # Prepare content for Gemini
+def build_analysis_request(prompt: str, file_count: int) -> tuple:
+    """Build the prompt contents and pick the system instruction for a document analysis"""
+    # Documents are attached by the AI service, from the context cache when possible
     gemini_contents = []
     
-    # Add all PDF files
-    for file_content in file_contents:
-        gemini_contents.append(
-            types.Part.from_bytes(
-                data=file_content,
-                mime_type='application/pdf',
-            )
-        )
-    
     # Add the prompt
     # Determine if this is CV analysis by checking file content or prompt keywords
     is_cv_analysis = any(keyword in prompt.lower() for keyword in 
@@ -53,24 +67,288 @@ async def analyze_documents_with_ai(file_contents: list, prompt: str, file_count
         f"Based on the {file_count} PDF document(s) provided above, please answer the following question: {prompt}"
     )
 
+    return gemini_contents, system_instruction
+
+async def analyze_documents_with_ai(file_contents: list, prompt: str, file_count: int, route: str = None) -> str:
+    """Analyze documents using AI"""
+    gemini_contents, system_instruction = build_analysis_request(prompt, file_count)
+    
     # Generate response
-    response = gemini_client.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=gemini_contents,
-        config=types.GenerateContentConfig(
-            system_instruction=system_instruction
+    return await generate_content(gemini_contents, system_instruction, file_contents, route=route)
+
+async def stream_analyze_documents_with_ai(file_contents: list, prompt: str, file_count: int, route: str = None):
+    """Stream the document analysis chunk by chunk"""
+    gemini_contents, system_instruction = build_analysis_request(prompt, file_count)
+    
+    async for chunk in stream_content(gemini_contents, system_instruction, file_contents, route=route):
+        yield chunk
+
+def split_text_pages(text: str) -> list:
+    """(page_number, page_text) of extracted document text, using its page markers"""
+    markers = list(PAGE_MARKER.finditer(text))
+    return [
+        (int(marker.group(1)), text[marker.end():markers[index + 1].start() if index + 1 < len(markers) else len(text)].strip())
+        for index, marker in enumerate(markers)
+    ]
+
+async def document_page_count(document, info: dict) -> Optional[int]:
+    """Page count recorded at extraction, counting only PDFs that were never extracted"""
+    if info.get("pages"):
+        return info["pages"]
+    if isinstance(document, str):
+        return len(split_text_pages(document)) or None
+    return await pdf_page_count(document)
+
+async def split_document_chunks(document, info: dict, pages_per_chunk: int) -> list:
+    """Split a document into page-range chunks ({'filename', 'first_page', 'last_page', 'content'}).
+    
+    Extracted text is split on its page markers; PDFs are split into smaller PDFs in the
+    process pool. Documents that cannot be split are returned as a single chunk.
+    """
+    filename = info["filename"]
+    chunks = []
+    if isinstance(document, str):
+        pages = split_text_pages(document)
+        for start in range(0, len(pages), pages_per_chunk):
+            group = pages[start:start + pages_per_chunk]
+            content = f"=== Document: {filename}, pages {group[0][0]}-{group[-1][0]} of {pages[-1][0]} ===\n" + "\n\n".join(
+                f"[Page {number}]\n{page}" for number, page in group if page
+            )
+            chunks.append({"filename": filename, "first_page": group[0][0], "last_page": group[-1][0], "content": content})
+    elif not info.get("pages") or info["pages"] > pages_per_chunk:
+        # A PDF known to fit in one chunk is not parsed again just to be copied
+        for first_page, last_page, data in await split_pdf_document(document, pages_per_chunk) or []:
+            chunks.append({"filename": filename, "first_page": first_page, "last_page": last_page, "content": data})
+    
+    return chunks or [{"filename": filename, "first_page": None, "last_page": None, "content": document}]
+
+async def analyze_documents_chunked(file_contents: list, file_info: list, prompt: str, route: str = None) -> dict:
+    """Analyze very large documents in two steps: concurrent summaries of page ranges, then one answer over them.
+    
+    Each chunk call is small and has its own deadline, so long documents finish predictably instead
+    of hitting the context window or the route deadline in one huge request. Chunks whose summary
+    fails are skipped and reported in ``failed_chunks`` as long as enough of them succeed.
+    """
+    chunks = []
+    for document, info in zip(file_contents, file_info):
+        chunks.extend(await split_document_chunks(document, info, CHUNKED_ANALYSIS_PAGES_PER_CHUNK))
+    
+    semaphore = asyncio.Semaphore(CHUNKED_ANALYSIS_CONCURRENCY)
+    summaries = [None] * len(chunks)
+    failed_chunks = []
+    
+    def chunk_label(chunk: dict) -> str:
+        if chunk["first_page"] is None:
+            return chunk["filename"]
+        return f"{chunk['filename']}, pages {chunk['first_page']}-{chunk['last_page']}"
+    
+    async def summarize(index: int):
+        chunk = chunks[index]
+        async with semaphore:
+            try:
+                # One-off chunk context, not worth a cached-content entry
+                summaries[index] = await generate_content(
+                    [f"These are {chunk_label(chunk)}. Question about the whole document: {prompt}"],
+                    CGI_DOCUMENT_CHUNK_INSTRUCTION,
+                    [chunk["content"]],
+                    use_context_cache=False,
+                    route=route
+                )
+            except Exception as e:
+                print(f"⚠️ Chunk summary failed for {chunk_label(chunk)}: {e}")
+                failed_chunks.append(chunk_label(chunk))
+    
+    await asyncio.gather(*(summarize(index) for index in range(len(chunks))))
+    
+    succeeded = len(chunks) - len(failed_chunks)
+    if succeeded == 0 or succeeded / len(chunks) < MAP_REDUCE_MIN_SUCCESS_RATIO:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Could only analyze {succeeded} of {len(chunks)} page ranges. Please try again later."
         )
+    
+    chunk_notes = "\n\n".join(
+        f"### {chunk_label(chunk)}\n{summary}"
+        for chunk, summary in zip(chunks, summaries) if summary is not None
     )
+    _, system_instruction = build_analysis_request(prompt, len(file_contents))
+    reduce_contents = [
+        f"Below are notes on consecutive page ranges of {len(file_contents)} document(s).\n\n{chunk_notes}"
+    ]
+    if failed_chunks:
+        reduce_contents.append(
+            f"Note: the following page range(s) could not be analyzed and are not included: {', '.join(failed_chunks)}. Mention this in your answer."
+        )
+    reduce_contents.append(f"Using only these notes, please answer the following question: {prompt}")
+    
+    response_text = await generate_content(reduce_contents, system_instruction, route=route)
+    return {"response": response_text, "chunks": len(chunks), "failed_chunks": failed_chunks}
 
-    return response.text
+async def analyze_uploaded_documents(file_contents: list, file_info: list, prompt: str, mode: str = "auto", route: str = None) -> dict:
+    """Analyze uploaded documents in one request, or page-chunked for very large PDFs.
+    
+    Returns the response and the mode used, plus the chunk counts for chunked analyses.
+    """
+    if mode not in DOCUMENT_ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'auto', 'single' or 'chunked'")
+    
+    if mode == "auto":
+        page_counts = [await document_page_count(document, info) for document, info in zip(file_contents, file_info)]
+        mode = "chunked" if any(count and count >= CHUNKED_ANALYSIS_MIN_PAGES for count in page_counts) else "single"
+    
+    if mode == "chunked":
+        return {**await analyze_documents_chunked(file_contents, file_info, prompt, route), "mode": "chunked"}
+    
+    response_text = await analyze_documents_with_ai(file_contents, prompt, len(file_contents), route=route)
+    return {"response": response_text, "mode": "single"}
+
+def update_analysis_progress(progress_id: str, user_id, **fields):
+    """Record the progress of a running analysis in the database so any worker can answer polls"""
+    db = SessionLocal()
+    try:
+        crud.save_analysis_progress(db, progress_id, user_id, ANALYSIS_PROGRESS_TTL, **fields)
+    except Exception as e:
+        # Progress is informational; never fail the analysis over it
+        db.rollback()
+        print(f"⚠️ Could not record analysis progress {progress_id}: {e}")
+    finally:
+        db.close()
+
+async def analyze_documents_map_reduce(file_contents: list, file_info: list, prompt: str, progress_callback=None, route: str = None) -> dict:
+    """Analyze many CVs in two stages: per-CV structured profiles (map), then one comparative answer (reduce).
+    
+    Profiles are extracted in parallel and stored by CV content, so CVs analyzed before cost no
+    model call. ``progress_callback(stage, completed, total, failed)`` is called as profiles become
+    available. CVs whose extraction fails are skipped and reported in ``failed_files`` as long as
+    enough of them succeed.
+    """
+    total = len(file_contents)
+    
+    def report(stage: str, completed: int, failed_files: list):
+        if progress_callback:
+            progress_callback(stage, completed, total, failed_files)
+    
+    profiles, failed_files = await load_profiles(
+        file_contents,
+        file_info,
+        route,
+        lambda completed, failed: report("map", completed, failed)
+    )
+    
+    succeeded = total - len(failed_files)
+    if succeeded == 0 or succeeded / total < MAP_REDUCE_MIN_SUCCESS_RATIO:
+        report("failed", total, failed_files)
+        raise HTTPException(
+            status_code=502,
+            detail=f"Could only analyze {succeeded} of {total} CVs. Please try again later."
+        )
+    
+    report("reduce", total, failed_files)
+    candidate_profiles = "\n".join(
+        render_profile(file_info[index]['filename'], profile)
+        for index, profile in enumerate(profiles) if profile is not None
+    )
+    reduce_contents = [
+        f"Below are structured profiles (JSON, one per line) extracted from {succeeded} candidate CV(s).\n\n{candidate_profiles}"
+    ]
+    if failed_files:
+        reduce_contents.append(
+            f"Note: the following CV(s) could not be analyzed and are not included: {', '.join(failed_files)}. Mention this in your answer."
+        )
+    reduce_contents.append(f"Using only these profiles, please answer the following request: {prompt}")
+    
+    response_text = await generate_content(reduce_contents, CGI_CV_ANALYSIS_INSTRUCTION, route=route)
+    report("done", total, failed_files)
+    
+    return {"response": response_text, "failed_files": failed_files}
+
+async def analyze_secure_folder_documents(prompt: str, mode: str = "auto", progress_callback=None, route: str = None) -> dict:
+    """Analyze the secure folder CVs for a prompt.
+    
+    mode: "single" sends every selected CV in one request, "map_reduce" compares per-CV profiles,
+    "auto" picks map-reduce for large folders. Returns the response with the analyzed documents,
+    the mode used, the failed files and the retrieval summary.
+    """
+    if mode not in ("auto", "single", "map_reduce"):
+        raise HTTPException(status_code=400, detail="mode must be 'auto', 'single' or 'map_reduce'")
+    
+    if not os.path.exists(SECURE_CV_FOLDER_PATH):
+        raise HTTPException(status_code=404, detail="Secure folder not found")
+    
+    # Read the CVs from the folder index; only new or changed PDFs are re-read and re-extracted
+    file_contents, file_info = await secure_folder_index.load_documents()
+    
+    if not file_contents:
+        raise HTTPException(
+            status_code=404, 
+            detail="No PDF files found in secure folder. Please contact an administrator to upload CV files."
+        )
+    
+    # Only the CVs that best match the prompt are sent to the model
+    file_contents, file_info, retrieval = select_relevant_documents(prompt, file_contents, file_info)
+    
+    # Generate AI response with CV analysis focus
+    cv_analysis_prompt = f"""
+        You are analyzing CVs from a confidential recruitment process. Please provide:
+        
+        User Request: {prompt}
+        
+        Guidelines for CV Analysis:
+        - Maintain confidentiality and professionalism
+        - Focus on relevant skills, experience, and qualifications
+        - Provide comparative analysis when requested
+        - Respect privacy by not revealing personal details unless specifically asked
+        - Summarize key findings and recommendations
+        
+        Please analyze the CVs and respond to the user's request.
+        """
+    
+    failed_files = []
+    if mode == "map_reduce" or (mode == "auto" and len(file_contents) >= MAP_REDUCE_MIN_FILES):
+        mode = "map_reduce"
+        result = await analyze_documents_map_reduce(file_contents, file_info, prompt, progress_callback, route=route)
+        response_text = result["response"]
+        failed_files = result["failed_files"]
+    else:
+        mode = "single"
+        if progress_callback:
+            progress_callback("analyzing", 0, len(file_contents), [])
+        response_text = await analyze_documents_with_ai(file_contents, cv_analysis_prompt, len(file_contents), route=route)
+        if progress_callback:
+            progress_callback("done", len(file_contents), len(file_contents), [])
+    
+    return {
+        "response": response_text,
+        "file_contents": file_contents,
+        "file_info": file_info,
+        "mode": mode,
+        "failed_files": failed_files,
+        "retrieval": retrieval
+    }
 
-def create_document_session(file_contents: list, file_info: list, prompt: str, response_text: str, user_id=None) -> str:
+async def create_document_session(file_contents: list, file_info: list, prompt: str, response_text: str, user_id=None, session_id: str = None, source: str = None) -> str:
     """Create a new document session and return session ID"""
-    session_id = str(uuid.uuid4())
-    document_sessions[session_id] = {
-        'file_contents': file_contents,
+    session_id = session_id or str(uuid.uuid4())
+    # Sessions reference documents by hash; identical CVs are stored once however many sessions use them
+    document_hashes = await document_store.put_many(file_contents, SESSION_BLOB_OWNER)
+    session_data = {
+        'document_hashes': document_hashes,
         'file_info': file_info,
-        'conversation_history': [f"User: {prompt}", f"Assistant: {response_text}"],
+        'conversation_history': new_conversation_history([f"User: {prompt}", f"Assistant: {response_text}"]).to_dict(),
         'user_id': user_id
     }
+    if source:
+        session_data['source'] = source
+    document_sessions.set(session_id, session_data)
     return session_id
+
+def delete_document_session(session_id: str):
+    """Forget a document session and release its documents"""
+    session_data = document_sessions.delete(session_id)
+    if session_data:
+        document_store.release(session_data['document_hashes'], SESSION_BLOB_OWNER)
+
+def delete_user_document_sessions(user_id: int):
+    """Forget every document session of a user"""
+    for session_id in document_sessions.session_ids_for_user(user_id):
+        delete_document_session(session_id)
@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+import time
+from google.genai import types
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest used to key documents (PDF bytes, memory-mapped PDFs or extracted text) by content"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+class FileUploadCache:
+    """Uploads each distinct document once and hands out file references for later requests.
+
+    The uploader is an async callable ``(data, mime_type) -> (uri, name)``; the Gemini Files API
+    in production, or a local stand-in when testing.
+    """
+
+    def __init__(self, uploader, ttl_seconds: int, enabled: bool = True):
+        self.uploader = uploader
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        # content hash -> {'uri', 'name', 'mime_type', 'expires_at'}
+        self.entries = {}
+        self._locks = {}
+        self.hits = 0
+        self.uploads = 0
+        self.failures = 0
+
+    def _get_valid_entry(self, key: str):
+        entry = self.entries.get(key)
+        if entry and entry['expires_at'] > time.time():
+            return entry
+        self.entries.pop(key, None)
+        return None
+
+    async def get_part(self, data, mime_type: str = 'application/pdf', key: str = None) -> types.Part:
+        """Return a Part for the document, uploading it only the first time its content is seen"""
+        if isinstance(data, str):
+            # Extracted text is sent inline; only PDFs go through the Files API
+            return types.Part.from_text(text=data)
+        if not self.enabled:
+            # Inline parts need real bytes; memory-mapped documents are copied only here
+            return types.Part.from_bytes(data=bytes(data), mime_type=mime_type)
+
+        key = key or content_hash(data)
+        entry = self._get_valid_entry(key)
+        if entry is None:
+            # One upload per hash even when several requests need it at once
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                entry = self._get_valid_entry(key)
+                if entry is None:
+                    try:
+                        uri, name = await self.uploader(data, mime_type)
+                    except Exception as e:
+                        # Fall back to inline bytes so the request still goes through
+                        self.failures += 1
+                        print(f"⚠️ Document upload failed, sending inline bytes: {e}")
+                        return types.Part.from_bytes(data=bytes(data), mime_type=mime_type)
+
+                    entry = {
+                        'uri': uri,
+                        'name': name,
+                        'mime_type': mime_type,
+                        'expires_at': time.time() + self.ttl_seconds
+                    }
+                    self.entries[key] = entry
+                    self.uploads += 1
+                else:
+                    self.hits += 1
+            self._locks.pop(key, None)
+        else:
+            self.hits += 1
+
+        return types.Part.from_uri(file_uri=entry['uri'], mime_type=entry['mime_type'])
+
+    async def get_parts(self, file_contents: list, mime_type: str = 'application/pdf', keys: list = None) -> list:
+        """Return Parts for several documents, uploading new ones concurrently"""
+        keys = keys or [None] * len(file_contents)
+        return list(await asyncio.gather(*(self.get_part(data, mime_type, key) for data, key in zip(file_contents, keys))))
+
+    def forget(self, key: str):
+        """Drop the cached reference for a content hash"""
+        return self.entries.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "cached_files": len(self.entries),
+            "hits": self.hits,
+            "uploads": self.uploads,
+            "failures": self.failures
+        }
@@ -0,0 +1,99 @@
+import asyncio
+
+# In-flight background compactions, keyed by session id; a session's history object is
+# rebuilt on every turn, so the guard cannot live on the instance
+_compactions = {}
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) that avoids a count_tokens round-trip"""
+    return len(text) // 4 + 1
+
+class ConversationHistory:
+    """Conversation turns of a document session, kept under a token budget.
+
+    The latest turns are kept verbatim; once the history grows past the budget the older
+    turns are folded into a rolling summary by the ``summarizer`` coroutine
+    ``(previous_summary, turns) -> summary``. Only the newly folded turns are sent to the
+    summarizer, so each compaction costs the same however long the conversation is.
+    ``on_compacted(previous_summary, folded_turns, summary)`` is called after each compaction
+    so a session store can save the result. Histories sharing a ``key`` (the session id) run
+    at most one background compaction at a time.
+    """
+
+    def __init__(self, summarizer, token_budget: int, recent_turns: int, turns: list = None, summary: str = "", on_compacted=None, key: str = None):
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.turns = list(turns or [])
+        self.summary = summary
+        self.on_compacted = on_compacted
+        self.key = key if key is not None else id(self)
+
+    def to_dict(self) -> dict:
+        return {"turns": list(self.turns), "summary": self.summary}
+
+    @classmethod
+    def from_dict(cls, data: dict, summarizer, token_budget: int, recent_turns: int, on_compacted=None, key: str = None) -> "ConversationHistory":
+        return cls(summarizer, token_budget, recent_turns, data.get("turns"), data.get("summary", ""), on_compacted, key)
+
+    def append(self, turn: str):
+        self.turns.append(turn)
+
+    def token_count(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(turn) for turn in self.turns)
+
+    def render(self) -> list:
+        """History entries to send to the model, summary first"""
+        if not self.summary:
+            return list(self.turns)
+        return [f"Summary of the earlier conversation: {self.summary}"] + self.turns
+
+    def _fold_count(self) -> int:
+        """How many of the oldest turns to fold into the summary"""
+        if self.token_count() <= self.token_budget:
+            return 0
+
+        # Keep recent turns while they fit in half the budget, so compaction runs rarely;
+        # always keep at least the latest exchange
+        kept_tokens = 0
+        kept = 0
+        for turn in reversed(self.turns):
+            turn_tokens = estimate_tokens(turn)
+            if kept >= 2 and (kept >= self.recent_turns or kept_tokens + turn_tokens > self.token_budget // 2):
+                break
+            kept_tokens += turn_tokens
+            kept += 1
+        return len(self.turns) - kept
+
+    async def compact(self):
+        """Fold the oldest turns into the rolling summary if the history is over budget"""
+        fold_count = self._fold_count()
+        if fold_count <= 0:
+            return
+
+        folded = self.turns[:fold_count]
+        previous_summary = self.summary
+        self.summary = await self.summarizer(previous_summary, folded)
+        # Turns appended while summarizing stay after the folded ones
+        del self.turns[:fold_count]
+        if self.on_compacted:
+            self.on_compacted(previous_summary, folded, self.summary)
+
+    def schedule_compaction(self):
+        """Compact in the background so the current turn does not wait for the summary"""
+        if self._fold_count() <= 0:
+            return
+        running = _compactions.get(self.key)
+        if running and not running.done():
+            return
+        _compactions[self.key] = asyncio.create_task(self._run_compaction())
+
+    async def _run_compaction(self):
+        try:
+            await self.compact()
+        except Exception as e:
+            # Keep the verbatim history; the next turn will try again
+            print(f"⚠️ Conversation history compaction failed: {e}")
+        finally:
+            if _compactions.get(self.key) is asyncio.current_task():
+                del _compactions[self.key]
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import io
+import math
+import random
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+from google import genai
+from google.genai import types, errors
+from config.settings import LLM_BACKEND, GEMINI_API_KEY, GEMINI_MODEL, FAKE_LLM_LATENCY_DISTRIBUTION, FAKE_LLM_LATENCY_MEAN_MS, FAKE_LLM_LATENCY_SPREAD_MS, FAKE_LLM_OUTPUT_TOKENS, FAKE_LLM_FAILURE_RATE, FAKE_LLM_SEED
+
+class LLMBackend(ABC):
+    """Model backend used by the AI service.
+
+    ``contents`` and ``config`` are google-genai request objects; every backend accepts the
+    same requests so the service code does not depend on which one is configured. A backend
+    missing one of the methods cannot be instantiated.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, contents: list, config: types.GenerateContentConfig) -> str:
+        """Text of a complete answer"""
+
+    @abstractmethod
+    def generate_stream(self, contents: list, config: types.GenerateContentConfig) -> AsyncIterator[str]:
+        """Async iterator of text chunks (implemented as an async generator)"""
+
+    @abstractmethod
+    async def upload_file(self, data: bytes, mime_type: str) -> tuple:
+        """Upload a document and return (uri, name)"""
+
+    @abstractmethod
+    async def create_cache(self, system_instruction: str, document_parts: list, ttl_seconds: int) -> str:
+        """Create a cached-content entry and return its name"""
+
+    @abstractmethod
+    async def delete_cache(self, name: str):
+        """Delete a cached-content entry"""
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini through the google-genai async client"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model: str):
+        self.client = genai.Client(api_key=api_key)
+        self.model = model
+
+    async def generate(self, contents: list, config: types.GenerateContentConfig) -> str:
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        return response.text
+
+    async def generate_stream(self, contents: list, config: types.GenerateContentConfig):
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+    async def upload_file(self, data: bytes, mime_type: str) -> tuple:
+        uploaded = await self.client.aio.files.upload(
+            file=io.BytesIO(data),
+            config=types.UploadFileConfig(mime_type=mime_type)
+        )
+
+        # PDFs are usually active straight away, but give processing a bounded wait
+        for _ in range(30):
+            if uploaded.state != types.FileState.PROCESSING:
+                break
+            await asyncio.sleep(1)
+            uploaded = await self.client.aio.files.get(name=uploaded.name)
+
+        if uploaded.state in (types.FileState.PROCESSING, types.FileState.FAILED):
+            raise Exception(f"Uploaded file {uploaded.name} is not usable (state: {uploaded.state})")
+
+        return uploaded.uri, uploaded.name
+
+    async def create_cache(self, system_instruction: str, document_parts: list, ttl_seconds: int) -> str:
+        cached = await self.client.aio.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                contents=[types.Content(role="user", parts=document_parts)] if document_parts else None,
+                ttl=f"{ttl_seconds}s"
+            )
+        )
+        return cached.name
+
+    async def delete_cache(self, name: str):
+        await self.client.aio.caches.delete(name=name)
+
+class FakeBackend(LLMBackend):
+    """Local stand-in for load tests and CI benchmarks; never touches the network.
+
+    Latency is drawn from a configurable distribution ("fixed", "uniform", "normal" or
+    "lognormal") with the given mean and spread, answers are ``output_tokens`` words long and
+    derived from the request, and ``failure_rate`` of the calls raise a 503 like the real API.
+    With a fixed seed the sequence of latencies and failures is reproducible.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_distribution: str = "lognormal", latency_mean_ms: float = 800, latency_spread_ms: float = 300,
+                 output_tokens: int = 200, failure_rate: float = 0.0, stream_chunk_tokens: int = 20, seed: int = 0):
+        self.latency_distribution = latency_distribution
+        self.latency_mean_ms = latency_mean_ms
+        self.latency_spread_ms = latency_spread_ms
+        self.output_tokens = output_tokens
+        self.failure_rate = failure_rate
+        self.stream_chunk_tokens = max(1, stream_chunk_tokens)
+        self.random = random.Random(seed)
+        self.files = 0
+        self.caches = 0
+
+    def _sample_latency(self) -> float:
+        """Latency of one call in seconds"""
+        mean = self.latency_mean_ms
+        spread = self.latency_spread_ms
+        if self.latency_distribution == "fixed":
+            latency_ms = mean
+        elif self.latency_distribution == "uniform":
+            latency_ms = self.random.uniform(mean - spread, mean + spread)
+        elif self.latency_distribution == "normal":
+            latency_ms = self.random.gauss(mean, spread)
+        else:
+            # Lognormal with the requested mean and standard deviation: a long right tail like real LLM calls
+            if mean <= 0:
+                return 0.0
+            sigma = math.sqrt(math.log(1 + (spread / mean) ** 2))
+            mu = math.log(mean) - sigma ** 2 / 2
+            latency_ms = self.random.lognormvariate(mu, sigma)
+        return max(0.0, latency_ms) / 1000
+
+    def _maybe_fail(self):
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "Fake backend injected failure", "status": "UNAVAILABLE"}})
+
+    def _answer_words(self, contents: list, config: types.GenerateContentConfig) -> list:
+        # Derive the answer from the text parts only; hashing inline PDF bytes would skew benchmarks
+        request_text = "\x00".join([config.system_instruction or "", config.cached_content or ""] + [item for item in contents if isinstance(item, str)])
+        digest = hashlib.sha256(request_text.encode('utf-8')).hexdigest()
+        return [f"fake-{digest[:8]}"] + [f"token{index}" for index in range(1, self.output_tokens)]
+
+    async def generate(self, contents: list, config: types.GenerateContentConfig) -> str:
+        latency = self._sample_latency()
+        self._maybe_fail()
+        await asyncio.sleep(latency)
+        return " ".join(self._answer_words(contents, config))
+
+    async def generate_stream(self, contents: list, config: types.GenerateContentConfig):
+        latency = self._sample_latency()
+        self._maybe_fail()
+        words = self._answer_words(contents, config)
+        chunks = [words[start:start + self.stream_chunk_tokens] for start in range(0, len(words), self.stream_chunk_tokens)]
+        # Spread the sampled latency evenly over the chunks
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(latency / len(chunks))
+            yield (" " if index else "") + " ".join(chunk)
+
+    async def upload_file(self, data: bytes, mime_type: str) -> tuple:
+        self.files += 1
+        name = f"files/fake-{hashlib.sha256(data).hexdigest()[:16]}"
+        return f"fake://{name}", name
+
+    async def create_cache(self, system_instruction: str, document_parts: list, ttl_seconds: int) -> str:
+        self.caches += 1
+        return f"cachedContents/fake-{self.caches}"
+
+    async def delete_cache(self, name: str):
+        return None
+
+def create_llm_backend() -> LLMBackend:
+    """Build the backend selected by LLM_BACKEND ("gemini" or "fake")"""
+    if LLM_BACKEND == "fake":
+        return FakeBackend(
+            latency_distribution=FAKE_LLM_LATENCY_DISTRIBUTION,
+            latency_mean_ms=FAKE_LLM_LATENCY_MEAN_MS,
+            latency_spread_ms=FAKE_LLM_LATENCY_SPREAD_MS,
+            output_tokens=FAKE_LLM_OUTPUT_TOKENS,
+            failure_rate=FAKE_LLM_FAILURE_RATE,
+            seed=FAKE_LLM_SEED
+        )
+    if LLM_BACKEND == "gemini":
+        return GeminiBackend(GEMINI_API_KEY, GEMINI_MODEL)
+    raise ValueError(f"Unknown LLM backend: {LLM_BACKEND}")
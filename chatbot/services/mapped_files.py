@@ -0,0 +1,67 @@
+import mmap
+import os
+from collections import OrderedDict
+from config.settings import MAPPED_FILES_MAX_ENTRIES
+
+class MappedFileCache:
+    """Shared read-only memory maps of files, handed out as zero-copy ``memoryview`` objects.
+
+    Each mapping is checked against the file's inode, size and mtime on every access and
+    re-mapped when the file changed (admin uploads replace files, so a view taken earlier
+    keeps showing the old content until it is dropped). At most ``max_entries`` files stay
+    mapped; a mapping is unmapped once the last view of it is released.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # path -> ((inode, size, mtime_ns), memoryview), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.maps = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> tuple:
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, path: str) -> memoryview:
+        """Read-only view of the file's current content; raises OSError if it cannot be read"""
+        stat = os.stat(path)
+        signature = self._signature(stat)
+        entry = self.entries.get(path)
+        if entry is not None:
+            if entry[0] == signature:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.invalidate(path)
+
+        if stat.st_size == 0:
+            # Empty files cannot be mapped
+            return memoryview(b"")
+
+        with open(path, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.entries[path] = (signature, view)
+        self.maps += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return view
+
+    def invalidate(self, path: str):
+        """Forget the mapping of a changed or deleted file"""
+        if self.entries.pop(path, None) is not None:
+            self.invalidations += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "mapped_files": len(self.entries),
+            "mapped_bytes": sum(len(view) for _, view in self.entries.values()),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "maps": self.maps,
+            "invalidations": self.invalidations
+        }
+
+# Shared maps of the secure-folder PDFs
+mapped_files = MappedFileCache(MAPPED_FILES_MAX_ENTRIES)
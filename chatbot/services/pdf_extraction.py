@@ -0,0 +1,197 @@
+import asyncio
+import io
+import mmap
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from services.file_cache import content_hash
+from config.settings import PDF_TEXT_EXTRACTION_ENABLED, PDF_EXTRACTION_WORKERS, PDF_EXTRACTION_TIMEOUT_SECONDS, PDF_TEXT_MIN_CHARS_PER_PAGE, PDF_EXTRACTION_CACHE_ENTRIES
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    # Optional dependency; without it every PDF is sent to the model as bytes
+    PdfReader = PdfWriter = None
+
+_extraction_pool = None
+
+# One permit per worker process: a task is only submitted when a worker is free to start it,
+# so the extraction timeout measures its run time, not its wait in the pool's queue
+_extraction_slots = asyncio.Semaphore(PDF_EXTRACTION_WORKERS)
+
+# Source content hash -> extraction result ('text' is None for PDFs that have to be sent as bytes)
+_extraction_results = OrderedDict()
+
+def _clean_page_text(text: str) -> str:
+    """Collapse layout whitespace while keeping the line and paragraph structure"""
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def extract_pdf_text(source, min_chars_per_page: int) -> Optional[dict]:
+    """Extract the text of a PDF (bytes or a file path) page by page; runs in a worker process.
+
+    Returns {'text', 'pages', 'title'}; 'text' is None when the PDF has too little text to
+    be worth sending as text (typically a scanned document that needs the model's OCR).
+    """
+    if isinstance(source, bytes):
+        return _extract_pdf_text(io.BytesIO(source), min_chars_per_page)
+    # Parse files straight from a read-only mapping instead of reading them into memory
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return _extract_pdf_text(mapped, min_chars_per_page)
+
+def _extract_pdf_text(stream, min_chars_per_page: int) -> dict:
+    reader = PdfReader(stream)
+    pages = []
+    for page in reader.pages:
+        pages.append(_clean_page_text(page.extract_text() or ""))
+
+    title = None
+    if reader.metadata and reader.metadata.title:
+        title = str(reader.metadata.title).strip() or None
+
+    if not pages or sum(len(page) for page in pages) < min_chars_per_page * len(pages):
+        # Keep the page count so scanned PDFs are not parsed again to size them
+        return {'text': None, 'pages': len(pages), 'title': title}
+
+    text = "\n\n".join(f"[Page {number}]\n{page}" for number, page in enumerate(pages, 1) if page)
+    return {'text': text, 'pages': len(pages), 'title': title}
+
+def split_pdf_pages(source: bytes, pages_per_chunk: int) -> list:
+    """Split a PDF into (first_page, last_page, pdf_bytes) page ranges; runs in a worker process"""
+    reader = PdfReader(io.BytesIO(source))
+    chunks = []
+    for start in range(0, len(reader.pages), pages_per_chunk):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_chunk]:
+            writer.add_page(page)
+        output = io.BytesIO()
+        writer.write(output)
+        chunks.append((start + 1, min(start + pages_per_chunk, len(reader.pages)), output.getvalue()))
+    return chunks
+
+def count_pdf_pages(source: bytes) -> int:
+    return len(PdfReader(io.BytesIO(source)).pages)
+
+def _get_extraction_pool() -> ProcessPoolExecutor:
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS)
+    return _extraction_pool
+
+def _reset_extraction_pool(pool: ProcessPoolExecutor):
+    """Kill the worker processes of a stuck or broken pool so the next call starts a new one"""
+    global _extraction_pool
+    if _extraction_pool is pool:
+        _extraction_pool = None
+    # A task already running in a worker cannot be cancelled, only killed with its process
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def _run_in_pool(function, *args):
+    """Run ``function`` in the extraction pool under the extraction timeout.
+    
+    Tasks wait for a free worker before being submitted, so only a task that has run for
+    longer than the timeout counts as stuck. Then, or when a crashed worker has broken the
+    pool, the pool is killed and reset (tasks running in it fail and fall back like any
+    failed extraction).
+    """
+    async with _extraction_slots:
+        pool = _get_extraction_pool()
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(pool, function, *args)
+        except BrokenProcessPool:
+            # A worker died since the last call; start over with a new pool
+            _reset_extraction_pool(pool)
+            pool = _get_extraction_pool()
+            future = loop.run_in_executor(pool, function, *args)
+        try:
+            return await asyncio.wait_for(future, PDF_EXTRACTION_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, BrokenProcessPool):
+            print("⚠️ PDF extraction pool timed out or broke, restarting it")
+            _reset_extraction_pool(pool)
+            raise
+
+def shutdown_extraction_pool():
+    """Stop the extraction worker processes (called on application shutdown)"""
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+def _remember(source_hash: str, result: Optional[dict]):
+    _extraction_results[source_hash] = result
+    _extraction_results.move_to_end(source_hash)
+    while len(_extraction_results) > PDF_EXTRACTION_CACHE_ENTRIES:
+        _extraction_results.popitem(last=False)
+
+def format_document_text(filename: str, extraction: dict) -> str:
+    """Text sent to the model in place of the PDF, headed by the file it came from"""
+    header = f"=== Document: {filename} ({extraction['pages']} page(s))"
+    if extraction['title']:
+        header += f", title: {extraction['title']}"
+    return f"{header} ===\n{extraction['text']}"
+
+async def extract_document(source, source_hash: str = None) -> Optional[dict]:
+    """Extract a PDF (bytes, or a file path) in the process pool, reusing earlier results for the same content.
+
+    Returns None when the PDF cannot be parsed (or extraction is disabled).
+    """
+    if not PDF_TEXT_EXTRACTION_ENABLED or PdfReader is None:
+        return None
+
+    source_hash = source_hash or content_hash(source)
+    if source_hash in _extraction_results:
+        _extraction_results.move_to_end(source_hash)
+        return _extraction_results[source_hash]
+
+    try:
+        result = await _run_in_pool(extract_pdf_text, source, PDF_TEXT_MIN_CHARS_PER_PAGE)
+    except Exception as e:
+        # Damaged or exotic PDFs are left to the model
+        print(f"⚠️ PDF text extraction failed, sending bytes: {e}")
+        return None
+
+    _remember(source_hash, result)
+    return result
+
+async def split_pdf_document(source, pages_per_chunk: int) -> Optional[list]:
+    """Split PDF bytes into page ranges in the process pool; None when the PDF cannot be split"""
+    if PdfReader is None:
+        return None
+    try:
+        return await _run_in_pool(split_pdf_pages, bytes(source), pages_per_chunk)
+    except Exception as e:
+        print(f"⚠️ PDF page split failed, sending the whole document: {e}")
+        return None
+
+async def pdf_page_count(source) -> Optional[int]:
+    """Number of pages of PDF bytes counted in the process pool, or None when it cannot be read.
+
+    Only needed for PDFs that were not extracted; extraction results carry their page count.
+    """
+    if PdfReader is None:
+        return None
+    try:
+        return await _run_in_pool(count_pdf_pages, bytes(source))
+    except Exception:
+        return None
+
+async def prepare_document_file(path: str, source_hash: str, info: dict):
+    """Return the extracted text of a PDF file, or its bytes when it has no usable text.
+
+    The file is parsed by a worker process straight from disk, so only scanned PDFs are
+    loaded into this process. ``info`` is annotated with how the file will be sent.
+    """
+    extraction = await extract_document(path, source_hash)
+    if extraction is not None:
+        info["pages"] = extraction['pages']
+    if extraction is None or extraction['text'] is None:
+        info["content_type"] = "pdf"
+        with open(path, 'rb') as f:
+            return f.read()
+    info["content_type"] = "text"
+    return format_document_text(info["filename"], extraction)
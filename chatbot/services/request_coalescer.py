@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+
+def make_request_key(system_instruction: str, document_hashes: list, contents: list) -> str:
+    """Key identifying a model request by instruction, document hashes and prompt contents"""
+    digest = hashlib.sha256(system_instruction.encode('utf-8'))
+    for document_hash in document_hashes:
+        digest.update(b"\x00doc:" + document_hash.encode('ascii'))
+    for item in contents:
+        digest.update(b"\x00content:" + str(item).encode('utf-8'))
+    return digest.hexdigest()
+
+class RequestCoalescer:
+    """Single-flight execution: concurrent callers with the same key share one in-flight call.
+
+    Nothing is cached once the call completes, so coalescing never serves stale answers.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, coroutine_factory):
+        """Await the in-flight call for ``key``, starting it with ``coroutine_factory()`` if there is none"""
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(coroutine_factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        else:
+            self.coalesced += 1
+
+        # Shield the shared call so one caller disconnecting does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight)
+        }
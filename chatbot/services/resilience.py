@@ -0,0 +1,232 @@
+import asyncio
+import random
+import time
+import httpx
+from fastapi import HTTPException
+from google.genai import errors
+
+def is_retryable_error(error: Exception) -> bool:
+    """Transient upstream failures worth another attempt: 5xx, 429, timeouts and connection errors"""
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.ClientError):
+        return error.code == 429
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, httpx.TransportError))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Fails fast while the model keeps failing.
+
+    After ``failure_threshold`` consecutive retryable failures the circuit opens and calls are
+    rejected for ``recovery_seconds``. It then lets ``half_open_max_calls`` trial calls through:
+    a success closes the circuit again, a failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _refresh(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_seconds:
+            self.state = self.HALF_OPEN
+            self.half_open_calls = 0
+
+    def allow_request(self) -> bool:
+        self._refresh()
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and self.half_open_calls < self.half_open_max_calls:
+            self.half_open_calls += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                print(f"⚠️ Circuit breaker opened after {self.consecutive_failures} consecutive model failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a trial slot whose call was cancelled before it had an outcome"""
+        if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def retry_after(self) -> int:
+        """Seconds until the next trial call is allowed"""
+        return max(1, int(self.recovery_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+    def get_state(self) -> dict:
+        self._refresh()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after() if self.state == self.OPEN else 0
+        }
+
+class ResilientCaller:
+    """Runs model calls under a deadline with jittered retries, optional hedging and a circuit breaker.
+
+    Callers pass a ``coroutine_factory`` so every attempt starts a fresh request. Each attempt but
+    the last gets at most ``attempt_timeout_ratio`` of the call's deadline, so a hung request
+    times out with time left for a retry; the last attempt may use whatever remains. Errors surface as
+    HTTPException: 503 while the circuit is open or retries are exhausted, 504 when the deadline
+    passes. Non-retryable errors (e.g. a 400 from the API) are raised unchanged.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, max_retries: int, backoff_base_seconds: float, backoff_max_seconds: float, hedge_delay_seconds: float = 0,
+                 attempt_timeout_ratio: float = 1.0):
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.attempt_timeout_ratio = attempt_timeout_ratio
+        self.calls = 0
+        self.retries = 0
+        self.attempt_timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def _circuit_open(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="The AI service is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(self.breaker.retry_after())}
+        )
+
+    def _deadline_exceeded(self) -> HTTPException:
+        self.deadline_exceeded += 1
+        return HTTPException(status_code=504, detail="The AI service took too long to respond. Please try again.")
+
+    async def _attempt(self, coroutine_factory, timeout: float):
+        if not self.breaker.allow_request():
+            raise CircuitOpenError()
+        succeeded = None
+        try:
+            result = await asyncio.wait_for(coroutine_factory(), timeout)
+            succeeded = True
+            return result
+        except Exception as e:
+            # Non-retryable errors still mean the model answered, so they do not count against it
+            succeeded = not is_retryable_error(e)
+            raise
+        finally:
+            if succeeded is True:
+                self.breaker.record_success()
+            elif succeeded is False:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+
+    async def _hedged_attempt(self, coroutine_factory, timeout: float):
+        """Start a second request if the first is slower than the hedge delay; the first answer wins"""
+        deadline = time.monotonic() + timeout
+        primary = asyncio.ensure_future(self._attempt(coroutine_factory, timeout))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay_seconds, timeout))
+            if not done:
+                self.hedges += 1
+                tasks.add(asyncio.ensure_future(self._attempt(coroutine_factory, deadline - time.monotonic())))
+
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    # Prefer reporting a real failure over a rejected hedge
+                    if error is None or isinstance(error, CircuitOpenError):
+                        error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, coroutine_factory, deadline_seconds: float, hedge: bool = True):
+        """Await ``coroutine_factory()`` with retries until it succeeds or the deadline passes"""
+        self.calls += 1
+        deadline = time.monotonic() + deadline_seconds
+        attempt_timeout = deadline_seconds * self.attempt_timeout_ratio
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._deadline_exceeded()
+            timeout = remaining if attempt >= self.max_retries else min(attempt_timeout, remaining)
+            try:
+                if hedge and self.hedge_delay_seconds > 0:
+                    return await self._hedged_attempt(coroutine_factory, timeout)
+                return await self._attempt(coroutine_factory, timeout)
+            except CircuitOpenError:
+                raise self._circuit_open()
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    if deadline - time.monotonic() <= 0:
+                        raise self._deadline_exceeded()
+                    self.attempt_timeouts += 1
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise HTTPException(status_code=503, detail="The AI service is temporarily unavailable. Please try again shortly.") from e
+
+                # Exponential backoff with full jitter so retries from many workers do not line up
+                delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)))
+                if time.monotonic() + delay >= deadline:
+                    raise self._deadline_exceeded()
+                print(f"⚠️ Model call failed ({e}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    async def stream_chunks(self, stream, idle_timeout_seconds: float):
+        """Yield the rest of a started stream, failing with 504 if the model stalls between chunks"""
+        while True:
+            try:
+                chunk = await asyncio.wait_for(stream.__anext__(), idle_timeout_seconds)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                raise self._deadline_exceeded()
+            yield chunk
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "attempt_timeouts": self.attempt_timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "circuit_breaker": self.breaker.get_state()
+        }
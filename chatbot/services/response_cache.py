@@ -0,0 +1,112 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+def normalize_message(message: str) -> str:
+    """Normalize a prompt so trivially different spellings share a cache entry"""
+    normalized = re.sub(r"\s+", " ", message.casefold()).strip()
+    return normalized.rstrip(" .!?")
+
+def make_cache_key(system_instruction: str, message: str) -> str:
+    digest = hashlib.sha256(system_instruction.encode('utf-8'))
+    digest.update(b"\x00")
+    digest.update(normalize_message(message).encode('utf-8'))
+    return digest.hexdigest()
+
+class InMemoryResponseCache:
+    """Per-process LRU cache of model answers with a TTL"""
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, response_text)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, response_text: str):
+        self.entries[key] = (time.time() + self.ttl_seconds, response_text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+class RedisResponseCache:
+    """Response cache shared by every worker through Redis (eviction is left to Redis' maxmemory policy)"""
+
+    backend = "redis"
+
+    def __init__(self, redis_url: str, ttl_seconds: int, prefix: str = "chatbot:response:"):
+        # Optional dependency, only needed when the shared backend is selected
+        import redis.asyncio as redis
+        self.client = redis.from_url(redis_url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.client.get(self.prefix + key)
+        except Exception as e:
+            # A cache outage must never fail the chat request
+            self.errors += 1
+            print(f"⚠️ Response cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode('utf-8')
+
+    async def set(self, key: str, response_text: str):
+        try:
+            await self.client.set(self.prefix + key, response_text, ex=self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Response cache write failed: {e}")
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+def create_response_cache(backend: str, max_entries: int, ttl_seconds: int, redis_url: str = None):
+    """Build the configured response cache backend"""
+    if backend == "redis":
+        return RedisResponseCache(redis_url, ttl_seconds)
+    return InMemoryResponseCache(max_entries, ttl_seconds)
@@ -0,0 +1,115 @@
+import hashlib
+import math
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from config.settings import RETRIEVAL_ENABLED, RETRIEVAL_TOP_K, RETRIEVAL_MIN_DOCUMENTS
+
+# Common English and French words that carry no signal for matching CVs
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "in", "is", "it", "me", "of", "on", "or", "our", "please", "show", "that", "the", "their", "them", "this",
+    "to", "was", "we", "what", "which", "who", "whom", "with", "you",
+    "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "en", "est", "et", "la", "le", "les", "leur",
+    "ou", "par", "pour", "qui", "quel", "quels", "sur", "un", "une",
+    "cv", "cvs", "candidate", "candidates", "resume", "resumes"
+}
+
+def tokenize(text: str) -> list:
+    """Lowercase, accent-free word tokens without stopwords"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return [token for token in re.findall(r"\w+", text) if len(token) > 1 and token not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of documents, stored as compact CSR-style arrays.
+
+    Postings of term ``t`` are ``document_ids[offsets[t]:offsets[t + 1]]`` with matching
+    ``term_frequencies``, so hundreds of CVs fit in a few flat integer arrays.
+    """
+
+    def __init__(self, texts: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.document_lengths = array('I')
+
+        postings = []
+        for document_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.document_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((document_id, frequency))
+
+        self.offsets = array('I', [0])
+        self.document_ids = array('I')
+        self.term_frequencies = array('I')
+        for term_postings in postings:
+            for document_id, frequency in term_postings:
+                self.document_ids.append(document_id)
+                self.term_frequencies.append(frequency)
+            self.offsets.append(len(self.document_ids))
+
+        self.document_count = len(texts)
+        self.average_length = (sum(self.document_lengths) / self.document_count) if self.document_count else 0
+
+    def score(self, query: str) -> list:
+        """BM25 score of every document for the query"""
+        scores = [0.0] * self.document_count
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            document_frequency = end - start
+            idf = math.log(1 + (self.document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for position in range(start, end):
+                document_id = self.document_ids[position]
+                frequency = self.term_frequencies[position]
+                length_norm = 1 - self.b + self.b * self.document_lengths[document_id] / (self.average_length or 1)
+                scores[document_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+# The secure folder rarely changes, so keep the index of the last document set
+_cached_index = (None, None)
+
+def _get_index(texts: list) -> BM25Index:
+    global _cached_index
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode('utf-8')).digest())
+    signature = digest.hexdigest()
+    if _cached_index[0] != signature:
+        _cached_index = (signature, BM25Index(texts))
+    return _cached_index[1]
+
+def select_relevant_documents(prompt: str, documents: list, file_info: list) -> tuple:
+    """Keep the RETRIEVAL_TOP_K documents that best match the prompt.
+
+    Returns (documents, file_info, retrieval) where ``retrieval`` describes the selection.
+    Everything is kept when retrieval is disabled, the set is at most RETRIEVAL_MIN_DOCUMENTS
+    long, or no document matches the prompt (e.g. "summarize every candidate"). Scanned PDFs
+    have no text to score and are always kept.
+    """
+    total = len(documents)
+    if not RETRIEVAL_ENABLED or total <= RETRIEVAL_MIN_DOCUMENTS:
+        return documents, file_info, {"method": "all", "candidates": total, "selected": total}
+
+    text_positions = [index for index, document in enumerate(documents) if isinstance(document, str)]
+    scores = _get_index([documents[index] for index in text_positions]).score(prompt)
+    ranked = sorted(((score, index) for score, index in zip(scores, text_positions) if score > 0), key=lambda item: item[0], reverse=True)
+    if not ranked:
+        return documents, file_info, {"method": "all", "candidates": total, "selected": total}
+
+    selected = {index for _, index in ranked[:RETRIEVAL_TOP_K]}
+    selected.update(index for index, document in enumerate(documents) if not isinstance(document, str))
+    keep = sorted(selected)
+    return (
+        [documents[index] for index in keep],
+        [file_info[index] for index in keep],
+        {"method": "bm25", "candidates": total, "selected": len(keep)}
+    )
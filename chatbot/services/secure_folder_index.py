@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Optional
+from services.file_cache import content_hash
+from services.mapped_files import mapped_files
+from services.pdf_extraction import extract_document, format_document_text
+from config.settings import SECURE_CV_FOLDER_PATH, SECURE_FOLDER_INDEX_PATH, SECURE_FOLDER_SCAN_INTERVAL_SECONDS
+
+class SecureFolderIndex:
+    """Persistent SQLite index of the PDFs in the secure CV folder.
+
+    Each row holds the file's size, mtime, content hash and extracted text, so analyses read
+    the index instead of re-reading and re-parsing every PDF. ``refresh`` is a cheap stat scan
+    that only re-reads files whose size or mtime changed; admin uploads and deletes update the
+    index directly through ``index_file`` and ``remove_file``.
+    """
+
+    def __init__(self, folder_path: str, db_path: str, scan_interval_seconds: float):
+        self.folder_path = folder_path
+        self.db_path = db_path
+        self.scan_interval_seconds = scan_interval_seconds
+        self.last_scan = 0.0
+        self._lock = asyncio.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    filename TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    text TEXT,
+                    pages INTEGER,
+                    title TEXT,
+                    indexed_at REAL NOT NULL
+                )
+            """)
+            self._connection.commit()
+        return self._connection
+
+    def _scan_folder(self) -> dict:
+        """filename -> (size, mtime_ns) of the PDFs currently in the folder"""
+        if not os.path.exists(self.folder_path):
+            return {}
+        files = {}
+        with os.scandir(self.folder_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    async def _index(self, filename: str) -> Optional[dict]:
+        file_path = os.path.join(self.folder_path, filename)
+        try:
+            stat = os.stat(file_path)
+            data = mapped_files.get(file_path)
+        except OSError as e:
+            print(f"Error reading file {file_path}: {e}")
+            return None
+
+        # Hash the shared mapping in place; the extraction worker maps the file itself
+        sha256 = content_hash(data)
+        extraction = await extract_document(file_path, sha256)
+        row = {
+            'filename': filename,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256,
+            'text': extraction['text'] if extraction else None,
+            'pages': extraction['pages'] if extraction else None,
+            'title': extraction['title'] if extraction else None,
+            'indexed_at': time.time()
+        }
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO documents (filename, size, mtime_ns, sha256, text, pages, title, indexed_at) "
+            "VALUES (:filename, :size, :mtime_ns, :sha256, :text, :pages, :title, :indexed_at)",
+            row
+        )
+        connection.commit()
+        return row
+
+    async def refresh(self, force: bool = False):
+        """Bring the index in line with the folder, at most once per scan interval unless forced"""
+        if not force and time.time() - self.last_scan < self.scan_interval_seconds:
+            return
+
+        async with self._lock:
+            if not force and time.time() - self.last_scan < self.scan_interval_seconds:
+                return
+
+            files = self._scan_folder()
+            indexed = {row['filename']: row for row in self.list_documents()}
+
+            removed = [filename for filename in indexed if filename not in files]
+            if removed:
+                connection = self._connect()
+                connection.executemany("DELETE FROM documents WHERE filename = ?", [(filename,) for filename in removed])
+                connection.commit()
+                for filename in removed:
+                    mapped_files.invalidate(os.path.join(self.folder_path, filename))
+
+            changed = [filename for filename, signature in files.items()
+                       if filename not in indexed or signature != (indexed[filename]['size'], indexed[filename]['mtime_ns'])]
+            if changed:
+                print(f"📇 Indexing {len(changed)} new or changed file(s) in the secure folder")
+                await asyncio.gather(*(self._index(filename) for filename in changed))
+
+            self.last_scan = time.time()
+
+    async def index_file(self, filename: str) -> Optional[dict]:
+        """Index (or re-index) one file, e.g. right after an admin upload"""
+        async with self._lock:
+            return await self._index(filename)
+
+    def remove_file(self, filename: str) -> Optional[dict]:
+        """Drop a file from the index and return its former row"""
+        mapped_files.invalidate(os.path.join(self.folder_path, filename))
+        row = self.get_document(filename)
+        if row:
+            connection = self._connect()
+            connection.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+            connection.commit()
+        return row
+
+    def get_document(self, filename: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def list_documents(self) -> list:
+        return [dict(row) for row in self._connect().execute("SELECT * FROM documents ORDER BY filename")]
+
+    @staticmethod
+    def document_text(row: dict) -> Optional[str]:
+        """Text sent to the model for an indexed file, or None when it has to go as PDF bytes"""
+        if row['text'] is None:
+            return None
+        return format_document_text(row['filename'], row)
+
+    async def load_documents(self) -> tuple:
+        """Return (documents, file_info) for every indexed file, refreshing the index first.
+
+        Text PDFs come straight from the index; scanned PDFs are shared read-only memory
+        maps of the files, so concurrent analyses do not each hold a copy.
+        """
+        await self.refresh()
+
+        documents = []
+        file_info = []
+        for row in self.list_documents():
+            text = self.document_text(row)
+            if text is None:
+                try:
+                    documents.append(mapped_files.get(os.path.join(self.folder_path, row['filename'])))
+                except OSError as e:
+                    print(f"Error reading file {row['filename']}: {e}")
+                    continue
+                file_info.append({"filename": row['filename'], "size": row['size'], "content_type": "pdf", "pages": row['pages']})
+            else:
+                documents.append(text)
+                file_info.append({"filename": row['filename'], "size": row['size'], "content_type": "text", "pages": row['pages']})
+        return documents, file_info
+
+# Shared index of the secure CV folder
+secure_folder_index = SecureFolderIndex(SECURE_CV_FOLDER_PATH, SECURE_FOLDER_INDEX_PATH, SECURE_FOLDER_SCAN_INTERVAL_SECONDS)
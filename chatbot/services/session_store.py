@@ -0,0 +1,237 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional
+
+class InMemorySessionStore:
+    """Per-process document session store with LRU, idle-TTL and byte-cap eviction.
+
+    Sessions are kept as JSON so they behave exactly like the SQLite backend: callers get a
+    copy and must ``set`` it back after changing it. ``on_evict(session_id, data)`` is called
+    for every session dropped by eviction (not for explicit deletes).
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_sessions: int, max_bytes: int, idle_ttl_seconds: float, on_evict=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.on_evict = on_evict
+        # session_id -> (last_access, payload), least recently used first
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, session_id: str) -> Optional[dict]:
+        entry = self.sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        self.total_bytes -= len(entry[1])
+        return json.loads(entry[1])
+
+    def _evict(self, session_id: str):
+        data = self._drop(session_id)
+        if data is not None and self.on_evict:
+            self.on_evict(session_id, data)
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_ttl_seconds
+        while self.sessions:
+            session_id, (last_access, _) = next(iter(self.sessions.items()))
+            if last_access >= cutoff:
+                break
+            self.expirations += 1
+            self._evict(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        self._expire()
+        return session_id in self.sessions
+
+    def get(self, session_id: str) -> Optional[dict]:
+        self._expire()
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.sessions[session_id] = (time.time(), entry[1])
+        self.sessions.move_to_end(session_id)
+        return json.loads(entry[1])
+
+    def set(self, session_id: str, data: dict):
+        payload = json.dumps(data)
+        self._drop(session_id)
+        self.sessions[session_id] = (time.time(), payload)
+        self.total_bytes += len(payload)
+
+        # Evict least recently used sessions, but always keep the one just written
+        while len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            self.evictions += 1
+            self._evict(next(iter(self.sessions)))
+
+    def delete(self, session_id: str) -> Optional[dict]:
+        """Remove a session and return its data"""
+        return self._drop(session_id)
+
+    def session_ids_for_user(self, user_id: int) -> list:
+        return [session_id for session_id, (_, payload) in self.sessions.items() if json.loads(payload).get('user_id') == user_id]
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "sessions": len(self.sessions),
+            "bytes": self.total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+class SQLiteSessionStore:
+    """Document session store in a local SQLite file, shared by every worker on the host.
+
+    Same interface and eviction rules as the in-memory store; the caps apply to the whole file.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, db_path: str, max_sessions: int, max_bytes: int, idle_ttl_seconds: float, on_evict=None):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            # WAL lets several uvicorn workers read while one writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS document_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS ix_document_sessions_last_access ON document_sessions (last_access)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS ix_document_sessions_user_id ON document_sessions (user_id)")
+            self._connection.commit()
+        return self._connection
+
+    def _evict_rows(self, rows: list):
+        connection = self._connect()
+        # Only report the rows this worker deleted, so another worker evicting too cannot double-release
+        deleted = [(session_id, payload) for session_id, payload in rows
+                   if connection.execute("DELETE FROM document_sessions WHERE session_id = ?", (session_id,)).rowcount]
+        connection.commit()
+        if self.on_evict:
+            for session_id, payload in deleted:
+                self.on_evict(session_id, json.loads(payload))
+
+    def _expire(self):
+        rows = self._connect().execute(
+            "SELECT session_id, payload FROM document_sessions WHERE last_access < ?",
+            (time.time() - self.idle_ttl_seconds,)
+        ).fetchall()
+        if rows:
+            self.expirations += len(rows)
+            self._evict_rows(rows)
+
+    def __contains__(self, session_id: str) -> bool:
+        self._expire()
+        return self._connect().execute("SELECT 1 FROM document_sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def get(self, session_id: str) -> Optional[dict]:
+        self._expire()
+        connection = self._connect()
+        row = connection.execute("SELECT payload FROM document_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        connection.execute("UPDATE document_sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+        connection.commit()
+        return json.loads(row[0])
+
+    def set(self, session_id: str, data: dict):
+        payload = json.dumps(data)
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO document_sessions (session_id, user_id, payload, size, last_access) VALUES (?, ?, ?, ?, ?)",
+            (session_id, data.get('user_id'), payload, len(payload), time.time())
+        )
+        connection.commit()
+
+        count, total_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM document_sessions").fetchone()
+        if count <= self.max_sessions and total_bytes <= self.max_bytes:
+            return
+
+        # Evict least recently used sessions, but always keep the one just written
+        evicted = []
+        for other_id, other_payload, size in connection.execute(
+            "SELECT session_id, payload, size FROM document_sessions WHERE session_id != ? ORDER BY last_access",
+            (session_id,)
+        ).fetchall():
+            if count <= self.max_sessions and total_bytes <= self.max_bytes:
+                break
+            evicted.append((other_id, other_payload))
+            count -= 1
+            total_bytes -= size
+        self.evictions += len(evicted)
+        self._evict_rows(evicted)
+
+    def delete(self, session_id: str) -> Optional[dict]:
+        """Remove a session and return its data"""
+        connection = self._connect()
+        row = connection.execute("SELECT payload FROM document_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        connection.execute("DELETE FROM document_sessions WHERE session_id = ?", (session_id,))
+        connection.commit()
+        return json.loads(row[0])
+
+    def session_ids_for_user(self, user_id: int) -> list:
+        return [row[0] for row in self._connect().execute("SELECT session_id FROM document_sessions WHERE user_id = ?", (user_id,))]
+
+    def get_stats(self) -> dict:
+        count, total_bytes = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM document_sessions").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "sessions": count,
+            "bytes": total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+def create_session_store(backend: str, max_sessions: int, max_bytes: int, idle_ttl_seconds: float, db_path: str = None, on_evict=None):
+    """Build the configured document session store backend"""
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path, max_sessions, max_bytes, idle_ttl_seconds, on_evict)
+    return InMemorySessionStore(max_sessions, max_bytes, idle_ttl_seconds, on_evict)
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from fastapi import UploadFile, HTTPException
+from config.settings import MAX_UPLOAD_SIZE_MB, UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_DIR
+
+PDF_MAGIC = b"%PDF-"
+
+class SpooledUpload:
+    """An uploaded PDF streamed to a spool file, with its size and content hash"""
+
+    def __init__(self, filename: str, path: str, size: int, sha256: str):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def discard(self):
+        """Remove the spool file (no-op once it has been moved into place)"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+async def spool_upload(file: UploadFile, directory: str = None, max_bytes: int = MAX_UPLOAD_SIZE_MB * 1024 * 1024) -> SpooledUpload:
+    """Stream an uploaded PDF to a spool file chunk by chunk.
+
+    The PDF signature and the size limit are checked as the data arrives and the SHA-256 is
+    computed on the way, so no more than one chunk of the upload is held in memory. Raises
+    400 for files that are not PDFs and 413 for files over the limit.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    descriptor, path = tempfile.mkstemp(suffix=".part", dir=directory or UPLOAD_SPOOL_DIR)
+    try:
+        with os.fdopen(descriptor, 'wb') as spool:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(PDF_MAGIC):
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File {file.filename} is not a PDF. Only PDF files are supported"
+                    )
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File {file.filename} is larger than the {MAX_UPLOAD_SIZE_MB} MB limit"
+                    )
+                digest.update(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail=f"File {file.filename} is empty")
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return SpooledUpload(file.filename, path, size, digest.hexdigest())
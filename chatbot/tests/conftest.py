@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+
+# Offline settings and throwaway stores, set before the app modules read them
+_data_dir = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["FAKE_LLM_LATENCY_MEAN_MS"] = "1"
+os.environ["FAKE_LLM_LATENCY_SPREAD_MS"] = "0"
+os.environ["SESSION_STORE_PATH"] = os.path.join(_data_dir, "document_sessions.db")
+os.environ["CV_PROFILE_STORE_PATH"] = os.path.join(_data_dir, "cv_profiles.db")
+os.environ["BLOB_STORE_PATH"] = os.path.join(_data_dir, "blobs")
+os.environ["SECURE_CV_FOLDER_PATH"] = os.path.join(_data_dir, "secure")
+os.environ["SECURE_FOLDER_INDEX_PATH"] = os.path.join(_data_dir, "secure_folder_index.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# SQLite instead of MySQL, patched in before the routes import SessionLocal
+import core.database as database
+database.engine = create_engine(f"sqlite:///{os.path.join(_data_dir, 'chatbot.db')}", connect_args={"check_same_thread": False})
+database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+
+import main
+from fastapi.testclient import TestClient
+from core.database import Base, get_db
+from core.dependencies import get_current_user
+from core.models import User, UserRole
+
+Base.metadata.create_all(bind=database.engine)
+
+def _get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+main.app.dependency_overrides[get_db] = _get_db
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def user(db):
+    """A signed-in regular user"""
+    email = "tester@example.com"
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        user = User(email=email, full_name="Tester", hashed_password="x", role=UserRole.USER)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    main.app.dependency_overrides[get_current_user] = lambda: user
+    yield user
+    main.app.dependency_overrides.pop(get_current_user, None)
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+@pytest.fixture
+def blob_store(tmp_path):
+    """A blob store of its own whose garbage collection removes released blobs right away"""
+    from services.blob_store import BlobStore
+    return BlobStore(str(tmp_path / "blobs"), 1024 * 1024, -1, 3600, 600)
+
+@pytest.fixture
+def admin(db):
+    """A signed-in administrator"""
+    from core.dependencies import get_current_admin
+    email = "admin@example.com"
+    admin = db.query(User).filter(User.email == email).first()
+    if not admin:
+        admin = User(email=email, full_name="Admin", hashed_password="x", role=UserRole.ADMIN)
+        db.add(admin)
+        db.commit()
+        db.refresh(admin)
+    main.app.dependency_overrides[get_current_admin] = lambda: admin
+    yield admin
+    main.app.dependency_overrides.pop(get_current_admin, None)
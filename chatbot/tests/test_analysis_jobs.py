@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import core.crud as crud
+import services.analysis_jobs as analysis_jobs_module
+from core.models import AnalysisJob
+from services.analysis_jobs import AnalysisJobQueue
+
+@pytest.fixture
+def jobs(monkeypatch, blob_store):
+    monkeypatch.setattr(analysis_jobs_module, "document_store", blob_store)
+    return AnalysisJobQueue(1, 10)
+
+def _job(db, job_id: str) -> AnalysisJob:
+    db.expire_all()
+    return crud.get_analysis_job(db, job_id)
+
+def _refcount(blob_store, key: str) -> int:
+    return blob_store._connect().execute("SELECT refcount FROM blobs WHERE hash = ?", (key,)).fetchone()[0]
+
+async def _wait_for(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def test_job_succeeds_and_releases_its_documents(jobs, blob_store, db, user):
+    async def handler(job_id, user_id, payload):
+        return {"response": "done"}
+    jobs.register("test", handler)
+
+    async def run():
+        keys = await blob_store.put_many(["a document"])
+        job, created = jobs.submit(db, user.id, "test", {"document_hashes": keys})
+        await jobs.queue.join()
+        await jobs.stop()
+        return job.job_id, keys
+
+    job_id, keys = asyncio.run(run())
+
+    assert _job(db, job_id).status == "succeeded"
+    assert _refcount(blob_store, keys[0]) == 0
+
+def test_failed_job_records_the_http_status(jobs, blob_store, db, user):
+    async def handler(job_id, user_id, payload):
+        raise HTTPException(status_code=502, detail="model down")
+    jobs.register("test", handler)
+
+    async def run():
+        job, _ = jobs.submit(db, user.id, "test", {})
+        await jobs.queue.join()
+        await jobs.stop()
+        return job.job_id
+
+    job = _job(db, asyncio.run(run()))
+    assert (job.status, job.error, job.error_status) == ("failed", "model down", 502)
+
+def test_stop_requeues_running_job_and_keeps_its_documents(jobs, blob_store, db, user):
+    started = []
+
+    async def handler(job_id, user_id, payload):
+        started.append(job_id)
+        await asyncio.sleep(60)
+    jobs.register("test", handler)
+
+    async def run():
+        keys = await blob_store.put_many(["a document"])
+        job, _ = jobs.submit(db, user.id, "test", {"document_hashes": keys})
+        await _wait_for(lambda: started)
+        await jobs.stop()
+        return job.job_id, keys
+
+    job_id, keys = asyncio.run(run())
+
+    job = _job(db, job_id)
+    assert (job.status, job.started_at, job.heartbeat_at) == ("queued", None, None)
+    assert _refcount(blob_store, keys[0]) == 1
+    assert job_id in crud.get_queued_analysis_job_ids(db)
+
+def test_claim_is_exclusive(db, user):
+    crud.create_analysis_job(db, "claim-once", user.id, "test", {})
+
+    assert crud.claim_analysis_job(db, "claim-once") is not None
+    assert crud.claim_analysis_job(db, "claim-once") is None
+
+def test_only_jobs_without_a_recent_heartbeat_are_requeued(db, user):
+    for job_id in ("stale-job", "live-job"):
+        crud.create_analysis_job(db, job_id, user.id, "test", {})
+        crud.claim_analysis_job(db, job_id)
+    db.query(AnalysisJob).filter(AnalysisJob.job_id == "stale-job").update(
+        {"heartbeat_at": datetime.utcnow() - timedelta(hours=1)}, synchronize_session=False
+    )
+    db.commit()
+    crud.touch_analysis_job(db, "live-job")
+
+    assert crud.requeue_stale_analysis_jobs(db, 300) == ["stale-job"]
+    assert _job(db, "stale-job").status == "queued"
+    assert _job(db, "live-job").status == "running"
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+
+from services.blob_store import BlobStore
+
+def _refcount(store: BlobStore, key: str):
+    row = store._connect().execute("SELECT refcount FROM blobs WHERE hash = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _owner_refcount(store: BlobStore, owner: str, key: str) -> int:
+    row = store._connect().execute("SELECT refcount FROM blob_refs WHERE owner = ? AND hash = ?", (owner, key)).fetchone()
+    return row[0] if row else 0
+
+def test_same_content_is_stored_once_and_counted_per_owner(blob_store):
+    key = asyncio.run(blob_store.put("a CV"))
+    assert asyncio.run(blob_store.put("a CV", blob_store.process_owner)) == key
+
+    assert _refcount(blob_store, key) == 2
+    assert _owner_refcount(blob_store, BlobStore.SHARED_OWNER, key) == 1
+    assert _owner_refcount(blob_store, blob_store.process_owner, key) == 1
+
+def test_release_only_drops_the_owners_own_references(blob_store):
+    key = asyncio.run(blob_store.put("another CV"))
+
+    # Releasing as an owner that holds nothing must not steal the shared reference
+    blob_store.release([key], blob_store.process_owner)
+    assert _refcount(blob_store, key) == 1
+
+    blob_store.release([key])
+    assert _refcount(blob_store, key) == 0
+
+def test_garbage_collection_removes_unreferenced_blobs_only(blob_store):
+    kept = asyncio.run(blob_store.put("kept CV"))
+    dropped = asyncio.run(blob_store.put(b"%PDF-dropped"))
+    blob_store.release([dropped])
+
+    assert blob_store.collect_garbage() == 1
+    assert _refcount(blob_store, dropped) is None
+    assert not os.path.exists(blob_store._path(dropped, "pdf"))
+    assert asyncio.run(blob_store.get(kept)) == "kept CV"
+
+def test_references_of_a_stopped_process_are_reaped(tmp_path):
+    root = str(tmp_path / "shared-blobs")
+    stopped = BlobStore(root, 1024, -1, 3600, 600)
+    key = asyncio.run(stopped.put("in-memory session CV", stopped.process_owner))
+    # The process stopped sending heartbeats long ago
+    stopped._connect().execute("UPDATE blob_owners SET heartbeat_at = ?", (time.time() - 3600,))
+    stopped._connect().commit()
+
+    survivor = BlobStore(root, 1024, -1, 3600, 600)
+    assert survivor.reap_dead_owners() == 1
+    assert _refcount(survivor, key) == 0
+    assert survivor.collect_garbage() == 1
+
+def test_live_process_references_are_kept(tmp_path):
+    root = str(tmp_path / "live-blobs")
+    live = BlobStore(root, 1024, -1, 3600, 600)
+    key = asyncio.run(live.put("live session CV", live.process_owner))
+
+    assert BlobStore(root, 1024, -1, 3600, 600).reap_dead_owners() == 0
+    assert _refcount(live, key) == 1
+
+def test_cache_stays_within_its_byte_budget(tmp_path):
+    store = BlobStore(str(tmp_path / "small-cache"), 10, -1, 3600, 600)
+    first = asyncio.run(store.put("123456"))
+    second = asyncio.run(store.put("abcdef"))
+
+    assert store.cache_bytes <= 10
+    assert first not in store.cache and second in store.cache
+    # Evicted from memory, still served from disk
+    assert asyncio.run(store.get(first)) == "123456"
@@ -0,0 +1,36 @@
+import uuid
+
+import core.crud as crud
+from core.models import Message
+from services.ai_service import document_sessions
+
+def _document_chat_session(db, user_id: int) -> str:
+    """A chat session recorded for a document analysis whose document session is gone"""
+    session_id = str(uuid.uuid4())
+    with crud.unit_of_work(db):
+        crud.add_chat_session(db, session_id, user_id, "CV analysis", {"files": ["cv.pdf"]})
+    document_sessions.delete(session_id)
+    return session_id
+
+def test_chat_with_evicted_document_session_returns_404(client, db, user):
+    session_id = _document_chat_session(db, user.id)
+
+    response = client.post("/chat", data={"message": "What are the skills?", "session_id": session_id})
+
+    assert response.status_code == 404
+    assert "expired" in response.json()["detail"]
+    # The question is not saved when it cannot be answered from the documents
+    assert db.query(Message).filter(Message.user_id == user.id, Message.content == "What are the skills?").count() == 0
+
+def test_chat_stream_with_evicted_document_session_returns_404(client, db, user):
+    session_id = _document_chat_session(db, user.id)
+
+    response = client.post("/chat/stream", data={"message": "Summarize", "session_id": session_id})
+
+    assert response.status_code == 404
+
+def test_chat_without_document_session_still_answers(client, user):
+    response = client.post("/chat", data={"message": "Hello"})
+
+    assert response.status_code == 200
+    assert response.json()["has_document_context"] is False
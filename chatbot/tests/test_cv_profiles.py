@@ -0,0 +1,57 @@
+import asyncio
+
+from services.cv_profiles import answer_profile_query, cv_profile_store, load_profiles, parse_profile, parse_profile_query
+from services.file_cache import content_hash
+from services.document_service import analyze_documents_map_reduce
+
+CV_TEXT = "Jane Doe, project manager in Casablanca. Ten years of experience. Skills: Python, SAP."
+
+def test_free_text_answer_falls_back_to_notes_profile():
+    # The fake backend answers in free text, not profile JSON
+    profiles, failed_files = asyncio.run(load_profiles([CV_TEXT], [{"filename": "jane.pdf"}]))
+
+    assert failed_files == []
+    assert profiles[0]["notes_only"] is True
+    assert profiles[0]["summary"]
+    assert profiles[0]["skills"] == []
+    # Notes are not stored, so the next analysis tries the extraction again
+    assert cv_profile_store.get_many([content_hash(CV_TEXT)]) == {}
+
+def test_profile_query_over_notes_profiles_goes_to_the_model():
+    # A local filter would report "none match" for CVs it never evaluated
+    result = asyncio.run(answer_profile_query("knows Python", [CV_TEXT], [{"filename": "jane.pdf"}]))
+
+    assert result["method"] == "model"
+    assert result["matches"] == []
+    assert result["profiles_considered"] == 1
+    assert result["failed_files"] == []
+
+def test_map_reduce_runs_on_notes_profiles():
+    result = asyncio.run(analyze_documents_map_reduce(
+        [CV_TEXT, "John Smith, accountant in Rabat."],
+        [{"filename": "jane.pdf"}, {"filename": "john.pdf"}],
+        "Who is the most experienced?"
+    ))
+
+    assert result["response"]
+    assert result["failed_files"] == []
+
+def test_experience_in_a_location_is_not_a_skill_filter():
+    assert parse_profile_query("experience in Casablanca") is None
+    assert parse_profile_query("candidates with experience in Casablanca and at least 5 years") is None
+
+def test_experience_in_a_known_skill_is_a_skill_filter():
+    assert parse_profile_query("experience in Python") == [{"field": "skills", "op": "contains", "value": "python"}]
+    assert parse_profile_query("experience with Kubernetes") == [{"field": "skills", "op": "contains", "value": "kubernetes"}]
+    assert parse_profile_query("experience in real estate") == [{"field": "real_estate_experience", "op": "is", "value": True}]
+
+def test_profile_query_over_structured_profiles_is_answered_locally():
+    documents = ["Structured CV of Amal", "Structured CV of Omar"]
+    cv_profile_store.put(content_hash(documents[0]), parse_profile('{"name": "Amal", "skills": ["Python"], "years_of_experience": 6}'))
+    cv_profile_store.put(content_hash(documents[1]), parse_profile('{"name": "Omar", "skills": ["Excel"], "years_of_experience": 2}'))
+
+    result = asyncio.run(answer_profile_query("knows Python", documents, [{"filename": "amal.pdf"}, {"filename": "omar.pdf"}]))
+
+    assert result["method"] == "local"
+    assert [match["filename"] for match in result["matches"]] == ["amal.pdf"]
+    assert result["response"].startswith("1 of 2 candidate(s) match")
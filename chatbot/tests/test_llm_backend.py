@@ -0,0 +1,23 @@
+import pytest
+
+from services.llm_backend import FakeBackend, LLMBackend
+
+def test_backend_missing_a_method_cannot_be_created():
+    class StreamlessBackend(LLMBackend):
+        async def generate(self, contents, config):
+            return ""
+
+        async def upload_file(self, data, mime_type):
+            return "uri", "name"
+
+        async def create_cache(self, system_instruction, document_parts, ttl_seconds):
+            return "cache"
+
+        async def delete_cache(self, name):
+            pass
+
+    with pytest.raises(TypeError, match="generate_stream"):
+        StreamlessBackend()
+
+def test_fake_backend_implements_the_interface():
+    assert isinstance(FakeBackend(), LLMBackend)
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from core import models
+from core.migrations import MIGRATIONS, _add_columns, migration_lock, run_migrations
+
+def test_migrations_apply_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+
+    assert run_migrations(engine) == [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+
+def test_migration_is_idempotent_when_rerun(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rerun.db'}")
+    run_migrations(engine)
+    # A run interrupted before recording its version applies the migration again
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM schema_migrations WHERE version = 5"))
+
+    assert run_migrations(engine) == [5]
+
+def test_add_columns_upgrades_an_existing_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE analysis_jobs (id INTEGER PRIMARY KEY, job_id VARCHAR(36))"))
+        _add_columns(models.AnalysisJob, "heartbeat_at")(connection)
+
+    assert "heartbeat_at" in {column["name"] for column in inspect(engine).get_columns("analysis_jobs")}
+
+class _LockConnection:
+    def __init__(self, acquired: int):
+        self.acquired = acquired
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(str(statement).split("(")[0])
+        return SimpleNamespace(scalar=lambda: self.acquired)
+
+def _mysql_engine(connection):
+    return SimpleNamespace(dialect=SimpleNamespace(name="mysql"), connect=lambda: connection)
+
+def test_mysql_migrations_run_under_a_named_lock():
+    connection = _LockConnection(acquired=1)
+
+    with migration_lock(_mysql_engine(connection)):
+        assert connection.statements == ["SELECT GET_LOCK"]
+
+    assert connection.statements == ["SELECT GET_LOCK", "SELECT RELEASE_LOCK"]
+
+def test_mysql_migrations_fail_when_the_lock_times_out():
+    with pytest.raises(RuntimeError):
+        with migration_lock(_mysql_engine(_LockConnection(acquired=0))):
+            pass
@@ -0,0 +1,73 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+import core.crud as crud
+from core.models import ChatSession
+from core.pagination import MAX_PAGE_SIZE, InvalidCursorError, decode_cursor, encode_cursor, paginate
+
+def test_cursor_round_trip_keeps_datetimes():
+    values = [datetime(2026, 1, 2, 3, 4, 5, 678), 42]
+
+    assert decode_cursor(encode_cursor(values), 2) == values
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor([1]), encode_cursor([None, 1])])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, 2)
+
+def _sessions(db, user_id: int, count: int) -> str:
+    """``count`` sessions sharing one updated_at, so only the id breaks the ties; returns their title"""
+    title = f"page-{uuid.uuid4()}"
+    updated_at = datetime(2026, 5, 1, 12, 0, 0)
+    with crud.unit_of_work(db):
+        for _ in range(count):
+            db.add(ChatSession(session_id=str(uuid.uuid4()), user_id=user_id, title=title, updated_at=updated_at))
+    return title
+
+def test_cursor_pages_cover_every_row_once(db, user):
+    title = _sessions(db, user.id, 7)
+    query = db.query(ChatSession).filter(ChatSession.title == title)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        items, cursor = paginate(query, [ChatSession.updated_at, ChatSession.id], 3, cursor, descending=True)
+        seen.extend(item.id for item in items)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert seen == sorted(seen, reverse=True)
+    assert len(set(seen)) == 7
+
+def test_last_full_page_has_no_next_cursor(db, user):
+    title = _sessions(db, user.id, 4)
+    query = db.query(ChatSession).filter(ChatSession.title == title)
+
+    items, cursor = paginate(query, [ChatSession.updated_at, ChatSession.id], 4)
+
+    assert len(items) == 4
+    assert cursor is None
+
+@pytest.mark.parametrize("limit", [0, -1, MAX_PAGE_SIZE + 1])
+def test_out_of_range_limits_are_rejected(db, limit):
+    with pytest.raises(ValueError):
+        paginate(db.query(ChatSession), [ChatSession.updated_at, ChatSession.id], limit)
+
+def test_skip_cannot_be_combined_with_a_cursor(db):
+    cursor = encode_cursor([datetime(2026, 1, 1), 1])
+
+    with pytest.raises(InvalidCursorError):
+        paginate(db.query(ChatSession), [ChatSession.updated_at, ChatSession.id], 10, cursor, skip=5)
+
+def test_admin_users_validates_paging_parameters(client, admin, user):
+    assert client.get("/admin/users", params={"limit": 0}).status_code == 422
+    assert client.get("/admin/users", params={"limit": MAX_PAGE_SIZE + 1}).status_code == 422
+
+    first = client.get("/admin/users", params={"limit": 1})
+    assert first.status_code == 200
+    cursor = first.headers["X-Next-Cursor"]
+    assert client.get("/admin/users", params={"limit": 1, "cursor": cursor, "skip": 1}).status_code == 400
+    assert client.get("/admin/users", params={"limit": 1, "cursor": cursor}).status_code == 200
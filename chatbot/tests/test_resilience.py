@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from services.resilience import CircuitBreaker, ResilientCaller
+
+def _caller(max_retries: int = 2, attempt_timeout_ratio: float = 0.4) -> ResilientCaller:
+    return ResilientCaller(CircuitBreaker(10, 30), max_retries, 0.01, 0.01, attempt_timeout_ratio=attempt_timeout_ratio)
+
+def test_hung_attempt_times_out_and_is_retried():
+    caller = _caller()
+    attempts = []
+
+    async def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(10)  # Hangs past its share of the deadline
+        return "answer"
+
+    assert asyncio.run(caller.call(factory, 1.0)) == "answer"
+    assert len(attempts) == 2
+    assert caller.get_stats()["attempt_timeouts"] == 1
+
+def test_last_attempt_may_use_the_rest_of_the_deadline():
+    caller = _caller(max_retries=0)
+
+    async def factory():
+        await asyncio.sleep(0.3)  # Longer than 40% of the deadline
+        return "slow answer"
+
+    assert asyncio.run(caller.call(factory, 0.5)) == "slow answer"
+
+def test_deadline_exceeded_is_a_504():
+    caller = _caller()
+
+    async def factory():
+        await asyncio.sleep(10)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(caller.call(factory, 0.3))
+    assert error.value.status_code == 504
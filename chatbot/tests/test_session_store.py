@@ -0,0 +1,90 @@
+import pytest
+
+from services import session_store
+from services.session_store import InMemorySessionStore, SQLiteSessionStore
+
+class FakeClock:
+    """Stands in for the ``time`` module so recency and idle TTL are deterministic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(session_store, "time", fake)
+    return fake
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    """Build a store of the parametrized backend, recording what it evicts"""
+    evicted = []
+
+    def make(max_sessions=10, max_bytes=1024 * 1024, idle_ttl_seconds=3600):
+        on_evict = lambda session_id, data: evicted.append(session_id)
+        if request.param == "sqlite":
+            return SQLiteSessionStore(str(tmp_path / "sessions.db"), max_sessions, max_bytes, idle_ttl_seconds, on_evict)
+        return InMemorySessionStore(max_sessions, max_bytes, idle_ttl_seconds, on_evict)
+
+    make.evicted = evicted
+    return make
+
+def test_least_recently_used_session_is_evicted(make_store, clock):
+    store = make_store(max_sessions=2)
+    store.set("a", {"user_id": 1})
+    clock.advance(1)
+    store.set("b", {"user_id": 1})
+    clock.advance(1)
+    # Reading "a" makes "b" the least recently used
+    assert store.get("a") == {"user_id": 1}
+    clock.advance(1)
+    store.set("c", {"user_id": 1})
+
+    assert make_store.evicted == ["b"]
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.get_stats()["evictions"] == 1
+
+def test_byte_cap_evicts_others_but_keeps_the_session_just_written(make_store, clock):
+    store = make_store(max_bytes=100)
+    store.set("small", {"text": "x"})
+    clock.advance(1)
+    store.set("large", {"text": "y" * 200})
+
+    assert make_store.evicted == ["small"]
+    assert store.get("large") == {"text": "y" * 200}
+    assert store.get_stats()["sessions"] == 1
+
+def test_idle_sessions_expire(make_store, clock):
+    store = make_store(idle_ttl_seconds=60)
+    store.set("idle", {"user_id": 1})
+    clock.advance(30)
+    store.set("active", {"user_id": 1})
+    clock.advance(31)
+
+    assert store.get("idle") is None
+    assert store.get("active") == {"user_id": 1}
+    assert make_store.evicted == ["idle"]
+    assert store.get_stats()["expirations"] == 1
+
+def test_delete_returns_the_session_without_reporting_an_eviction(make_store, clock):
+    store = make_store()
+    store.set("a", {"user_id": 7, "document_hashes": ["h"]})
+
+    assert store.delete("a") == {"user_id": 7, "document_hashes": ["h"]}
+    assert store.delete("a") is None
+    assert "a" not in store
+    assert make_store.evicted == []
+
+def test_sessions_are_listed_per_user(make_store, clock):
+    store = make_store()
+    store.set("a", {"user_id": 1})
+    store.set("b", {"user_id": 2})
+    store.set("c", {"user_id": 1})
+
+    assert sorted(store.session_ids_for_user(1)) == ["a", "c"]
@@ -0,0 +1,19 @@
+import asyncio
+
+from config.settings import GEMINI_MAX_CONCURRENT_REQUESTS
+from services.ai_service import gemini_semaphore, stream_content
+
+def test_paused_stream_does_not_hold_a_concurrency_permit():
+    async def run():
+        stream = stream_content(["Hello"], "Be brief.")
+        first_chunk = await stream.__anext__()
+        # The client has not read further: the permit is already back for other calls
+        free_permits = gemini_semaphore._value
+        rest = [chunk async for chunk in stream]
+        return first_chunk, free_permits, rest
+
+    first_chunk, free_permits, rest = asyncio.run(run())
+
+    assert first_chunk
+    assert rest
+    assert free_permits == GEMINI_MAX_CONCURRENT_REQUESTS
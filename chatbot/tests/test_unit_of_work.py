@@ -0,0 +1,38 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import inspect
+
+import core.crud as crud
+from core.models import ChatSession, Message
+from core.schemas import MessageCreate
+
+def test_http_exception_rolls_back_the_whole_unit(db, user):
+    session_id = str(uuid.uuid4())
+
+    with pytest.raises(HTTPException):
+        with crud.unit_of_work(db):
+            chat_session = crud.add_chat_session(db, session_id, user.id, "Doomed")
+            crud.add_message(db, MessageCreate(content="Never saved", message_type="user"), user.id, chat_session)
+            db.flush()
+            raise HTTPException(status_code=404, detail="Document session expired")
+
+    assert db.query(ChatSession).filter(ChatSession.session_id == session_id).count() == 0
+    assert db.query(Message).filter(Message.content == "Never saved").count() == 0
+
+def test_unit_commits_and_keeps_objects_loaded(db, user):
+    session_id = str(uuid.uuid4())
+
+    with crud.unit_of_work(db):
+        chat_session = crud.add_chat_session(db, session_id, user.id, "Kept")
+        message = crud.add_message(db, MessageCreate(content="Saved", message_type="user"), user.id, chat_session)
+
+    # Reading the new ids after the commit needs no refresh query
+    assert not inspect(chat_session).expired_attributes
+    assert not inspect(message).expired_attributes
+    assert message.session_id == chat_session.id
+    assert db.expire_on_commit is True
+
+    db.expire_all()
+    assert db.query(ChatSession).filter(ChatSession.session_id == session_id).one().title == "Kept"